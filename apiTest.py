@@ -1,7 +1,10 @@
 import pytest
 import requests
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import logging
+import time
+import gzip
+import json
 import http.client as http_client
 
 http_client.HTTPConnection.debuglevel = 1
@@ -13,6 +16,7 @@ requests_log.propagate = True
 
 BASE_URL = "http://localhost:5000"
 TEST_USER = {"email": "john.doe@example.com", "password": "password"}
+SALE_PARTY_ID = "60b2b3b9d9c1b6f5f7e8f7b4"
 
 @pytest.fixture
 def auth_token():
@@ -21,11 +25,35 @@ def auth_token():
     assert response.status_code == 200
     return response.json()["token"]
 
+@pytest.fixture
+def product_id(auth_token):
+    """Fixture creating a product priced 2.0 with 5 units in stock, deleted after the test"""
+    headers = {"X-Access-Token": auth_token}
+    name = f"Sale Product {datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+    product_data = {"name": name, "description": "Sale", "category": "Sale", "price": 2.0, "status": "Available", "quantity": 5}
+    response = requests.post(f"{BASE_URL}/product", headers=headers, json=product_data)
+    assert response.status_code == 201
+    products = requests.get(f"{BASE_URL}/product", headers=headers).json()
+    product_id = next(product["_id"]["$oid"] for product in products if product["name"] == name)
+    yield product_id
+    requests.delete(f"{BASE_URL}/product/{product_id}", headers=headers)
+
+def sale_of(product_id, *quantities):
+    """Sale of the given quantities of a product, one line each, dated now by the server"""
+    return {
+        "id_seller": SALE_PARTY_ID,
+        "id_client": SALE_PARTY_ID,
+        "products": [{"idProducto": product_id, "quantity": quantity} for quantity in quantities]
+    }
+
 def test_login():
     """Test login endpoint"""
     response = requests.post(f"{BASE_URL}/login", json=TEST_USER)
     assert response.status_code == 200
     assert "token" in response.json()
+    assert response.json()["role"] == "admin"
+    assert response.json()["profile"]["email"] == TEST_USER["email"]
+    assert "password" not in response.json()["profile"]
 
 def test_product_operations(auth_token):
     """Test product CRUD operations"""
@@ -43,6 +71,10 @@ def test_product_operations(auth_token):
     response = requests.post(f"{BASE_URL}/product", headers=headers, json=product_data)
     assert response.status_code == 201
     
+    # Test POST with a name already taken
+    response = requests.post(f"{BASE_URL}/product", headers=headers, json=product_data)
+    assert response.status_code == 409
+    
     # Test GET all
     response = requests.get(f"{BASE_URL}/product", headers=headers)
     assert response.status_code == 200
@@ -58,10 +90,72 @@ def test_product_operations(auth_token):
     response = requests.put(f"{BASE_URL}/product/{product_id}", headers=headers, json=product_data)
     assert response.status_code == 200
     
+    # Test PUT of a single field, the others keep their values
+    response = requests.put(f"{BASE_URL}/product/{product_id}", headers=headers, json={"price": 50.0})
+    assert response.status_code == 200
+    product = requests.get(f"{BASE_URL}/product/{product_id}", headers=headers).json()
+    assert product["price"] == 50.0 and product["name"] == "Updated Product" and product["quantity"] == 10
+    
     # Test DELETE
     response = requests.delete(f"{BASE_URL}/product/{product_id}", headers=headers)
     assert response.status_code == 200
 
+def test_product_pagination(auth_token):
+    """Test keyset pagination of the product list"""
+    headers = {"X-Access-Token": auth_token}
+    response = requests.get(f"{BASE_URL}/product", headers=headers, params={"limit": 1, "sort": "name"})
+    assert response.status_code == 200
+    page = response.json()
+    assert len(page["items"]) <= 1
+    if page["next"] is not None:
+        response = requests.get(f"{BASE_URL}/product", headers=headers, params={"limit": 1, "sort": "name", "after": page["next"]})
+        assert response.status_code == 200
+        assert response.json()["items"][0]["_id"] != page["items"][0]["_id"]
+    
+    # cursors are tied to their sort field
+    if page["next"] is not None:
+        response = requests.get(f"{BASE_URL}/product", headers=headers, params={"limit": 1, "sort": "price", "after": page["next"]})
+        assert response.status_code == 400
+
+def test_product_search(auth_token):
+    """Test product search filters"""
+    headers = {"X-Access-Token": auth_token}
+    response = requests.get(f"{BASE_URL}/product/search", headers=headers, params={"status": "Available", "minPrice": 1, "maxPrice": 1000, "limit": 5})
+    assert response.status_code == 200
+    page = response.json()
+    assert len(page["items"]) <= 5
+    assert all(item["status"] == "Available" and 1 <= item["price"] <= 1000 for item in page["items"])
+    response = requests.get(f"{BASE_URL}/product/search", headers=headers, params={"minPrice": "cheap"})
+    assert response.status_code == 400
+
+def test_product_conditional_get(auth_token):
+    """Test ETag based conditional GET of the product list"""
+    headers = {"X-Access-Token": auth_token}
+    response = requests.get(f"{BASE_URL}/product", headers=headers)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    response = requests.get(f"{BASE_URL}/product", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+def test_product_bulk_import(auth_token):
+    """Test bulk product import with per item results"""
+    headers = {"X-Access-Token": auth_token}
+    suffix = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    products = [
+        {"name": f"Bulk Product {suffix}", "description": "Bulk", "category": "Bulk", "price": 1.5, "status": "Available", "quantity": 3},
+        {"name": f"Bulk Product {suffix}", "description": "Duplicate", "category": "Bulk", "price": 1.5, "status": "Available", "quantity": 3},
+        {"name": "Missing fields"}
+    ]
+    response = requests.post(f"{BASE_URL}/product/bulk", headers=headers, json=products)
+    assert response.status_code == 200
+    result = response.json()
+    assert result["created"] == 1
+    assert [item["status"] for item in result["results"]] == ["created", "error", "error"]
+    response = requests.get(f"{BASE_URL}/product/suggest", headers=headers, params={"q": f"bulk product {suffix}"})
+    assert response.status_code == 200
+    assert [item["name"] for item in response.json()] == [f"Bulk Product {suffix}"]
+
 def test_provider_operations(auth_token):
     """Test provider CRUD operations"""
     headers = {"X-Access-Token": auth_token}
@@ -93,18 +187,12 @@ def test_provider_operations(auth_token):
     response = requests.delete(f"{BASE_URL}/provider/{provider_id}", headers=headers)
     assert response.status_code == 200
 
-def test_sale_operations(auth_token):
+def test_sale_operations(auth_token, product_id):
     """Test sale operations"""
     headers = {"X-Access-Token": auth_token}
     
     # Test POST
-    sale_data = {
-        "id_seller": "test_seller",
-        "id_client": "test_client",
-        "products": [{"idProducto": "672312212da7ae7986157674", "quantity": 5}, {"idProducto": "672312222da7ae7986157675", "quantity": 3}],
-        "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-    response = requests.post(f"{BASE_URL}/sale", headers=headers, json=sale_data)
+    response = requests.post(f"{BASE_URL}/sale", headers=headers, json=sale_of(product_id, 2, 3))
     assert response.status_code == 201
     
     # Test GET all
@@ -112,8 +200,8 @@ def test_sale_operations(auth_token):
     assert response.status_code == 200
     
     # Test GET by date
-    date_lo = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
-    date_hi = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+    date_lo = (datetime.now(timezone.utc) - timedelta(days=1)).strftime("%Y-%m-%d")
+    date_hi = (datetime.now(timezone.utc) + timedelta(days=1)).strftime("%Y-%m-%d")
     response = requests.get(
         f"{BASE_URL}/sale/date",
         headers=headers,
@@ -121,6 +209,117 @@ def test_sale_operations(auth_token):
     )
     assert response.status_code == 200
 
+def test_sale_batch(auth_token, product_id):
+    """Test a batch of sales accepted in part, with per sale results"""
+    headers = {"X-Access-Token": auth_token}
+    sales = [
+        sale_of(product_id, 3),
+        sale_of(product_id, 3),
+        {**sale_of(product_id, 1), "id_seller": "not an id"},
+        "not a sale",
+        sale_of(product_id, 1)
+    ]
+    response = requests.post(f"{BASE_URL}/sale/batch", headers=headers, json=sales)
+    assert response.status_code == 200
+    result = response.json()
+    assert result["created"] == 2 and result["failed"] == 3
+    assert [item["status"] for item in result["results"]] == ["created", "error", "error", "error", "created"]
+    assert "Insufficient stock" in result["results"][1]["error"]
+    assert result["results"][4]["total"] == 2.0
+    assert requests.get(f"{BASE_URL}/product/{product_id}", headers=headers).json()["quantity"] == 1
+
+    # Test NDJSON input, one sale per line
+    body = "\n".join(json.dumps(sale) for sale in [sale_of(product_id, 1), {"products": []}]) + "\n"
+    response = requests.post(f"{BASE_URL}/sale/batch", headers={**headers, "Content-Type": "application/x-ndjson"}, data=body)
+    assert response.status_code == 200
+    assert [item["status"] for item in response.json()["results"]] == ["created", "error"]
+    assert requests.get(f"{BASE_URL}/product/{product_id}", headers=headers).json()["quantity"] == 0
+    response = requests.post(f"{BASE_URL}/sale/batch", headers=headers, json={"not": "a list"})
+    assert response.status_code == 400
+
+def test_sale_insufficient_stock(auth_token, product_id):
+    """Test that a sale exceeding the stock is rejected without touching it"""
+    headers = {"X-Access-Token": auth_token}
+    response = requests.post(f"{BASE_URL}/sale", headers=headers, json=sale_of(product_id, 6))
+    assert response.status_code == 409
+    sale_data = sale_of(product_id, 5)
+    response = requests.post(f"{BASE_URL}/sale", headers=headers, json=sale_data)
+    assert response.status_code == 201
+    response = requests.get(f"{BASE_URL}/product/{product_id}", headers=headers)
+    assert response.json()["quantity"] == 0
+    
+    # Test the sale is found by product and by seller
+    response = requests.get(f"{BASE_URL}/sale/product/{product_id}", headers=headers)
+    assert response.status_code == 200
+    assert len(response.json()["items"]) == 1
+    response = requests.get(f"{BASE_URL}/sale/seller/{sale_data['id_seller']}", headers=headers, params={"dateLo": datetime.now(timezone.utc).strftime("%Y-%m-%d"), "limit": 1})
+    assert response.status_code == 200
+    assert response.json()["items"][0]["products"][0]["idProducto"]["$oid"] == product_id
+
+def test_sale_idempotency_key(auth_token, product_id):
+    """Test that a retried sale with the same Idempotency-Key is replayed instead of recorded twice"""
+    headers = {"X-Access-Token": auth_token, "Idempotency-Key": f"test-{datetime.now().strftime('%Y%m%d%H%M%S%f')}"}
+    sale_data = sale_of(product_id, 1)
+    response = requests.post(f"{BASE_URL}/sale", headers=headers, json=sale_data)
+    assert response.status_code == 201
+    replay = requests.post(f"{BASE_URL}/sale", headers=headers, json=sale_data)
+    assert replay.status_code == 201
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.json() == response.json()
+    assert requests.get(f"{BASE_URL}/product/{product_id}", headers=headers).json()["quantity"] == 4
+    sale_data["products"][0]["quantity"] = 2
+    response = requests.post(f"{BASE_URL}/sale", headers=headers, json=sale_data)
+    assert response.status_code == 422
+
+def test_sale_streaming(auth_token):
+    """Test streamed sale listings match the regular one"""
+    headers = {"X-Access-Token": auth_token}
+    sales = requests.get(f"{BASE_URL}/sale", headers=headers).json()
+    response = requests.get(f"{BASE_URL}/sale", headers={**headers, "Accept": "application/x-ndjson"}, params={"batch_size": 10}, stream=True)
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("application/x-ndjson")
+    assert len([line for line in response.iter_lines() if line]) == len(sales)
+    response = requests.get(f"{BASE_URL}/sale", headers=headers, params={"stream": "true"})
+    assert response.json() == sales
+
+def test_sale_stats(auth_token, product_id):
+    """Test sales stats from the sales and from the daily rollup"""
+    headers = {"X-Access-Token": auth_token}
+    response = requests.post(f"{BASE_URL}/sale", headers=headers, json=sale_of(product_id, 2, 3))
+    assert response.status_code == 201
+    # the sale is dated now in UTC, the rollup days are UTC days
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    for source in ["sales", "rollup"]:
+        response = requests.get(f"{BASE_URL}/sale/stats/period", headers=headers, params={"dateLo": today, "dateHi": today, "source": source})
+        assert response.status_code == 200
+        periods = response.json()
+        assert len(periods) == 1
+        assert periods[0]["sales"] >= 1 and periods[0]["total"] >= 10.0
+        response = requests.get(f"{BASE_URL}/sale/stats/product", headers=headers, params={"dateLo": today, "dateHi": today, "source": source})
+        assert response.status_code == 200
+        row = next(row for row in response.json() if row["product"]["$oid"] == product_id)
+        assert row["quantity"] == 5 and row["revenue"] == 10.0 and row["sales"] == 1
+    response = requests.get(f"{BASE_URL}/sale/stats/seller", headers=headers, params={"source": "unknown"})
+    assert response.status_code == 400
+    response = requests.get(f"{BASE_URL}/sale/stats/period", headers=headers, params={"timezone": "Mars/Base"})
+    assert response.status_code == 400
+
+def test_sale_export(auth_token):
+    """Test a background sales export to gzip CSV"""
+    headers = {"X-Access-Token": auth_token}
+    response = requests.post(f"{BASE_URL}/sale/export", headers=headers, params={"format": "csv"})
+    assert response.status_code == 202
+    job_url = f"{BASE_URL}{response.headers['Location']}"
+    for _ in range(100):
+        job = requests.get(job_url, headers=headers).json()
+        if job["status"] != "running":
+            break
+        time.sleep(0.1)
+    assert job["status"] == "done"
+    response = requests.get(f"{BASE_URL}{job['download']}", headers=headers)
+    assert response.status_code == 200
+    assert len(gzip.decompress(response.content).decode().splitlines()) == job["rows"] + 1
+
 def test_user_operations(auth_token):
     """Test user CRUD operations"""
     headers = {"X-Access-Token": auth_token}
@@ -0,0 +1,119 @@
+"""
+Helpers of the bulk import endpoints (POST /product/bulk, /user/bulk, /provider/bulk).
+
+Records are read from a JSON array or an NDJSON stream, validated and written chunk by chunk with unordered
+insert_many, and every record gets its own result:
+    { "index": 0, "status": "created", "_id": "..." }
+    { "index": 1, "status": "error", "error": "..." }
+"""
+
+import json
+from itertools import islice
+from typing import Callable, Iterable, Iterator
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+CHUNK_SIZE = 1000
+# code of the write errors raised by unique indexes
+DUPLICATE_KEY = 11000
+
+class InvalidRecord:
+    """
+    Placeholder for a record that could not even be parsed, carrying the reason.
+    """
+    def __init__(self, error: str) -> None:
+        self.error = error
+
+def iterNdjson(stream: Iterable[bytes]) -> Iterator[dict | InvalidRecord]:
+    """
+    Yields the records of an NDJSON stream one line at a time, without reading the whole body in memory.
+    """
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield InvalidRecord(f'Invalid JSON: {e}')
+
+def chunked(records: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(records)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+def validate(chunk: list, model) -> tuple[list, list[dict]]:
+    """
+    Builds model instances from a chunk of records with model.bulk_from_dict.
+
+    Returns:
+        tuple[list, list[dict]]: One instance (or None) per record, and the results of the records that are invalid.
+    """
+    if all(isinstance(record, dict) for record in chunk):
+        try:
+            return model.bulk_from_dict(chunk), []
+        except TypeError:
+            pass
+    # at least one record is invalid, validate them one by one to find which
+    items, errors = [], []
+    for index, record in enumerate(chunk):
+        if isinstance(record, InvalidRecord):
+            error = record.error
+        elif not isinstance(record, dict):
+            error = 'Record must be a JSON object'
+        else:
+            try:
+                items.append(model.bulk_from_dict([record])[0])
+                continue
+            except TypeError as e:
+                error = f'Invalid fields: {e}'
+        items.append(None)
+        errors.append({'index': index, 'status': 'error', 'error': error})
+    return items, errors
+
+def insertMany(collection: Collection, documents: list[dict], duplicateError: str = None) -> list[dict]:
+    """
+    Inserts documents with a single unordered insert_many and returns one result per document.
+    Documents rejected by a unique index are reported with duplicateError when given.
+    """
+    if not documents:
+        return []
+    errors = {}
+    try:
+        collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        errors = {
+            error['index']: duplicateError if duplicateError and error.get('code') == DUPLICATE_KEY else error.get('errmsg', 'Write error')
+            for error in e.details['writeErrors']
+        }
+    return [
+        {'status': 'error', 'error': errors[index]} if index in errors else {'status': 'created', '_id': str(document['_id'])}
+        for index, document in enumerate(documents)
+    ]
+
+def importRecords(records: Iterable, model, insert: Callable[[list], list[dict]], chunkSize: int = CHUNK_SIZE) -> dict:
+    """
+    Validates and inserts records chunk by chunk.
+
+    Args:
+        records (Iterable): Parsed records (dicts), possibly streamed.
+        model: Class with a bulk_from_dict static method (Product, User, Provider).
+        insert (Callable): Handler method inserting a list of model instances and returning one result per instance.
+        chunkSize (int, optional): Number of records validated and written at once. Defaults to CHUNK_SIZE.
+
+    Returns:
+        dict: { "created": n, "failed": n, "results": [...] } with the results ordered by record index.
+    """
+    results = []
+    offset = 0
+    for chunk in chunked(records, chunkSize):
+        items, errors = validate(chunk, model)
+        valid = [(index, item) for index, item in enumerate(items) if item is not None]
+        inserted = insert([item for _, item in valid])
+        chunkResults = errors + [{'index': index, **result} for (index, _), result in zip(valid, inserted)]
+        for result in sorted(chunkResults, key=lambda result: result['index']):
+            result['index'] += offset
+            results.append(result)
+        offset += len(chunk)
+    created = sum(1 for result in results if result['status'] == 'created')
+    return {'created': created, 'failed': len(results) - created, 'results': results}
@@ -0,0 +1,47 @@
+import datetime
+import threading
+import time
+from pymongo import MongoClient, ReturnDocument
+
+class CollectionVersion:
+    """
+    Shared version counters of collections, kept in the 'versions' collection ({_id: name, version, modified}).
+
+    Handlers bump the counter of a collection on every write, so every API worker can tell whether the data it
+    serves changed without querying or serializing it (ETags, catalog invalidation). Reads are cached for maxAge
+    seconds to keep them off the request path.
+    """
+    def __init__(self, connection: MongoClient, db: str, maxAge: float = 1.0) -> None:
+        self.connection = connection
+        self.db = db
+        self.maxAge = maxAge
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def bump(self, name: str) -> int:
+        """
+        Increments the version of the collection name and returns the new version.
+        """
+        modified = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None, microsecond=0)
+        result = self.connection[self.db].versions.find_one_and_update(
+            {'_id': name},
+            {'$inc': {'version': 1}, '$set': {'modified': modified}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        with self._lock:
+            self._cache[name] = (result['version'], result['modified'], time.monotonic())
+        return result['version']
+
+    def get(self, name: str) -> tuple[int, datetime.datetime | None]:
+        """
+        Returns the version of the collection name and when it last changed (naive UTC, None if it never did).
+        """
+        with self._lock:
+            cached = self._cache.get(name)
+        if cached is not None and time.monotonic() - cached[2] <= self.maxAge:
+            return cached[0], cached[1]
+        result = self.connection[self.db].versions.find_one({'_id': name}) or {'version': 0, 'modified': None}
+        with self._lock:
+            self._cache[name] = (result['version'], result['modified'], time.monotonic())
+        return result['version'], result['modified']
@@ -1,10 +1,3 @@
-from dash import Dash, html, dash_table, dcc
-import pandas as pd
-import plotly.express as px
-from secret import Secret
-from pymongo import MongoClient
-import sys
-
 """
 This script creates a Dash app that displays a table with the sales data and the products of the providers from the database.
 
@@ -31,137 +24,47 @@ This script creates a Dash app that displays a table with the sales data and the
 ```
 
 # Graphs
-- pie chart with most sold products -> requieres a function that returns a dataframe with the products and the quantity sold
-- bar chart with sales per day -> requieres a function that returns a dataframe with the date and the total sales
-- bar chart with sales per seller -> requieres a function that returns a dataframe with the seller and the total sales
+Every graph is built from rows aggregated by MongoDB (see SalesStats and statsRetrieveData).
+- pie chart with most sold products -> SalesStats.byProduct
+- bar chart with sales per seller -> SalesStats.bySeller
 - bar chart with sales per provider (Not yet)*
-- bar chart with sales per week -> requieres a function that returns a dataframe with the week and the total sales
-- bar chart with sales per month -> requieres a function that returns a dataframe with the month and the total sales
+- bar chart with sales per week -> SalesStats.byPeriod by week
+- bar chart with sales per month -> SalesStats.byPeriod by month
 
 """
 
-def enhancedRetrieveData(secret: Secret) -> pd.DataFrame:
-    mongo = MongoClient(secret.uri)
-    db = mongo[secret.dbName]
-    
-    # Retrieve all sales
-    sales = list(db.sales.find())
-    
-    # Retrieve all users and products in bulk
-    user_ids = {sale['id_seller'] for sale in sales}.union({sale['id_client'] for sale in sales})
-    product_ids = {product['idProducto'] for sale in sales for product in sale['products']}
-    
-    users = {user['_id']: user for user in db.users.find({'_id': {'$in': list(user_ids)}})}
-    products = {product['_id']: product for product in db.products.find({'_id': {'$in': list(product_ids)}})}
-    
-    # Process sales data
-    salesResult = [
-        {
-            'seller': users[sale['id_seller']]['name'],
-            'client': users[sale['id_client']]['name'],
-            'products': [{'idProducto': products[product['idProducto']]['name'], 'quantity': product['quantity']} for product in sale['products']],
-            'date': sale['date'],
-            'total': sale['total']
-        }
-        for sale in sales
-    ]
-    
-    return pd.DataFrame(salesResult)
-
-def retrieveData(secret: Secret) -> pd.DataFrame:
-    mongo = MongoClient(secret.uri)
-    db = mongo[secret.dbName]
-    sales = db.sales.find()
-    # replace id_seller and id_client and idProducto with the actual names
-    
-    salesResult = []
-    for sale in sales:
-        sellerInfo = db.users.find_one({'_id': sale['id_seller']})
-        clientInfo = db.users.find_one({'_id': sale['id_client']})
-        productsList = []
-        for product in sale['products']:
-            productInfo = db.products.find_one({'_id': product['idProducto']})
-            productsList.append({'idProducto': productInfo['name'], 'quantity': product['quantity']})
-        salesResult.append({'seller': sellerInfo['name'], 'client': clientInfo['name'], 'products': productsList, 'date': sale['date'], 'total': sale['total']})
-    return pd.DataFrame(salesResult)    
-
-def getProductsSales(df: pd.DataFrame) -> pd.DataFrame:
-    products = []
-    for products_list in df['products']:
-        for product in products_list:
-            products.append({'product': product['idProducto'], 'quantity': product['quantity']})
-    
-    result = {}
-    for product in products:
-        if product['product'] in result:
-            result[product['product']] += product['quantity']
-        else:
-            result[product['product']] = product['quantity']
-    
-    return pd.DataFrame(result.items(), columns=['products', 'quantity'])         
-
-def getSalesPerDay(df: pd.DataFrame) -> pd.DataFrame:
-    salesPerDay = df.groupby('date').sum()['total']
-    return salesPerDay.reset_index()
-
-def getSalesPerWeek(df: pd.DataFrame) -> pd.DataFrame:
-    #convert date column to datetime
-    df['date'] = pd.to_datetime(df['date'])
-    #generate week column from date
-    df['week'] = df['date'].dt.isocalendar().week
-    #generate year column from date
-    df['year'] = df['date'].dt.isocalendar().year
-    #drop all entries from a year that is not the current year
-    df = df[df['year'] == pd.Timestamp.now().year]
-    df = df.drop(columns=['year'])
-    df = df.drop(columns=['seller'])
-    df = df.drop(columns=['client'])
-    df = df.drop(columns=['products'])
-    df = df.drop(columns=['date'])
-    result = {}
-    for entry in df.to_dict('records'):
-        if str(entry['week']) in result:
-            result[entry['week']] += entry['total']
-        else:
-            result[entry['week']] = entry['total']
-    return pd.DataFrame(result.items(), columns=['week', 'total']).sort_values(by='week')
-
-def getSalesPerMonth(df: pd.DataFrame) -> pd.DataFrame:
-    #generate month column from date
-    df['month'] = df['date'].dt.month
-    #generate year column from date
-    df['year'] = df['date'].dt.year
-    #drop all entries from a year that is not the current year
-    df = df[df['year'] == pd.Timestamp.now().year]
-    df = df.drop(columns=['year'])
-    df = df.drop(columns=['seller'])
-    df = df.drop(columns=['client'])
-    df = df.drop(columns=['products'])
-    df = df.drop(columns=['date'])
-    result = {}
-    for entry in df.to_dict('records'):
-        if str(entry['month']) in result:
-            result[entry['month']] += entry['total']
-        else:
-            result[entry['month']] = entry['total']
-    return pd.DataFrame(result.items(), columns=['month', 'total']).sort_values(by='month')
-
-def getSalesPerSeller(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.drop(columns=['date'])
-    salesPerSeller = df.groupby('seller').sum()['total']
-    return salesPerSeller.reset_index()
+from dash import Dash, html, dash_table, dcc
+import pandas as pd
+import plotly.express as px
+from secret import Secret
+from salesStats import SalesStats
+import datetime
+import sys
 
+def statsRetrieveData(secret: Secret) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Builds the dataframes of the graphs from aggregations computed by MongoDB (see SalesStats), so only the
+    aggregated rows are downloaded instead of every sale.
+
+    Returns:
+        tuple: Products sold (products, quantity), sales per week and per month of the current year (week / month, total) and sales per seller (seller, total).
+    """
+    stats = SalesStats(secret.dbName, uri=secret.uri, source=secret.stats_source)
+    yearStart = datetime.datetime(datetime.datetime.now().year, 1, 1)
+    dfSales = pd.DataFrame([{'products': row['name'], 'quantity': row['quantity']} for row in stats.byProduct()], columns=['products', 'quantity'])
+    # weeks are ISO weeks, numbered by the year their monday belongs to like isocalendar does
+    weeks = [row for row in stats.byPeriod('week', yearStart - datetime.timedelta(days=6)) if row['period'].isocalendar().year == yearStart.year]
+    dfWeek = pd.DataFrame([{'week': row['period'].isocalendar().week, 'total': row['total']} for row in weeks], columns=['week', 'total'])
+    dfMonth = pd.DataFrame([{'month': row['period'].month, 'total': row['total']} for row in stats.byPeriod('month', yearStart)], columns=['month', 'total'])
+    dfSeller = pd.DataFrame([{'seller': row['name'], 'total': row['total']} for row in stats.bySeller()], columns=['seller', 'total'])
+    return dfSales, dfWeek, dfMonth, dfSeller
 
 # Load data
 
 if __name__ == '__main__':
     secret = Secret()
     print('Retrieving data...')
-    df = enhancedRetrieveData(secret)
-    dfSales = getProductsSales(df)
-    dfWeek = getSalesPerWeek(df)
-    dfMonth = getSalesPerMonth(df)
-    dfSeller = getSalesPerSeller(df)
+    dfSales, dfWeek, dfMonth, dfSeller = statsRetrieveData(secret)
 
 # Create Dash app
 app = Dash(__name__)
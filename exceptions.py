@@ -21,4 +21,34 @@ class ProviderNotFoundException(Exception):
 class UserNotFoundException(Exception):
     def __init__(self, message):
         self.message = message
-        super().__init__(self.message)
\ No newline at end of file
+        super().__init__(self.message)
+        
+class PasswordHasherBusyException(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+class InvalidCursorException(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+class InsufficientStockException(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+class ExportNotFoundException(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+class IdempotencyKeyReusedException(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+class IdempotencyKeyInProgressException(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
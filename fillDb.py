@@ -52,7 +52,7 @@ def create_test_data() -> None:
 
     # Create test sales
     sales = [
-        Sale(id_seller=1, id_client=2, products=[{'idProducto': products[0]._id, 'quantity': 5}, {'idProducto': products[1]._id, 'quantity': 10}], date=datetime.datetime.now().isoformat())
+        Sale(id_seller=1, id_client=2, products=[{'idProducto': products[0]._id, 'quantity': 5}, {'idProducto': products[1]._id, 'quantity': 10}], date=datetime.datetime.now(datetime.timezone.utc).isoformat())
     ]
     for sale in sales:
         sale_handler.makeSale(sale.id_seller, sale.id_client, sale.products, sale.date)
@@ -0,0 +1,110 @@
+"""
+Idempotency keys for requests that must not be applied twice, such as POST /sale retried by a terminal after a timeout.
+
+Each key is stored in the 'idempotency_keys' collection under a unique _id (scope and key, the scope being the
+user sending it), with a hash of the request and an expiry removed by a TTL index. The first request claims the
+key by inserting it, a concurrent duplicate fails on the unique _id. Once the request succeeds its response is
+saved with the key and kept in an in-process cache, so replays are answered with the original response without
+running the request again. Failed requests release their key, so they can be retried.
+"""
+
+import datetime
+import hashlib
+import json
+from pymongo import MongoClient, IndexModel, ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from exceptions import IdempotencyKeyInProgressException, IdempotencyKeyReusedException
+from ttlCache import TTLCache
+from utcTime import utcnow
+
+class IdempotencyStore:
+    """
+    Claims, completes and replays idempotency keys.
+
+    Attributes:
+        ttl (int): Seconds a key and its response are kept.
+        lockTimeout (int): Seconds after which a key claimed by a request that never finished (e.g. the server stopped)
+            can be claimed again.
+    """
+    INDEXES = [IndexModel([('expiresAt', ASCENDING)], name='ttl_expiry', expireAfterSeconds=0)]
+    MAX_KEY_LENGTH = 255
+
+    def __init__(self, connection: MongoClient, db: str, ttl: int = 86400, lockTimeout: int = 60, cacheSize: int = 1024) -> None:
+        self.collection = connection[db].idempotency_keys
+        self.ttl = ttl
+        self.lockTimeout = lockTimeout
+        # expiresAt is naive UTC like the TTL index compares against, the cache checks it on the same clock
+        self.cache = TTLCache(cacheSize, clock=utcnow)
+
+    @staticmethod
+    def requestHash(body) -> str:
+        return hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def begin(self, scope: str, key: str, requestHash: str) -> dict | None:
+        """
+        Claims key for a request, or returns the saved response if a request with that key already succeeded.
+
+        Returns:
+            dict | None: { "status": int, "body": dict } to replay, or None if the request has to be run (then
+                followed by complete or release).
+
+        Raises:
+            ValueError: If the key is empty or too long.
+            IdempotencyKeyReusedException: If the key was used for a different request.
+            IdempotencyKeyInProgressException: If a request with the key is still running.
+        """
+        if not key or len(key) > self.MAX_KEY_LENGTH:
+            raise ValueError(f'Idempotency-Key must have between 1 and {self.MAX_KEY_LENGTH} characters')
+        id = f'{scope}:{key}'
+        cached = self.cache.get(id)
+        if cached is not None:
+            return self._replay(cached, requestHash)
+        now = utcnow()
+        try:
+            self.collection.insert_one({'_id': id, 'requestHash': requestHash, 'status': 'pending', 'claimedAt': now, 'expiresAt': now + datetime.timedelta(seconds=self.ttl)})
+            return None
+        except DuplicateKeyError:
+            pass
+        saved = self.collection.find_one({'_id': id})
+        if saved is None:
+            # expired or released in the meantime, claim it again
+            return self.begin(scope, key, requestHash)
+        if saved['status'] == 'done':
+            self.cache.set(id, saved, saved['expiresAt'])
+            return self._replay(saved, requestHash)
+        if saved['requestHash'] != requestHash:
+            raise IdempotencyKeyReusedException('Idempotency-Key was used for a different request')
+        # a claim older than lockTimeout belongs to a request that never finished, it is taken over once
+        stale = now - datetime.timedelta(seconds=self.lockTimeout)
+        taken = self.collection.update_one({'_id': id, 'status': 'pending', 'claimedAt': {'$lte': stale}}, {'$set': {'claimedAt': now}})
+        if taken.modified_count == 0:
+            raise IdempotencyKeyInProgressException('A request with this Idempotency-Key is in progress')
+        return None
+
+    def complete(self, scope: str, key: str, status: int, body: dict) -> None:
+        """
+        Saves the response of the request that claimed key, replayed to the following requests with the same key.
+        """
+        id = f'{scope}:{key}'
+        saved = self.collection.find_one_and_update(
+            {'_id': id},
+            {'$set': {'status': 'done', 'response': {'status': status, 'body': body}}},
+            return_document=ReturnDocument.AFTER
+        )
+        if saved is not None:
+            self.cache.set(id, saved, saved['expiresAt'])
+
+    def release(self, scope: str, key: str) -> None:
+        """
+        Frees key after its request failed without side effects, so a retry runs it again.
+        """
+        self.collection.delete_one({'_id': f'{scope}:{key}', 'status': 'pending'})
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+    @staticmethod
+    def _replay(saved: dict, requestHash: str) -> dict:
+        if saved['requestHash'] != requestHash:
+            raise IdempotencyKeyReusedException('Idempotency-Key was used for a different request')
+        return saved['response']
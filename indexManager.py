@@ -0,0 +1,152 @@
+"""
+Registry of the indexes of every collection of the API, applied at startup or from the command line.
+
+Each handler declares the indexes its queries need in its INDEXES attribute, this module gathers them by
+collection. Applying the registry only creates the indexes that are missing, so it is idempotent and cheap
+when nothing changed. The report lists, for every collection, the declared indexes that are missing or whose
+definition changed, the indexes that exist without being declared, and the ones no query used since the
+server started (from $indexStats).
+
+Usage:
+    python indexManager.py [apply|report] [--background]
+    python indexManager.py report
+"""
+
+import threading
+from pymongo import MongoClient, IndexModel
+from pymongo.errors import PyMongoError
+from productHandler import ProductHandler
+from userHandler import UserHandler
+from saleHandler import SaleHandler
+from providerHandler import ProviderHandler
+from sessionStore import MongoSessionStore
+from salesRollup import SalesRollup
+from idempotency import IdempotencyStore
+from secret import Secret
+import sys
+
+REGISTRY = {
+    'products': ProductHandler.INDEXES,
+    'users': UserHandler.INDEXES,
+    'sales': SaleHandler.INDEXES,
+    'sales_daily': SalesRollup.INDEXES,
+    'idempotency_keys': IdempotencyStore.INDEXES,
+    'providers': ProviderHandler.INDEXES,
+    'tokens': MongoSessionStore.INDEXES,
+    'revoked_tokens': MongoSessionStore.INDEXES
+}
+
+class IndexManager:
+    """
+    Creates and checks the indexes of a registry ({collection: [IndexModel]}) in a database.
+
+    Attributes:
+        created (dict): Names of the indexes created by the last apply, by collection.
+        errors (dict): Errors of the last apply, by collection (e.g. a unique index over duplicated values).
+        building (bool): Whether an apply started with applyInBackground is running.
+    """
+    def __init__(self, connection: MongoClient, db: str, registry: dict[str, list[IndexModel]] = None) -> None:
+        self.connection = connection
+        self.db = db
+        self.registry = registry if registry is not None else REGISTRY
+        self.created = {}
+        self.errors = {}
+        self.building = False
+        self._thread = None
+
+    def apply(self, background: bool = False) -> dict[str, list[str]]:
+        """
+        Creates the declared indexes missing from each collection and returns their names by collection.
+
+        Collections failing to build an index are reported in errors and do not stop the others.
+
+        Args:
+            background (bool, optional): Whether to build with the background option, so servers older than 4.2 keep
+                serving the collection during the build (newer ones always do). Defaults to False.
+        """
+        db = self.connection[self.db]
+        created, errors = {}, {}
+        for collection, indexes in self.registry.items():
+            try:
+                existing = db[collection].index_information()
+                missing = [index for index in indexes if index.document['name'] not in existing]
+                if background:
+                    missing = [self._inBackground(index) for index in missing]
+                if missing:
+                    created[collection] = db[collection].create_indexes(missing)
+            except PyMongoError as e:
+                errors[collection] = str(e)
+                print(f'Could not create the indexes of {collection}: {e}')
+        self.created, self.errors = created, errors
+        return created
+
+    def applyInBackground(self) -> threading.Thread:
+        """
+        Runs apply with background builds in a daemon thread, so the API starts serving while indexes of large collections are built.
+        """
+        def run() -> None:
+            try:
+                self.apply(background=True)
+            finally:
+                self.building = False
+        self.building = True
+        self._thread = threading.Thread(target=run, name='index-builder', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def report(self) -> dict[str, dict]:
+        """
+        Compares the indexes of each collection with the registry.
+
+        Returns:
+            dict[str, dict]: By collection, { "missing": [...], "changed": [...], "undeclared": [...], "unused": [...] }.
+                unused is None when index usage statistics are not available.
+        """
+        db = self.connection[self.db]
+        report = {}
+        for collection, indexes in self.registry.items():
+            existing = db[collection].index_information()
+            declared = {index.document['name']: index.document for index in indexes}
+            report[collection] = {
+                'missing': [name for name in declared if name not in existing],
+                'changed': [name for name, index in declared.items() if name in existing and list(index['key'].items()) != list(existing[name]['key'])],
+                'undeclared': [name for name in existing if name != '_id_' and name not in declared],
+                'unused': self._unused(collection)
+            }
+        return report
+
+    def stats(self) -> dict:
+        return {'building': self.building, 'created': self.created, 'errors': self.errors}
+
+    @staticmethod
+    def _inBackground(index: IndexModel) -> IndexModel:
+        options = {option: value for option, value in index.document.items() if option != 'key'}
+        return IndexModel(list(index.document['key'].items()), **options, background=True)
+
+    def _unused(self, collection: str) -> list[str] | None:
+        try:
+            usage = self.connection[self.db][collection].aggregate([{'$indexStats': {}}])
+            return [index['name'] for index in usage if index['name'] != '_id_' and index['accesses']['ops'] == 0]
+        except PyMongoError:
+            return None
+
+if __name__ == '__main__':
+    command = next((arg for arg in sys.argv[1:] if not arg.startswith('--')), 'apply')
+    secret = Secret()
+    manager = IndexManager(MongoClient(secret.uri), secret.dbName)
+    if command == 'apply':
+        manager.apply(background='--background' in sys.argv)
+        for collection, names in manager.created.items():
+            print(f"{collection}: created {', '.join(names)}")
+        if not manager.created and not manager.errors:
+            print('All indexes already exist')
+    elif command == 'report':
+        for collection, status in manager.report().items():
+            unused = 'unknown' if status['unused'] is None else ', '.join(status['unused']) or '-'
+            print(f'{collection}:')
+            for field in ['missing', 'changed', 'undeclared']:
+                print(f"    {field}: {', '.join(status[field]) or '-'}")
+            print(f'    unused: {unused}')
+    else:
+        print(f'Unknown command {command}, expected apply or report')
+        sys.exit(1)
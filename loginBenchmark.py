@@ -0,0 +1,50 @@
+"""
+Benchmark of login throughput (password verifications per second) at different bcrypt cost factors.
+
+Each login is verified through PasswordHasher the same way LoginHandler does it, with `concurrency`
+request threads competing for the hasher pool, so the numbers show what a worker can sustain during a login storm.
+
+Usage:
+    python loginBenchmark.py [logins] [concurrency] [rounds...]
+    python loginBenchmark.py 200 16 10 11 12 13
+"""
+
+from passwordHasher import PasswordHasher
+from concurrent.futures import ThreadPoolExecutor
+import statistics
+import time
+import sys
+
+def benchmark(rounds: int, logins: int, concurrency: int, workers: int = None) -> dict:
+    hasher = PasswordHasher(rounds=rounds, workers=workers, maxPending=concurrency)
+    stored = hasher.hash('password')
+    latencies = []
+
+    def login(_) -> None:
+        start = time.perf_counter()
+        assert hasher.verify('password', stored)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as requests:
+        list(requests.map(login, range(logins)))
+    elapsed = time.perf_counter() - start
+    hasher.shutdown()
+    latencies.sort()
+    return {
+        'rounds': rounds,
+        'workers': hasher.workers,
+        'logins/s': logins / elapsed,
+        'p50 ms': statistics.median(latencies) * 1000,
+        'p95 ms': latencies[int(len(latencies) * 0.95) - 1] * 1000
+    }
+
+if __name__ == '__main__':
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    costs = [int(arg) for arg in sys.argv[3:]] or [10, 11, 12, 13]
+    print(f'{logins} logins, {concurrency} concurrent requests')
+    print(f"{'rounds':>6} {'workers':>7} {'logins/s':>10} {'p50 ms':>9} {'p95 ms':>9}")
+    for rounds in costs:
+        result = benchmark(rounds, logins, concurrency)
+        print(f"{result['rounds']:>6} {result['workers']:>7} {result['logins/s']:>10.1f} {result['p50 ms']:>9.1f} {result['p95 ms']:>9.1f}")
@@ -3,24 +3,36 @@ from login import Login
 from pymongo.results import InsertOneResult, UpdateResult
 from pymongo.server_api import ServerApi
 from bson import ObjectId
-import bcrypt
+from passwordHasher import PasswordHasher
 
 class LoginHandler:
 
-    def __init__(self,db_name: str,  uri: str = None, connection: MongoClient = None) -> None:
+    # fields of the user document returned to the client on login
+    PROFILE_FIELDS = ['name', 'lastname', 'email', 'cellphone', 'role']
+
+    def __init__(self,db_name: str,  uri: str = None, connection: MongoClient = None, hasher: PasswordHasher = None) -> None:
         if connection is not None:
             self.connection = connection
         else:
             self.connection = MongoClient(uri, server_api=ServerApi('1'))
         self.db_name = db_name
+        self.hasher = hasher if hasher is not None else PasswordHasher()
+
+    def login(self,login: Login) -> dict | None:
+        """
+        Checks the credentials and returns the profile of the user (role included), or None if they are invalid.
 
-    def login(self,login: Login) -> bool:
+        The credentials and the profile come from a single query on the users collection.
+        """
         db = self.connection[self.db_name]
-        user = db.users.find_one({'email': login.email})
+        user = db.users.find_one({'email': login.email, '_isActive': True}, {field: 1 for field in self.PROFILE_FIELDS + ['password']})
         if user is None:
-            return False
-        password = login.password
-        if password == user['password']:
-            return True
-        else:
-            return False
\ No newline at end of file
+            return None
+        if not self.hasher.verify(login.password, user['password']):
+            return None
+        # plaintext passwords and hashes with an outdated cost factor are rehashed on a successful login
+        if self.hasher.needsRehash(user['password']):
+            db.users.update_one({'_id': user['_id'], 'password': user['password']}, {'$set': {'password': self.hasher.hash(login.password)}})
+        profile = {field: user.get(field) for field in self.PROFILE_FIELDS}
+        profile['_id'] = str(user['_id'])
+        return profile
\ No newline at end of file
@@ -7,9 +7,10 @@ Endpoints:
     - Description: Authenticates a user and generates an access token.
     - Request Body: { "email": "user@example.com", "password": "password" }
     - Responses:
-        - 200: { "token": "access_token" }
+        - 200: { "token": "access_token", "ttl": "expiry", "user": "user@example.com", "role": "admin", "profile": { "_id": "user_id", "name": "John", ... } }
         - 400: { "error": "Invalid request" }
         - 401: { "error": "Invalid credentials" }
+        - 503: { "error": "Server busy, try again later" }
         - 500: { "error": "Internal server error" }
 - /logout [POST]
     - Description: Logs out a user by invalidating the access token.
@@ -20,10 +21,29 @@ Endpoints:
         - 401: { "error": "Token not in session" }
         - 500: { "error": "Internal server error" }
 - /product [GET]
-    - Description: Retrieves a list of products.
+    - Description: Retrieves a list of products, optionally one page at a time (keyset pagination).
+    - Headers: { "X-Access-Token": "access_token", "If-None-Match": "etag" (optional), "If-Modified-Since": "date" (optional) }
+    - Query: limit, after, sort, order (all optional)
+    - Responses:
+        - 200: List of products, or { "items": [...], "next": "cursor" } when limit is given (pass next as after to get the following page)
+        - 304: Not modified (If-None-Match / If-Modified-Since match the ETag / Last-Modified of the data)
+        - 400: { "error": "Invalid pagination cursor" }
+        - 500: { "error": "Internal server error" }
+- /product/search [GET]
+    - Description: Searches active products by text (name and description), category, status and price range, one page at a time.
+    - Headers: { "X-Access-Token": "access_token" }
+    - Query: q, category, status, minPrice, maxPrice, limit (defaults to 50), after, sort, order (all optional)
+    - Responses:
+        - 200: { "items": [...], "next": "cursor" } (pass next as after to get the following page)
+        - 400: { "error": "Invalid pagination cursor" }
+        - 500: { "error": "Internal server error" }
+- /product/suggest [GET]
+    - Description: Suggests active products whose name has a word starting with q, served from memory (autocomplete).
     - Headers: { "X-Access-Token": "access_token" }
+    - Query: q, limit (1 to 50, defaults to 10)
     - Responses:
-        - 200: List of products
+        - 200: [{ "_id": "product_id", "name": "Product Name", "price": 100.0 }, ...]
+        - 400: { "error": "Invalid request" }
         - 500: { "error": "Internal server error" }
 - /product [POST]
     - Description: Adds a new product.
@@ -32,22 +52,32 @@ Endpoints:
     - Responses:
         - 201: { "message": "Product added" }
         - 400: { "error": "Invalid request" }
+        - 409: { "error": "Product already exists" }
+        - 500: { "error": "Internal server error" }
+- /product/bulk [POST]
+    - Description: Adds many products at once (admins only), from a JSON array or an NDJSON stream (Content-Type: application/x-ndjson).
+    - Headers: { "X-Access-Token": "access_token" }
+    - Responses:
+        - 200: { "created": 1, "failed": 1, "results": [{ "index": 0, "status": "created", "_id": "id" }, { "index": 1, "status": "error", "error": "message" }] }
+        - 400: { "error": "Expected a JSON array or an NDJSON stream" }
         - 500: { "error": "Internal server error" }
 - /product/<id> [GET]
     - Description: Retrieves a product by its ID.
-    - Headers: { "X-Access-Token": "access_token" }
+    - Headers: { "X-Access-Token": "access_token", "If-None-Match": "etag" (optional), "If-Modified-Since": "date" (optional) }
     - Responses:
         - 200: Product details
+        - 304: Not modified (If-None-Match / If-Modified-Since match the ETag / Last-Modified of the data)
         - 404: { "error": "Product not found" }
         - 500: { "error": "Internal server error" }
 - /product/<id> [PUT]
-    - Description: Updates a product by its ID.
+    - Description: Updates a product by its ID, only the fields sent are changed.
     - Headers: { "X-Access-Token": "access_token" }
     - Request Body: { "name": "Product Name", "description": "Product Description", "category": "Category", "price": 100.0, "status": "Available", "quantity": 10 }
     - Responses:
         - 200: { "message": "Product updated" }
         - 400: { "error": "Invalid request" }
         - 404: { "error": "Product not found" }
+        - 409: { "error": "Product already exists" }
         - 500: { "error": "Internal server error" }
 - /product/<id> [DELETE]
     - Description: Deletes a product by its ID.
@@ -57,44 +87,106 @@ Endpoints:
         - 404: { "error": "Product not found" }
         - 500: { "error": "Internal server error" }
 - /sale [GET]
-    - Description: Retrieves a list of sales.
-    - Headers: { "X-Access-Token": "access_token" }
+    - Description: Retrieves a list of sales, optionally one page at a time (keyset pagination) or streamed.
+    - Headers: { "X-Access-Token": "access_token", "Accept": "application/x-ndjson" (optional, streams one sale per line) }
+    - Query: limit, after, sort, order, stream (streams the JSON array), batch_size (sales sent at a time when streaming) (all optional)
     - Responses:
-        - 200: List of sales
+        - 200: List of sales, or { "items": [...], "next": "cursor" } when limit is given (pass next as after to get the following page)
+        - 400: { "error": "Invalid pagination cursor" }
         - 500: { "error": "Internal server error" }
 - /sale [POST]
-    - Description: Generates a new sale.
-    - Headers: { "X-Access-Token": "access_token" }
+    - Description: Generates a new sale and takes the quantities sold out of the stock of the products.
+      Retries sent with the same Idempotency-Key get the response of the first request instead of a new sale.
+    - Headers: { "X-Access-Token": "access_token", "Idempotency-Key": "unique_key" (optional) }
     - Request Body: { "id_seller": "seller_id", "id_client": "client_id", "products": ["product_id1", "product_id2"], "date": "YYYY-MM-DD HH:MM:SS" }
+      date is optional (now by default) and read as UTC unless it carries an offset (e.g. 2024-11-04T12:00:00-05:00).
     - Responses:
-        - 201: { "message": "Sale generated" }
+        - 201: { "message": "Sale generated", "receipt": { "seller": "seller_id", "client": "client_id", "date": "date", "total": 100.0, "products": [...] } }, with Idempotent-Replayed: true on replays
         - 400: { "error": "Invalid request" }
+        - 404: { "error": "Products product_id1, product_id2 not found" }
+        - 409: { "error": "Insufficient stock for products product_id1" } or { "error": "A request with this Idempotency-Key is in progress" }
+        - 422: { "error": "Idempotency-Key was used for a different request" }
         - 500: { "error": "Internal server error" }
-- /sale/date [GET]
-    - Description: Retrieves sales within a date range.
+- /sale/batch [POST]
+    - Description: Generates many sales at once (e.g. replayed by a terminal after being offline), from a JSON array or an NDJSON stream (Content-Type: application/x-ndjson).
     - Headers: { "X-Access-Token": "access_token" }
-    - Query Parameters: dateLo, dateHi
+    - Request Body: [{ "id_seller": "seller_id", "id_client": "client_id", "products": [{ "idProducto": "product_id", "quantity": 1 }], "date": "YYYY-MM-DD HH:MM:SS" }, ...]
+    - Responses:
+        - 200: { "created": 1, "failed": 1, "results": [{ "index": 0, "status": "created", "_id": "id", "total": 100.0 }, { "index": 1, "status": "error", "error": "message" }] }
+        - 400: { "error": "Expected a JSON array or an NDJSON stream" }
+        - 409: { "error": "Insufficient stock for products product_id1" }
+        - 500: { "error": "Internal server error" }
+- /sale/date [GET]
+    - Description: Retrieves sales within a date range, both limits included (a dateHi without time includes that whole day).
+    - Headers: { "X-Access-Token": "access_token", "Accept": "application/x-ndjson" (optional, streams one sale per line) }
+    - Query Parameters: dateLo, dateHi (ISO 8601 in UTC unless they carry an offset, e.g. 2024-11-04 or 2024-11-04 12:00:00), stream, batch_size (optional, see /sale)
     - Responses:
         - 200: List of sales within the date range
         - 400: { "error": "Could not parse dates from request" }
         - 500: { "error": "Internal server error" }
-- /sale/product/<id> [GET]
-    - Description: Retrieves sales for a specific product.
+- /sale/stats/<grouping> [GET]
+    - Description: Sales totals aggregated in the database by period, seller or product (grouping is period, seller or product).
     - Headers: { "X-Access-Token": "access_token" }
+    - Query Parameters: dateLo, dateHi (optional, both inclusive), granularity (period only, day, week, month or year), timezone (period only), limit (seller and product only), source (sales or rollup, the daily rollup having UTC days only)
     - Responses:
-        - 200: List of sales for the product
+        - 200: [{ "period": "date", "total": 100.0, "sales": 2 }], [{ "seller": "user_id", "name": "John", "lastname": "Doe", "total": 100.0, "sales": 2 }] or [{ "product": "product_id", "name": "Product Name", "quantity": 10, "revenue": 100.0, "sales": 2 }]
+        - 400: { "error": "granularity must be one of day, week, month, year" }
+        - 404: { "error": "Unknown grouping" }
         - 500: { "error": "Internal server error" }
-- /sale/user/<id> [GET]
-    - Description: Retrieves sales for a specific user.
+- /sale/export [POST]
+    - Description: Starts a background export of the sales (admins only), one row per line item, to Parquet, Arrow IPC or gzip CSV.
     - Headers: { "X-Access-Token": "access_token" }
+    - Query Parameters: format (parquet, arrow or csv, defaults to parquet), dateLo, dateHi (optional, both inclusive)
     - Responses:
-        - 200: List of sales for the user
+        - 202: { "id": "export_id", "status": "running", "format": "parquet", "sales": 0, "rows": 0, ... }, with the job at the Location header
+        - 400: { "error": "format must be one of parquet, arrow, csv" }
         - 500: { "error": "Internal server error" }
-- /provider [GET]
-    - Description: Retrieves a list of providers.
+- /sale/export/<id> [GET]
+    - Description: Retrieves the state of an export (running, done or failed) and the sales and rows written so far (admins only).
+    - Headers: { "X-Access-Token": "access_token" }
+    - Responses:
+        - 200: { "id": "export_id", "status": "done", "sales": 1200, "rows": 3400, "download": "/sale/export/export_id/file", ... }
+        - 404: { "error": "Export not found" }
+        - 500: { "error": "Internal server error" }
+- /sale/export/<id>/file [GET]
+    - Description: Downloads the file of a finished export (admins only).
+    - Headers: { "X-Access-Token": "access_token" }
+    - Responses:
+        - 200: Exported file
+        - 404: { "error": "Export not found" }
+        - 409: { "error": "Export is running" }
+        - 500: { "error": "Internal server error" }
+- /sale/product/<id> [GET]
+    - Description: Retrieves a page of the sales including a product, most recent first.
+    - Headers: { "X-Access-Token": "access_token" }
+    - Query Parameters: dateLo, dateHi (optional, both inclusive), limit (defaults to 50), after, order (asc or desc, defaults to desc)
+    - Responses:
+        - 200: { "items": [...], "next": "cursor" } (pass next as after to get the following page)
+        - 400: { "error": "Invalid id 123" }
+        - 500: { "error": "Internal server error" }
+- /sale/seller/<id> [GET]
+    - Description: Retrieves a page of the sales made by a seller (e.g. a cashier during a shift with dateLo and dateHi), most recent first.
+    - Headers: { "X-Access-Token": "access_token" }
+    - Query Parameters: Same as /sale/product/<id>
+    - Responses: Same as /sale/product/<id>
+- /sale/client/<id> [GET]
+    - Description: Retrieves a page of the sales made to a client, most recent first.
+    - Headers: { "X-Access-Token": "access_token" }
+    - Query Parameters: Same as /sale/product/<id>
+    - Responses: Same as /sale/product/<id>
+- /sale/user/<id> [GET]
+    - Description: Retrieves a page of the sales a user took part in, as seller or as client, most recent first.
     - Headers: { "X-Access-Token": "access_token" }
+    - Query Parameters: Same as /sale/product/<id>
+    - Responses: Same as /sale/product/<id>
+- /provider [GET]
+    - Description: Retrieves a list of providers, optionally one page at a time (keyset pagination).
+    - Headers: { "X-Access-Token": "access_token", "If-None-Match": "etag" (optional), "If-Modified-Since": "date" (optional) }
+    - Query: limit, after, sort, order (all optional)
     - Responses:
-        - 200: List of providers
+        - 200: List of providers, or { "items": [...], "next": "cursor" } when limit is given (pass next as after to get the following page)
+        - 304: Not modified (If-None-Match / If-Modified-Since match the ETag / Last-Modified of the data)
+        - 400: { "error": "Invalid pagination cursor" }
         - 500: { "error": "Internal server error" }
 - /provider [POST]
     - Description: Adds a new provider.
@@ -104,11 +196,19 @@ Endpoints:
         - 201: { "message": "Provider added" }
         - 400: { "error": "Invalid request" }
         - 500: { "error": "Internal server error" }
+- /provider/bulk [POST]
+    - Description: Adds many providers at once (admins only), from a JSON array or an NDJSON stream (Content-Type: application/x-ndjson).
+    - Headers: { "X-Access-Token": "access_token" }
+    - Responses:
+        - 200: { "created": 1, "failed": 1, "results": [{ "index": 0, "status": "created", "_id": "id" }, { "index": 1, "status": "error", "error": "message" }] }
+        - 400: { "error": "Expected a JSON array or an NDJSON stream" }
+        - 500: { "error": "Internal server error" }
 - /provider/<id> [GET]
     - Description: Retrieves a provider by its ID.
-    - Headers: { "X-Access-Token": "access_token" }
+    - Headers: { "X-Access-Token": "access_token", "If-None-Match": "etag" (optional), "If-Modified-Since": "date" (optional) }
     - Responses:
         - 200: Provider details
+        - 304: Not modified (If-None-Match / If-Modified-Since match the ETag / Last-Modified of the data)
         - 404: { "error": "Provider not found" }
         - 500: { "error": "Internal server error" }
 - /provider/<id> [PUT]
@@ -128,10 +228,12 @@ Endpoints:
         - 404: { "error": "Provider not found" }
         - 500: { "error": "Internal server error" }
 - /user [GET]
-    - Description: Retrieves a list of users.
+    - Description: Retrieves a list of users, optionally one page at a time (keyset pagination).
     - Headers: { "X-Access-Token": "access_token" }
+    - Query: limit, after, sort, order (all optional)
     - Responses:
-        - 200: List of users
+        - 200: List of users, or { "items": [...], "next": "cursor" } when limit is given (pass next as after to get the following page)
+        - 400: { "error": "Invalid pagination cursor" }
         - 500: { "error": "Internal server error" }
 - /user [POST]
     - Description: Adds a new user.
@@ -140,6 +242,14 @@ Endpoints:
     - Responses:
         - 201: { "message": "User added" }
         - 400: { "error": "Invalid request" }
+        - 409: { "error": "User already exists" }
+        - 500: { "error": "Internal server error" }
+- /user/bulk [POST]
+    - Description: Adds many users at once (admins only), from a JSON array or an NDJSON stream (Content-Type: application/x-ndjson).
+    - Headers: { "X-Access-Token": "access_token" }
+    - Responses:
+        - 200: { "created": 1, "failed": 1, "results": [{ "index": 0, "status": "created", "_id": "id" }, { "index": 1, "status": "error", "error": "message" }] }
+        - 400: { "error": "Expected a JSON array or an NDJSON stream" }
         - 500: { "error": "Internal server error" }
 - /user/<id> [GET]
     - Description: Retrieves a user by its ID.
@@ -156,6 +266,7 @@ Endpoints:
         - 200: { "message": "User updated" }
         - 400: { "error": "Invalid request" }
         - 404: { "error": "User not found" }
+        - 409: { "error": "User already exists" }
         - 500: { "error": "Internal server error" }
 - /user/<id> [DELETE]
     - Description: Deletes a user by its ID.
@@ -164,23 +275,36 @@ Endpoints:
         - 200: { "message": "User deleted" }
         - 404: { "error": "User not found" }
         - 500: { "error": "Internal server error" }
+- /metrics [GET]
+    - Description: Retrieves internal counters of the API (token cache hits and misses, revoked signed tokens, expired session sweeps, product catalog reloads, index builds).
+    - Headers: { "X-Access-Token": "access_token" }
+    - Responses:
+        - 200: { "tokenCache": { ... }, "revokedTokens": 0, "tokenSweeper": { "enabled": true, "runs": 12, "purged": 40, ... }, "productCatalog": { "version": 3, "loads": 4, ... }, "indexes": { "building": false, "created": { ... }, "errors": { ... } }, "idempotency": { "size": 2, "hits": 1, ... } }
 """
 import sys
-from flask import Flask, request, jsonify
+import os
+from flask import Flask, Response, request, jsonify, g, make_response, send_file
 from flask_cors import CORS
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
 from bson.json_util import dumps
 from redis import Redis
-from datetime import datetime
 import hashlib
 from functools import wraps
 from exceptions import *
 from saleHandler import SaleHandler
+from salesStats import SalesStats
+from salesRollup import SalesRollup
 from userHandler import UserHandler
 from productHandler import ProductHandler
+from productCatalog import ProductCatalog
+from collectionVersion import CollectionVersion
 from loginHandler import LoginHandler
 from tokenHandler import TokenHandler
+from passwordHasher import PasswordHasher
+from sessionStore import SessionStore, MongoSessionStore, RedisSessionStore
+from utcTime import utcnow
 from providerHandler import ProviderHandler
 from login import Login
 from user import User
@@ -188,6 +312,11 @@ from product import Product
 from secret import Secret
 from provider import Provider
 from flasgger import Swagger
+from bulkImport import importRecords, iterNdjson
+from streaming import ndjson, jsonArray, DEFAULT_BATCH_SIZE, MAX_BATCH_SIZE
+from indexManager import IndexManager
+from salesExport import ExportJobs, MIMETYPES as EXPORT_MIMETYPES
+from idempotency import IdempotencyStore
 import traceback
 
 template = {
@@ -203,36 +332,191 @@ template = {
   }
 }
 
+def sessionStore() -> SessionStore:
+    # sessions go to Redis when it is configured and reachable, MongoDB is the fallback
+    if config.redis_uri is not None:
+        try:
+            redis = Redis.from_url(config.redis_uri)
+            redis.ping()
+            return RedisSessionStore(redis)
+        except Exception:
+            print(traceback.format_exc())
+            print('Redis is not available, keeping sessions in MongoDB')
+    return MongoSessionStore(mongo, config.dbName)
+
 app = Flask(__name__)
 cors = CORS(app)
 config = Secret()
 mongo = MongoClient(config.uri)
-saleHandler = SaleHandler(config.dbName, connection=mongo)
-providerHandler = ProviderHandler(config.dbName, connection=mongo)
-userHandler = UserHandler(config.dbName, connection=mongo)
-productHandler = ProductHandler(config.dbName, connection=mongo)
-loginHandler = LoginHandler(config.dbName, connection=mongo)
-tokenHandler = TokenHandler(config.token_ttl, config.secret, mongo, config.dbName)
+collectionVersion = CollectionVersion(mongo, config.dbName, config.version_cache_age)
+productCatalog = ProductCatalog(mongo[config.dbName].products, config.catalog_max_staleness, collectionVersion)
+salesRollup = SalesRollup(mongo, config.dbName) if config.sales_rollup else None
+productHandler = ProductHandler(config.dbName, connection=mongo, catalog=productCatalog, versions=collectionVersion)
+saleHandler = SaleHandler(config.dbName, connection=mongo, catalog=productCatalog, versions=collectionVersion, rollup=salesRollup, products=productHandler)
+salesStats = SalesStats(config.dbName, connection=mongo, source=config.stats_source)
+exportJobs = ExportJobs(saleHandler, config.export_dir, config.export_max_age)
+idempotencyStore = IdempotencyStore(mongo, config.dbName, config.idempotency_ttl, config.idempotency_lock_timeout)
+providerHandler = ProviderHandler(config.dbName, connection=mongo, versions=collectionVersion)
+passwordHasher = PasswordHasher(config.bcrypt_rounds, config.hash_workers)
+userHandler = UserHandler(config.dbName, connection=mongo, hasher=passwordHasher)
+loginHandler = LoginHandler(config.dbName, connection=mongo, hasher=passwordHasher)
+tokenHandler = TokenHandler(config.token_ttl, config.secret, mongo, config.dbName, cacheSize=config.token_cache_size, cacheMaxAge=config.token_cache_max_age, store=sessionStore(), stateless=config.stateless_tokens, revocationRefresh=config.revocation_refresh)
 swagger = Swagger(app, template=template)
 
-def login_required(f):
-    @wraps(f)
-    def wrapper(*args, **kwargs):
-        try:
-            token = request.headers['X-Access-Token']
-            if token is None:
+indexManager = IndexManager(mongo, config.dbName)
+if config.index_build == 'background':
+    indexManager.applyInBackground()
+elif config.index_build == 'foreground':
+    indexManager.apply()
+if config.token_sweep_interval:
+    tokenHandler.startSweeper(config.token_sweep_interval)
+if config.catalog_change_stream:
+    productCatalog.watch()
+
+def loadUser(token: str) -> dict:
+    """
+    Resolves a token to the context of its user: id, email and role.
+
+    The context comes from the session itself, only sessions created before roles were stored in them need a user lookup.
+    """
+    session = tokenHandler.getSession(token)
+    user = {'id': session.get('userId'), 'email': session['user'], 'role': session.get('role')}
+    if user['id'] is None or user['role'] is None:
+        userData = userHandler.getUserByEmail(user['email'])
+        user['id'] = str(userData['_id'])
+        user['role'] = userData['role']
+    return user
+
+def currentUser() -> dict:
+    """
+    Returns the context ({'id', 'email', 'role'}) of the user making the request, loaded once by login_required.
+    """
+    return g.user
+
+def login_required(f=None, roles: list[str] = None):
+    """
+    Requires a valid X-Access-Token header and stores the context of its user in flask.g for the request.
+
+    Can be used as @login_required, or as @login_required(roles=['admin']) to also require one of the given roles.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            try:
+                token = request.headers['X-Access-Token']
+                if token is None:
+                    return jsonify({'error': 'Token not found'}), 400
+                if 'user' not in g:
+                    g.user = loadUser(token)
+            except KeyError:
                 return jsonify({'error': 'Token not found'}), 400
-            
-            if not tokenHandler.auth(token):
-                return jsonify({'error': 'Invalid token'}), 401
-        except KeyError:
-            return jsonify({'error': 'Token not found'}), 400
-        except ExpiredTokenException:
-            return jsonify({'error': 'Token expired'}), 418
-        except TokenNotInSessionException:
-            return jsonify({'error': 'Token not in session'}), 401
-        return f(*args, **kwargs)
-    return wrapper
+            except ExpiredTokenException:
+                return jsonify({'error': 'Token expired'}), 418
+            except (TokenNotInSessionException, UserNotFoundException):
+                return jsonify({'error': 'Token not in session'}), 401
+            if roles is not None and g.user['role'] not in roles:
+                return jsonify({'error': 'Forbidden'}), 403
+            return f(*args, **kwargs)
+        return wrapper
+    if f is not None:
+        return decorator(f)
+    return decorator
+
+def conditional(*collections: str):
+    """
+    Adds a strong ETag and Last-Modified to successful GET responses, derived from the shared versions of collections.
+
+    Requests whose If-None-Match (or If-Modified-Since) still matches get a 304 without running the endpoint,
+    so nothing is queried or serialized for clients polling unchanged data.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            versions = [collectionVersion.get(collection) for collection in collections]
+            modified = max((changed for _, changed in versions if changed is not None), default=None)
+            tag = ':'.join(f'{collection}:{version}' for collection, (version, _) in zip(collections, versions))
+            etag = hashlib.sha256(f'{tag}:{request.full_path}'.encode('utf-8')).hexdigest()[:32]
+            if request.if_none_match:
+                notModified = request.if_none_match.contains(etag)
+            else:
+                notModified = modified is not None and request.if_modified_since is not None and modified <= request.if_modified_since.replace(tzinfo=None)
+            if notModified:
+                response = make_response('', 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if modified is not None:
+                response.last_modified = modified
+            return response
+        return wrapper
+    return decorator
+
+def isPaged() -> bool:
+    return 'limit' in request.args
+
+def pageArgs(defaultLimit: int = None) -> dict:
+    """
+    Reads the keyset pagination parameters (limit, after, sort, order) of list endpoints from the query string.
+    """
+    return {
+        'limit': int(request.args.get('limit', defaultLimit)),
+        'after': request.args.get('after'),
+        'sort': request.args.get('sort', '_id'),
+        'descending': request.args.get('order', 'asc') == 'desc'
+    }
+
+def pageResponse(items: list[dict], next: str | None) -> tuple:
+    return dumps({'items': items, 'next': next}), 200
+
+def salesLookup(lookup, id: str) -> tuple:
+    """
+    Answers the sales lookups by product, seller, client or user with a page of their sales, most recent first by default.
+    """
+    try:
+        limit = int(request.args.get('limit', 50))
+        descending = request.args.get('order', 'desc') == 'desc'
+        return pageResponse(*lookup(id, request.args.get('dateLo'), request.args.get('dateHi'), limit, request.args.get('after'), descending))
+    except (ValueError, InvalidCursorException) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
+def cursorResponse(cursor) -> tuple:
+    """
+    Sends the documents of a cursor as NDJSON (Accept: application/x-ndjson) or as a JSON array (stream=true),
+    streamed batch_size documents at a time, and otherwise serialized at once.
+    """
+    batchSize = request.args.get('batch_size', DEFAULT_BATCH_SIZE, type=int)
+    if batchSize is None or not 1 <= batchSize <= MAX_BATCH_SIZE:
+        raise ValueError(f'batch_size must be between 1 and {MAX_BATCH_SIZE}')
+    if any(mimetype == 'application/x-ndjson' for mimetype, _ in request.accept_mimetypes):
+        return Response(ndjson(cursor, batchSize), mimetype='application/x-ndjson'), 200
+    if request.args.get('stream', 'false').lower() in ('true', '1'):
+        return Response(jsonArray(cursor, batchSize), mimetype='application/json'), 200
+    return dumps(cursor), 200
+
+def exportJob(job: dict) -> dict:
+    """
+    Returns the public state of an export job, with its download link once done instead of its path.
+    """
+    state = {field: value for field, value in job.items() if field != 'file'}
+    if job['status'] == 'done':
+        state['download'] = f"/sale/export/{job['id']}/file"
+    return state
+
+def bulkRecords():
+    """
+    Returns the records of a bulk import request: streamed line by line for NDJSON bodies, or the parsed JSON array.
+    """
+    if request.mimetype == 'application/x-ndjson':
+        return iterNdjson(request.stream)
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        raise ValueError('Expected a JSON array or an NDJSON stream')
+    return data
 
 # Login endpoints
 
@@ -264,15 +548,30 @@ def login():
                     example: admin
     responses:
         200:
-            description: User logged in
+            description: User logged in, with the role and profile of the user
             schema:
             type: object
             properties:
                 token:
                 type: string
                 description: Access token
+                ttl:
+                type: string
+                description: Token expiry
+                user:
+                type: string
+                description: User email
+                role:
+                type: string
+                description: User role
+                profile:
+                $ref: '#/definitions/User'
             example:
                 token: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+                ttl: Mon, 04 Nov 2024 13:00:00 GMT
+                user: admin@test.com
+                role: admin
+                profile: {"_id": "60b2b3b9d9c1b6f5f7e8f7b4", "name": "John", "lastname": "Smith Paisa", "email": "admin@test.com", "cellphone": 1234567890, "role": "admin"}
         400:
             description: Invalid request
             schema:
@@ -293,6 +592,16 @@ def login():
                 description: Error message
             example:
                 error: Invalid credentials
+        503:
+            description: Too many logins being verified at once
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Server busy, try again later
         500:
             description: Internal server error
             schema:
@@ -307,12 +616,15 @@ def login():
     try:
         data = request.json
         login = Login(data['email'], data['password'])
-        if loginHandler.login(login):
-            response = tokenHandler.generate(data['email'])
+        if (profile := loginHandler.login(login)) is not None:
+            response = tokenHandler.generate(data['email'], profile['role'], profile['_id'])
+            response['profile'] = profile
             return jsonify(response), 200
         return jsonify({'error': 'Invalid credentials'}), 401
     except KeyError:
         return jsonify({'error': 'Invalid request'}), 400
+    except PasswordHasherBusyException:
+        return jsonify({'error': 'Server busy, try again later'}), 503
     except Exception as e:
         print(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
@@ -445,6 +757,8 @@ def getRole(email):
     try:
         if email is None:
             return jsonify({'error': 'Invalid request'}), 400
+        if email == currentUser()['email']:
+            return jsonify({'role': currentUser()['role']}), 200
         role = userHandler.getUserRole(email)
         return jsonify({'role': role}), 200
     except UserNotFoundException:
@@ -462,6 +776,7 @@ def getRole(email):
 
 @app.route('/product', methods=['GET'])
 @login_required
+@conditional('products', 'products_stock')
 def getProducts():
     """Get all products
     ---
@@ -472,6 +787,39 @@ def getProducts():
             type: string
             description: Access token
             example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+        -   in: header
+            name: If-None-Match
+            required: false
+            type: string
+            description: ETag of a previous response, answered with 304 if the data did not change
+        -   in: header
+            name: If-Modified-Since
+            required: false
+            type: string
+            description: Last-Modified of a previous response, answered with 304 if the data did not change
+        -   in: query
+            name: limit
+            required: false
+            type: integer
+            description: Page size (1 to 1000). When given, the response is a page with the items and the cursor of the next page instead of the whole list
+            example: 100
+        -   in: query
+            name: after
+            required: false
+            type: string
+            description: Cursor of the page to retrieve, as returned in "next" by the previous page
+        -   in: query
+            name: sort
+            required: false
+            type: string
+            enum: [_id, name, price]
+            description: Field the products are ordered by. Defaults to _id
+        -   in: query
+            name: order
+            required: false
+            type: string
+            enum: [asc, desc]
+            description: Sort direction. Defaults to asc
     definitions:
         Product:
             type: object
@@ -502,11 +850,23 @@ def getProducts():
                     example: 10
     responses:
         200:
-            description: List of products
+            description: List of products, or a page of them when limit is given
             schema:
             type: array
             items:
                 $ref: '#/definitions/Product'
+        304:
+            description: Not modified since the ETag or date sent by the client
+        400:
+            description: Invalid pagination parameters
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Invalid pagination cursor
         500:
             description: Internal server error
             schema:
@@ -519,16 +879,20 @@ def getProducts():
                 error: Internal server error
     """
     try:
+        if isPaged():
+            return pageResponse(*productHandler.getProductsPage(**pageArgs()))
         products = productHandler.getProducts()
         return dumps(products), 200
+    except (ValueError, InvalidCursorException) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
-    
-@app.route('/product', methods=['POST'])
+
+@app.route('/product/search', methods=['GET'])
 @login_required
-def addProduct():
-    """Add a new product
+def searchProducts():
+    """Search products
     ---
     parameters:
         -   in: header
@@ -537,32 +901,74 @@ def addProduct():
             type: string
             description: Access token
             example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
-        -   in: body
-            name: body
-            required: true
-            type: JSON
-            schema:
-                $ref: '#/definitions/Product'
-            example:
-                name: Product Name
-                description: Product Description
-                category: Category
-                price: 100.0
-                status: Available
-                quantity: 10
+        -   in: query
+            name: q
+            required: false
+            type: string
+            description: Words searched in the name and description of the products
+            example: coffee
+        -   in: query
+            name: category
+            required: false
+            type: string
+            description: Exact category of the products
+            example: Category
+        -   in: query
+            name: status
+            required: false
+            type: string
+            description: Exact status of the products
+            example: Available
+        -   in: query
+            name: minPrice
+            required: false
+            type: number
+            description: Lowest price, inclusive
+            example: 10.0
+        -   in: query
+            name: maxPrice
+            required: false
+            type: number
+            description: Highest price, inclusive
+            example: 100.0
+        -   in: query
+            name: limit
+            required: false
+            type: integer
+            description: Page size (1 to 1000). Defaults to 50
+            example: 50
+        -   in: query
+            name: after
+            required: false
+            type: string
+            description: Cursor of the page to retrieve, as returned in "next" by the previous page
+        -   in: query
+            name: sort
+            required: false
+            type: string
+            enum: [_id, name, price]
+            description: Field the products are ordered by. Defaults to _id
+        -   in: query
+            name: order
+            required: false
+            type: string
+            enum: [asc, desc]
+            description: Sort direction. Defaults to asc
     responses:
-        201:
-            description: Product added
+        200:
+            description: A page of the matching products, with the cursor of the next page (null on the last one)
             schema:
             type: object
             properties:
-                message:
+                items:
+                type: array
+                items:
+                    $ref: '#/definitions/Product'
+                next:
                 type: string
-                description: Message
-            example:
-                message: Product added
+                description: Cursor of the next page
         400:
-            description: Invalid request
+            description: Invalid filters or pagination parameters
             schema:
             type: object
             properties:
@@ -570,7 +976,7 @@ def addProduct():
                 type: string
                 description: Error message
             example:
-                error: Invalid request
+                error: Invalid pagination cursor
         500:
             description: Internal server error
             schema:
@@ -583,26 +989,29 @@ def addProduct():
                 error: Internal server error
     """
     try:
-        data = request.get_json()
-        name = data.get('name')
-        description = data.get('description')
-        category = data.get('category')
-        price = data.get('price')
-        status = data.get('status')
-        quantity = data.get('quantity')
-        product = Product(name, description, category, price, status, quantity)
-        productHandler.productRegister(product)
-        return jsonify({'message': 'Product added'}), 201
-    except ValueError:
-        return jsonify({'error': 'Invalid request'}), 400
+        minPrice = request.args.get('minPrice', type=float)
+        maxPrice = request.args.get('maxPrice', type=float)
+        if ('minPrice' in request.args and minPrice is None) or ('maxPrice' in request.args and maxPrice is None):
+            raise ValueError('minPrice and maxPrice must be numbers')
+        page = productHandler.searchProducts(
+            text=request.args.get('q'),
+            category=request.args.get('category'),
+            status=request.args.get('status'),
+            minPrice=minPrice,
+            maxPrice=maxPrice,
+            **pageArgs(defaultLimit=50)
+        )
+        return pageResponse(*page)
+    except (ValueError, InvalidCursorException) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
-    
-@app.route('/product/<id>', methods=['GET'])
+
+@app.route('/product/suggest', methods=['GET'])
 @login_required
-def getProduct(id):
-    """Get a product by ID
+def suggestProducts():
+    """Suggest products by name prefix
     ---
     parameters:
         -   in: header
@@ -611,19 +1020,41 @@ def getProduct(id):
             type: string
             description: Access token
             example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
-        -   in: path
-            name: id
+        -   in: query
+            name: q
             required: true
             type: string
-            description: Product ID
-            example: 60b2b3b9d9c1b6f5f7e8f7b4
+            description: Beginning of a word of the product name, case and accents are ignored
+            example: cof
+        -   in: query
+            name: limit
+            required: false
+            type: integer
+            description: Maximum number of suggestions (1 to 50). Defaults to 10
+            example: 10
     responses:
         200:
-            description: Product details
+            description: Matching active products in alphabetical order
             schema:
-            $ref: '#/definitions/Product'
-        404:
-            description: Product not found
+            type: array
+            items:
+                type: object
+                properties:
+                    _id:
+                        type: string
+                        description: Product ID
+                    name:
+                        type: string
+                        description: Product name
+                    price:
+                        type: number
+                        description: Product price
+            example:
+                -   _id: 60b2b3b9d9c1b6f5f7e8f7b4
+                    name: Coffee
+                    price: 2.5
+        400:
+            description: Invalid request
             schema:
             type: object
             properties:
@@ -631,7 +1062,7 @@ def getProduct(id):
                 type: string
                 description: Error message
             example:
-                error: Product not found
+                error: Invalid request
         500:
             description: Internal server error
             schema:
@@ -644,19 +1075,19 @@ def getProduct(id):
                 error: Internal server error
     """
     try:
-        product = productHandler.getProductByID(id)
-        return dumps(product), 200
-    except ProductNotFoundException:
-        return jsonify({'error': 'Product not found'}), 404
+        prefix = request.args.get('q')
+        limit = request.args.get('limit', 10, type=int)
+        if prefix is None or limit is None or not 1 <= limit <= 50:
+            return jsonify({'error': 'Invalid request'}), 400
+        return jsonify(productHandler.suggestProducts(prefix, limit)), 200
     except Exception as e:
         print(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
     
-@app.route('/product/<id>', methods=['PUT'])
+@app.route('/product', methods=['POST'])
 @login_required
-def updateProduct(id):
-    """
-    Update a product by ID
+def addProduct():
+    """Add a new product
     ---
     parameters:
         -   in: header
@@ -665,12 +1096,6 @@ def updateProduct(id):
             type: string
             description: Access token
             example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
-        -   in: path
-            name: id
-            required: true
-            type: string
-            description: Product ID
-            example: 60b2b3b9d9c1b6f5f7e8f7b4
         -   in: body
             name: body
             required: true
@@ -684,56 +1109,9 @@ def updateProduct(id):
                 price: 100.0
                 status: Available
                 quantity: 10
-    """
-    try:
-        data = request.json
-        currentData = mongo[config.dbName].products.find_one({'_id': ObjectId(id)})
-        if currentData is None:
-            return jsonify({'error': 'Product not found'}), 404
-        if name := data.get('name') is None:
-            name = currentData['name']
-        if description := data.get('description') is None:
-            description = currentData['description']
-        if category := data.get('category') is None:
-            category = currentData['category']
-        if price := data.get('price') is None:
-            price = currentData['price']
-        if status := data.get('status') is None:
-            status = currentData['status']
-        if quantity := data.get('quantity') is None:
-            quantity = currentData['quantity']
-        product = Product(name, description, category, price, status, quantity)
-        productHandler.updateProduct(id, product)
-        return jsonify({'message': 'Product updated'}), 200
-    except ValueError:
-        return jsonify({'error': 'Invalid request'}), 400
-    except ProductNotFoundException:
-        return jsonify({'error': 'Product not found'}), 404
-    except Exception as e:
-        print(traceback.format_exc())
-        return jsonify({'error': str(e)}), 500
-
-@app.route('/product/<id>', methods=['DELETE'])
-@login_required
-def deleteProduct(id):
-    """Delete a product by ID
-    ---
-    parameters:
-        -   in: header
-            name: X-Access-Token
-            required: true
-            type: string
-            description: Access token
-            example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
-        -   in: path
-            name: id
-            required: true
-            type: string
-            description: Product ID
-            example: 60b2b3b9d9c1b6f5f7
     responses:
-        200:
-            description: Product deleted
+        201:
+            description: Product added
             schema:
             type: object
             properties:
@@ -741,9 +1119,9 @@ def deleteProduct(id):
                 type: string
                 description: Message
             example:
-                message: Product deleted
-        404:
-            description: Product not found
+                message: Product added
+        400:
+            description: Invalid request
             schema:
             type: object
             properties:
@@ -751,11 +1129,288 @@ def deleteProduct(id):
                 type: string
                 description: Error message
             example:
-                error: Product not found
-    """
-    try:
-        productHandler.deleteProduct(id)
-        return jsonify({'message': 'Product deleted'}), 200
+                error: Invalid request
+        409:
+            description: Product already exists
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Product already exists
+        500:
+            description: Internal server error
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Internal server error
+    """
+    try:
+        data = request.get_json()
+        name = data.get('name')
+        description = data.get('description')
+        category = data.get('category')
+        price = data.get('price')
+        status = data.get('status')
+        quantity = data.get('quantity')
+        product = Product(name, description, category, price, status, quantity)
+        if not productHandler.productRegister(product):
+            return jsonify({'error': 'Product already exists'}), 409
+        return jsonify({'message': 'Product added'}), 201
+    except ValueError:
+        return jsonify({'error': 'Invalid request'}), 400
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+    
+@app.route('/product/bulk', methods=['POST'])
+@login_required(roles=['admin'])
+def addProductsBulk():
+    """Add many products at once
+    ---
+    consumes:
+        - application/json
+        - application/x-ndjson
+    parameters:
+        -   in: header
+            name: X-Access-Token
+            required: true
+            type: string
+            description: Access token
+            example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+        -   in: body
+            name: body
+            required: true
+            description: JSON array of products, or one product per line when sent as application/x-ndjson
+            schema:
+                type: array
+                items:
+                    $ref: '#/definitions/Product'
+    responses:
+        200:
+            description: Result of every product, in the order they were sent
+            schema:
+            type: object
+            properties:
+                created:
+                type: integer
+                description: Number of products added
+                failed:
+                type: integer
+                description: Number of products rejected
+                results:
+                type: array
+                description: One result per product
+            example:
+                created: 1
+                failed: 1
+                results: [{"index": 0, "status": "created", "_id": "60b2b3b9d9c1b6f5f7e8f7b4"}, {"index": 1, "status": "error", "error": "Product Name already exists"}]
+        400:
+            description: Invalid request
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Expected a JSON array or an NDJSON stream
+        403:
+            description: Only admins can import products
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Forbidden
+        500:
+            description: Internal server error
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Internal server error
+    """
+    try:
+        result = importRecords(bulkRecords(), Product, productHandler.productBulkRegister)
+        return jsonify(result), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/product/<id>', methods=['GET'])
+@login_required
+@conditional('products', 'products_stock')
+def getProduct(id):
+    """Get a product by ID
+    ---
+    parameters:
+        -   in: header
+            name: X-Access-Token
+            required: true
+            type: string
+            description: Access token
+            example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+        -   in: header
+            name: If-None-Match
+            required: false
+            type: string
+            description: ETag of a previous response, answered with 304 if the data did not change
+        -   in: header
+            name: If-Modified-Since
+            required: false
+            type: string
+            description: Last-Modified of a previous response, answered with 304 if the data did not change
+        -   in: path
+            name: id
+            required: true
+            type: string
+            description: Product ID
+            example: 60b2b3b9d9c1b6f5f7e8f7b4
+    responses:
+        200:
+            description: Product details
+            schema:
+            $ref: '#/definitions/Product'
+        304:
+            description: Not modified since the ETag or date sent by the client
+        404:
+            description: Product not found
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Product not found
+        500:
+            description: Internal server error
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Internal server error
+    """
+    try:
+        product = productHandler.getProductByID(id)
+        return dumps(product), 200
+    except ProductNotFoundException:
+        return jsonify({'error': 'Product not found'}), 404
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+    
+@app.route('/product/<id>', methods=['PUT'])
+@login_required
+def updateProduct(id):
+    """
+    Update a product by ID
+    Only the fields sent are updated, the others keep their stored values.
+    ---
+    parameters:
+        -   in: header
+            name: X-Access-Token
+            required: true
+            type: string
+            description: Access token
+            example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+        -   in: path
+            name: id
+            required: true
+            type: string
+            description: Product ID
+            example: 60b2b3b9d9c1b6f5f7e8f7b4
+        -   in: body
+            name: body
+            required: true
+            type: JSON
+            schema:
+                $ref: '#/definitions/Product'
+            example:
+                name: Product Name
+                description: Product Description
+                category: Category
+                price: 100.0
+                status: Available
+                quantity: 10
+    """
+    try:
+        data = request.json
+        if not isinstance(data, dict):
+            raise ValueError('Invalid request')
+        # only the fields sent are written, a cached quantity is never written back over concurrent sales
+        productHandler.updateProduct(id, data)
+        return jsonify({'message': 'Product updated'}), 200
+    except ValueError:
+        return jsonify({'error': 'Invalid request'}), 400
+    except ProductNotFoundException:
+        return jsonify({'error': 'Product not found'}), 404
+    except DuplicateKeyError:
+        return jsonify({'error': 'Product already exists'}), 409
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/product/<id>', methods=['DELETE'])
+@login_required
+def deleteProduct(id):
+    """Delete a product by ID
+    ---
+    parameters:
+        -   in: header
+            name: X-Access-Token
+            required: true
+            type: string
+            description: Access token
+            example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+        -   in: path
+            name: id
+            required: true
+            type: string
+            description: Product ID
+            example: 60b2b3b9d9c1b6f5f7
+    responses:
+        200:
+            description: Product deleted
+            schema:
+            type: object
+            properties:
+                message:
+                type: string
+                description: Message
+            example:
+                message: Product deleted
+        404:
+            description: Product not found
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Product not found
+    """
+    try:
+        productHandler.deleteProduct(id)
+        return jsonify({'message': 'Product deleted'}), 200
     except ProductNotFoundException:
         return jsonify({'error': 'Product not found'}), 404
     except Exception as e:
@@ -777,6 +1432,45 @@ def getSales():
             type: string
             description: Access token
             example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+        -   in: query
+            name: limit
+            required: false
+            type: integer
+            description: Page size (1 to 1000). When given, the response is a page with the items and the cursor of the next page instead of the whole list
+            example: 100
+        -   in: query
+            name: after
+            required: false
+            type: string
+            description: Cursor of the page to retrieve, as returned in "next" by the previous page
+        -   in: query
+            name: sort
+            required: false
+            type: string
+            enum: [_id, date, total]
+            description: Field the sales are ordered by. Defaults to _id
+        -   in: query
+            name: order
+            required: false
+            type: string
+            enum: [asc, desc]
+            description: Sort direction. Defaults to asc
+        -   in: header
+            name: Accept
+            required: false
+            type: string
+            description: application/x-ndjson to receive one sale per line, streamed as the sales are read
+        -   in: query
+            name: stream
+            required: false
+            type: boolean
+            description: Stream the JSON array as the sales are read instead of building it first
+        -   in: query
+            name: batch_size
+            required: false
+            type: integer
+            description: Number of sales read and sent at a time when streaming (1 to 10000). Defaults to 500
+            example: 500
     definitions:
         Sale:
             type: object
@@ -805,7 +1499,7 @@ def getSales():
                                 example: 10
                 date:
                     type: string
-                    description: Sale date
+                    description: Sale date, ISO 8601 read as UTC unless it carries an offset. Defaults to now
                     example: 2021-05-29 12:00:00
                 total:
                     type: number
@@ -813,11 +1507,21 @@ def getSales():
                     example: 100.0
     responses:
         200:
-            description: List of sales
+            description: List of sales, or a page of them when limit is given
             schema:
             type: array
             items:
                 $ref: '#/definitions/Sale'
+        400:
+            description: Invalid pagination parameters
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Invalid pagination cursor
         500:
             description: Internal server error
             schema:
@@ -830,8 +1534,11 @@ def getSales():
                 error: Internal server error
     """
     try:
-        sales = saleHandler.getSales()
-        return dumps(sales), 200
+        if isPaged():
+            return pageResponse(*saleHandler.getSalesPage(**pageArgs()))
+        return cursorResponse(saleHandler.getSales())
+    except (ValueError, InvalidCursorException) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
@@ -858,17 +1565,27 @@ def generateSale():
                 id_client: 60b2b3b9d9c1b6f5f7e8f7b4
                 products: [{"idProducto": "60b2b3b9d9c1b6f5f7e8f7b4", "quantity": 10}]
                 date: 2024-11-04 12:00:00
+        -   in: header
+            name: Idempotency-Key
+            required: false
+            type: string
+            description: Unique key of the sale (e.g. a UUID generated by the terminal), sent again with every retry. A retry of a recorded sale gets its original response, with the Idempotent-Replayed header, instead of recording it again
+            example: 8c3e2f4a-5b6d-4e7f-9a0b-1c2d3e4f5a6b
     responses:
         201:
-            description: Sale generated
+            description: Sale generated, or replayed for an Idempotency-Key already used
             schema:
             type: object
             properties:
                 message:
                 type: string
                 description: Message
+                receipt:
+                type: object
+                description: Seller, client, date, total and priced products of the sale
             example:
                 message: Sale generated
+                receipt: {"seller": "60b2b3b9d9c1b6f5f7e8f7b4", "client": "60b2b3b9d9c1b6f5f7e8f7b4", "date": "Mon, 04 Nov 2024 12:00:00 GMT", "total": 100.0, "products": [{"quantity": 10, "product": "Product Name", "price": 10.0, "subtotal": 100.0}]}
         400:
             description: Invalid request
             schema:
@@ -879,8 +1596,8 @@ def generateSale():
                 description: Error message
             example:
                 error: Invalid request
-        500:
-            description: Internal server error
+        404:
+            description: Products not found, all of them being listed
             schema:
             type: object
             properties:
@@ -888,23 +1605,163 @@ def generateSale():
                 type: string
                 description: Error message
             example:
-                error: Internal server error
-    """
+                error: Products 60b2b3b9d9c1b6f5f7e8f7b4, 60b2b3b9d9c1b6f5f7e8f7b5 not found
+        409:
+            description: Not enough stock of some products, nothing was recorded
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Insufficient stock for products 60b2b3b9d9c1b6f5f7e8f7b4
+        422:
+            description: The Idempotency-Key was already used for a different sale
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Idempotency-Key was used for a different request
+        500:
+            description: Internal server error
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Internal server error
+    """
+    key = request.headers.get('Idempotency-Key')
+    claimed = recorded = False
     try:
         data = request.get_json()
+        if key is not None:
+            replay = idempotencyStore.begin(currentUser()['id'], key, IdempotencyStore.requestHash(data))
+            if replay is not None:
+                response = jsonify(replay['body'])
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response, replay['status']
+            claimed = True
         id_seller = data.get('id_seller')
         id_client = data.get('id_client')
         products = data.get('products')
-        if date := data.get('date') is None:
-            date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        result = saleHandler.makeSale(id_seller, id_client, products, date)
-        return jsonify({'message': 'Sale generated'}), 201 #return dumps(result), 201
+        if (date := data.get('date')) is None:
+            date = utcnow()
+        receipt = saleHandler.makeSale(id_seller, id_client, products, date)
+        # makeSale only raises when nothing was written, past this point the key must not be released
+        recorded = True
+        body = {'message': 'Sale generated', 'receipt': receipt}
+        if claimed:
+            idempotencyStore.complete(currentUser()['id'], key, 201, body)
+        return jsonify(body), 201
     except ValueError:
         return jsonify({'error': 'Invalid request'}), 400
+    except ProductNotFoundException as e:
+        return jsonify({'error': str(e)}), 404
+    except (InsufficientStockException, IdempotencyKeyInProgressException) as e:
+        return jsonify({'error': str(e)}), 409
+    except IdempotencyKeyReusedException as e:
+        return jsonify({'error': str(e)}), 422
     except Exception as e:
         print(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
+    finally:
+        # a sale that was not recorded can be retried with the same key
+        if claimed and not recorded:
+            idempotencyStore.release(currentUser()['id'], key)
     
+@app.route('/sale/batch', methods=['POST'])
+@login_required
+def generateSales():
+    """Create many sales at once
+    ---
+    consumes:
+        - application/json
+        - application/x-ndjson
+    parameters:
+        -   in: header
+            name: X-Access-Token
+            required: true
+            type: string
+            description: Access token
+            example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+        -   in: body
+            name: body
+            required: true
+            description: JSON array of sales, or one sale per line when sent as application/x-ndjson
+            schema:
+                type: array
+                items:
+                    $ref: '#/definitions/Sale'
+    responses:
+        200:
+            description: Result of every sale, in the order they were sent. Sales are accepted in order while the stock allows it
+            schema:
+            type: object
+            properties:
+                created:
+                type: integer
+                description: Number of sales generated
+                failed:
+                type: integer
+                description: Number of sales rejected
+                results:
+                type: array
+                description: One result per sale
+            example:
+                created: 1
+                failed: 1
+                results: [{"index": 0, "status": "created", "_id": "60b2b3b9d9c1b6f5f7e8f7b4", "total": 100.0}, {"index": 1, "status": "error", "error": "Insufficient stock for products 60b2b3b9d9c1b6f5f7e8f7b4"}]
+        400:
+            description: Invalid request
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Expected a JSON array or an NDJSON stream
+        409:
+            description: The stock changed while the sales were being recorded, nothing was recorded and the request can be retried
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Insufficient stock for products 60b2b3b9d9c1b6f5f7e8f7b4
+        500:
+            description: Internal server error
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Internal server error
+    """
+    try:
+        results = saleHandler.makeSales(list(bulkRecords()))
+        results = [{'index': index, **result} for index, result in enumerate(results)]
+        created = sum(1 for result in results if result['status'] == 'created')
+        return jsonify({'created': created, 'failed': len(results) - created, 'results': results}), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except InsufficientStockException as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/sale/date', methods=['GET'])
 @login_required
 def getSalesByDate():
@@ -927,8 +1784,24 @@ def getSalesByDate():
             name: dateHi
             required: true
             type: string
-            description: Upper date limit
+            description: Upper date limit, inclusive. A date without time includes that whole day
             example: 2021-05-30
+        -   in: header
+            name: Accept
+            required: false
+            type: string
+            description: application/x-ndjson to receive one sale per line, streamed as the sales are read
+        -   in: query
+            name: stream
+            required: false
+            type: boolean
+            description: Stream the JSON array as the sales are read instead of building it first
+        -   in: query
+            name: batch_size
+            required: false
+            type: integer
+            description: Number of sales read and sent at a time when streaming (1 to 10000). Defaults to 500
+            example: 500
     responses:
         200:
             description: List of sales within the date range
@@ -960,18 +1833,516 @@ def getSalesByDate():
     try:
         dateLo = request.args.get('dateLo')
         dateHi = request.args.get('dateHi')
-        sales = saleHandler.getSalesByDate(dateLo, dateHi)
-        return dumps(sales), 200
+        return cursorResponse(saleHandler.getSalesByDate(dateLo, dateHi))
     except ValueError:
         return jsonify({'error': 'Could not parse dates from request'}), 400
     except Exception as e:
         print(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
 
-@app.route('/sale/product/<id>', methods=['GET'])
+@app.route('/sale/stats/<grouping>', methods=['GET'])
+@login_required
+def getSalesStats(grouping):
+    """Get sales totals by period, seller or product
+    ---
+    parameters:
+        -   in: header
+            name: X-Access-Token
+            required: true
+            type: string
+            description: Access token
+            example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+        -   in: path
+            name: grouping
+            required: true
+            type: string
+            enum: [period, seller, product]
+            description: What the sales are grouped by
+        -   in: query
+            name: dateLo
+            required: false
+            type: string
+            description: First date included
+            example: 2024-01-01
+        -   in: query
+            name: dateHi
+            required: false
+            type: string
+            description: Last date included. A date without time includes that whole day
+            example: 2024-12-31
+        -   in: query
+            name: granularity
+            required: false
+            type: string
+            enum: [day, week, month, year]
+            description: Length of the periods (period grouping only). Weeks start on monday. Defaults to day
+        -   in: query
+            name: timezone
+            required: false
+            type: string
+            description: Timezone the periods start in, Olson name or UTC offset (period grouping only). Defaults to UTC
+            example: America/Bogota
+        -   in: query
+            name: limit
+            required: false
+            type: integer
+            description: Maximum number of rows, the best sellers or most sold products first (seller and product groupings only)
+            example: 10
+        -   in: query
+            name: source
+            required: false
+            type: string
+            enum: [sales, rollup]
+            description: Whether totals are computed from the sales or from the daily rollup, which only has UTC days and counts the whole days of the range. Defaults to the stats_source setting
+    responses:
+        200:
+            description: Aggregated rows. Periods are in chronological order, sellers by total and products by quantity, highest first
+            schema:
+            type: array
+            items:
+                type: object
+            example:
+                -   period: 2024-11-04T00:00:00Z
+                    total: 100.0
+                    sales: 2
+        400:
+            description: Invalid dates, granularity, timezone, limit or source
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: granularity must be one of day, week, month, year
+        404:
+            description: Unknown grouping
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Unknown grouping
+        500:
+            description: Internal server error
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Internal server error
+    """
+    try:
+        dateLo = request.args.get('dateLo')
+        dateHi = request.args.get('dateHi')
+        limit = request.args.get('limit', type=int)
+        if 'limit' in request.args and (limit is None or limit < 1):
+            raise ValueError('limit must be a positive integer')
+        source = request.args.get('source')
+        if grouping == 'period':
+            rows = salesStats.byPeriod(request.args.get('granularity', 'day'), dateLo, dateHi, request.args.get('timezone', 'UTC'), source)
+        elif grouping == 'seller':
+            rows = salesStats.bySeller(dateLo, dateHi, limit, source)
+        elif grouping == 'product':
+            rows = salesStats.byProduct(dateLo, dateHi, limit, source)
+        else:
+            return jsonify({'error': 'Unknown grouping'}), 404
+        return dumps(rows), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/sale/export', methods=['POST'])
+@login_required(roles=['admin'])
+def startSalesExport():
+    """Start a sales export
+    ---
+    parameters:
+        -   in: header
+            name: X-Access-Token
+            required: true
+            type: string
+            description: Access token
+            example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+        -   in: query
+            name: format
+            required: false
+            type: string
+            enum: [parquet, arrow, csv]
+            description: File format, csv being gzip compressed. Defaults to parquet
+        -   in: query
+            name: dateLo
+            required: false
+            type: string
+            description: First date included
+            example: 2024-01-01
+        -   in: query
+            name: dateHi
+            required: false
+            type: string
+            description: Last date included. A date without time includes that whole day
+            example: 2024-12-31
+    responses:
+        202:
+            description: Export started, its state is at the Location header
+            schema:
+            type: object
+            example:
+                id: 3f2c9a0e8b5d4c1e9f6a7b8c0d1e2f3a
+                status: running
+                format: parquet
+                dateLo: 2024-01-01
+                dateHi: 2024-12-31
+                sales: 0
+                rows: 0
+                error: null
+        400:
+            description: Invalid format or dates
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: format must be one of parquet, arrow, csv
+        403:
+            description: Only admins can export sales
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Forbidden
+        500:
+            description: Internal server error
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Internal server error
+    """
+    try:
+        job = exportJobs.start(request.args.get('format', 'parquet'), request.args.get('dateLo'), request.args.get('dateHi'))
+        response = jsonify(exportJob(job))
+        response.headers['Location'] = f"/sale/export/{job['id']}"
+        return response, 202
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/sale/export/<id>', methods=['GET'])
+@login_required(roles=['admin'])
+def getSalesExport(id):
+    """Get the state of a sales export
+    ---
+    parameters:
+        -   in: header
+            name: X-Access-Token
+            required: true
+            type: string
+            description: Access token
+            example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+        -   in: path
+            name: id
+            required: true
+            type: string
+            description: Export ID
+            example: 3f2c9a0e8b5d4c1e9f6a7b8c0d1e2f3a
+    responses:
+        200:
+            description: State of the export (running, done or failed) and sales and rows written so far
+            schema:
+            type: object
+            example:
+                id: 3f2c9a0e8b5d4c1e9f6a7b8c0d1e2f3a
+                status: done
+                format: parquet
+                sales: 1200
+                rows: 3400
+                error: null
+                download: /sale/export/3f2c9a0e8b5d4c1e9f6a7b8c0d1e2f3a/file
+        404:
+            description: Export not found
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Export not found
+        500:
+            description: Internal server error
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Internal server error
+    """
+    try:
+        return jsonify(exportJob(exportJobs.get(id))), 200
+    except ExportNotFoundException:
+        return jsonify({'error': 'Export not found'}), 404
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/sale/export/<id>/file', methods=['GET'])
+@login_required(roles=['admin'])
+def downloadSalesExport(id):
+    """Download the file of a finished sales export
+    ---
+    produces:
+        - application/vnd.apache.parquet
+        - application/vnd.apache.arrow.file
+        - application/gzip
+    parameters:
+        -   in: header
+            name: X-Access-Token
+            required: true
+            type: string
+            description: Access token
+            example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+        -   in: path
+            name: id
+            required: true
+            type: string
+            description: Export ID
+            example: 3f2c9a0e8b5d4c1e9f6a7b8c0d1e2f3a
+    responses:
+        200:
+            description: Exported file, one row per line item
+        404:
+            description: Export not found or its file was deleted
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Export not found
+        409:
+            description: The export is still running or failed
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Export is running
+        500:
+            description: Internal server error
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Internal server error
+    """
+    try:
+        job = exportJobs.get(id)
+        if job['status'] != 'done':
+            return jsonify({'error': f"Export is {job['status']}"}), 409
+        if not os.path.exists(job['file']):
+            return jsonify({'error': 'Export not found'}), 404
+        return send_file(os.path.abspath(job['file']), mimetype=EXPORT_MIMETYPES[job['format']], as_attachment=True, download_name=os.path.basename(job['file']))
+    except ExportNotFoundException:
+        return jsonify({'error': 'Export not found'}), 404
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/sale/product/<id>', methods=['GET'])
+@login_required
+def getSalesByProduct(id):
+    """Get sales for a specific product
+    ---
+    parameters:
+        -   in: header
+            name: X-Access-Token
+            required: true
+            type: string
+            description: Access token
+            example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+        -   in: path
+            name: id
+            required: true
+            type: string
+            description: Product ID
+            example: 60b2b3b9d9c1b6f5f7e8f7b4
+        -   in: query
+            name: dateLo
+            required: false
+            type: string
+            description: First date included
+            example: 2024-11-04 08:00:00
+        -   in: query
+            name: dateHi
+            required: false
+            type: string
+            description: Last date included. A date without time includes that whole day
+            example: 2024-11-04 16:00:00
+        -   in: query
+            name: limit
+            required: false
+            type: integer
+            description: Page size (1 to 1000). Defaults to 50
+            example: 50
+        -   in: query
+            name: after
+            required: false
+            type: string
+            description: Cursor of the page to retrieve, as returned in "next" by the previous page
+        -   in: query
+            name: order
+            required: false
+            type: string
+            enum: [asc, desc]
+            description: Date order. Defaults to desc (most recent first)
+    responses:
+        200:
+            description: Page of the sales including the product, ordered by date, and the cursor of the next page (null on the last one)
+            schema:
+            type: object
+            properties:
+                items:
+                type: array
+                items:
+                    $ref: '#/definitions/Sale'
+                next:
+                type: string
+                description: Cursor of the next page
+        400:
+            description: Invalid id, dates or pagination parameters
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Invalid pagination cursor
+        500:
+            description: Internal server error
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Internal server error
+    """
+    return salesLookup(saleHandler.getSaleByProduct, id)
+
+@app.route('/sale/seller/<id>', methods=['GET'])
+@login_required
+def getSalesBySeller(id):
+    """Get sales made by a seller
+    ---
+    parameters:
+        -   in: header
+            name: X-Access-Token
+            required: true
+            type: string
+            description: Access token
+            example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+        -   in: path
+            name: id
+            required: true
+            type: string
+            description: Seller (user) ID
+            example: 60b2b3b9d9c1b6f5f7e8f7b4
+        -   in: query
+            name: dateLo
+            required: false
+            type: string
+            description: First date included
+            example: 2024-11-04 08:00:00
+        -   in: query
+            name: dateHi
+            required: false
+            type: string
+            description: Last date included. A date without time includes that whole day
+            example: 2024-11-04 16:00:00
+        -   in: query
+            name: limit
+            required: false
+            type: integer
+            description: Page size (1 to 1000). Defaults to 50
+            example: 50
+        -   in: query
+            name: after
+            required: false
+            type: string
+            description: Cursor of the page to retrieve, as returned in "next" by the previous page
+        -   in: query
+            name: order
+            required: false
+            type: string
+            enum: [asc, desc]
+            description: Date order. Defaults to desc (most recent first)
+    responses:
+        200:
+            description: Page of the sales made by the seller, ordered by date, and the cursor of the next page (null on the last one)
+            schema:
+            type: object
+            properties:
+                items:
+                type: array
+                items:
+                    $ref: '#/definitions/Sale'
+                next:
+                type: string
+                description: Cursor of the next page
+        400:
+            description: Invalid id, dates or pagination parameters
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Invalid pagination cursor
+        500:
+            description: Internal server error
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Internal server error
+    """
+    return salesLookup(saleHandler.getSalesBySeller, id)
+
+@app.route('/sale/client/<id>', methods=['GET'])
 @login_required
-def getSalesByProduct(id):
-    """Get sales for a specific product
+def getSalesByClient(id):
+    """Get sales made to a client
     ---
     parameters:
         -   in: header
@@ -984,15 +2355,60 @@ def getSalesByProduct(id):
             name: id
             required: true
             type: string
-            description: Product ID
+            description: Client (user) ID
             example: 60b2b3b9d9c1b6f5f7e8f7b4
+        -   in: query
+            name: dateLo
+            required: false
+            type: string
+            description: First date included
+            example: 2024-11-04 08:00:00
+        -   in: query
+            name: dateHi
+            required: false
+            type: string
+            description: Last date included. A date without time includes that whole day
+            example: 2024-11-04 16:00:00
+        -   in: query
+            name: limit
+            required: false
+            type: integer
+            description: Page size (1 to 1000). Defaults to 50
+            example: 50
+        -   in: query
+            name: after
+            required: false
+            type: string
+            description: Cursor of the page to retrieve, as returned in "next" by the previous page
+        -   in: query
+            name: order
+            required: false
+            type: string
+            enum: [asc, desc]
+            description: Date order. Defaults to desc (most recent first)
     responses:
         200:
-            description: List of sales for the product
+            description: Page of the sales made to the client, ordered by date, and the cursor of the next page (null on the last one)
             schema:
-            type: array
-            items:
-                $ref: '#/definitions/Sale'
+            type: object
+            properties:
+                items:
+                type: array
+                items:
+                    $ref: '#/definitions/Sale'
+                next:
+                type: string
+                description: Cursor of the next page
+        400:
+            description: Invalid id, dates or pagination parameters
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Invalid pagination cursor
         500:
             description: Internal server error
             schema:
@@ -1004,12 +2420,8 @@ def getSalesByProduct(id):
             example:
                 error: Internal server error
     """
-    try:
-        result = saleHandler.getSaleByProduct(id)
-        return jsonify(result), 200
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    
+    return salesLookup(saleHandler.getSalesByClient, id)
+
 @app.route('/sale/user/<id>', methods=['GET'])
 @login_required
 def getSalesByUser(id):
@@ -1028,13 +2440,58 @@ def getSalesByUser(id):
             type: string
             description: User ID
             example: 60b2b3b9d9c1b6f5f7e8f7b4
+        -   in: query
+            name: dateLo
+            required: false
+            type: string
+            description: First date included
+            example: 2024-11-04 08:00:00
+        -   in: query
+            name: dateHi
+            required: false
+            type: string
+            description: Last date included. A date without time includes that whole day
+            example: 2024-11-04 16:00:00
+        -   in: query
+            name: limit
+            required: false
+            type: integer
+            description: Page size (1 to 1000). Defaults to 50
+            example: 50
+        -   in: query
+            name: after
+            required: false
+            type: string
+            description: Cursor of the page to retrieve, as returned in "next" by the previous page
+        -   in: query
+            name: order
+            required: false
+            type: string
+            enum: [asc, desc]
+            description: Date order. Defaults to desc (most recent first)
     responses:
         200:
-            description: List of sales for the user
+            description: Page of the sales the user took part in as seller or client, ordered by date, and the cursor of the next page (null on the last one)
             schema:
-            type: array
-            items:
-                $ref: '#/definitions/Sale'
+            type: object
+            properties:
+                items:
+                type: array
+                items:
+                    $ref: '#/definitions/Sale'
+                next:
+                type: string
+                description: Cursor of the next page
+        400:
+            description: Invalid id, dates or pagination parameters
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Invalid pagination cursor
         500:
             description: Internal server error
             schema:
@@ -1046,16 +2503,13 @@ def getSalesByUser(id):
             example:
                 error: Internal server error
     """
-    try:
-        sales = saleHandler.getSalesByUser(id)
-        return jsonify(sales), 200
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    
+    return salesLookup(saleHandler.getSalesByUser, id)
+
 # Provider endpoints
 
 @app.route('/provider', methods=['GET'])
 @login_required
+@conditional('providers')
 def getProviders():
     """
     Get all providers
@@ -1067,6 +2521,39 @@ def getProviders():
             type: string
             description: Access token
             example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+        -   in: header
+            name: If-None-Match
+            required: false
+            type: string
+            description: ETag of a previous response, answered with 304 if the data did not change
+        -   in: header
+            name: If-Modified-Since
+            required: false
+            type: string
+            description: Last-Modified of a previous response, answered with 304 if the data did not change
+        -   in: query
+            name: limit
+            required: false
+            type: integer
+            description: Page size (1 to 1000). When given, the response is a page with the items and the cursor of the next page instead of the whole list
+            example: 100
+        -   in: query
+            name: after
+            required: false
+            type: string
+            description: Cursor of the page to retrieve, as returned in "next" by the previous page
+        -   in: query
+            name: sort
+            required: false
+            type: string
+            enum: [_id, name]
+            description: Field the providers are ordered by. Defaults to _id
+        -   in: query
+            name: order
+            required: false
+            type: string
+            enum: [asc, desc]
+            description: Sort direction. Defaults to asc
     definitions:
         Provider:
             type: object
@@ -1081,11 +2568,23 @@ def getProviders():
                     example: Provider Address
     responses:
         200:
-            description: List of providers
+            description: List of providers, or a page of them when limit is given
             schema:
             type: array
             items:
                 $ref: '#/definitions/Provider'
+        304:
+            description: Not modified since the ETag or date sent by the client
+        400:
+            description: Invalid pagination parameters
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Invalid pagination cursor
         500:
             description: Internal server error
             schema:
@@ -1098,8 +2597,12 @@ def getProviders():
                 error: Internal server error
     """
     try:
+        if isPaged():
+            return pageResponse(*providerHandler.getProvidersPage(**pageArgs()))
         providers = providerHandler.getProviders()
         return dumps(providers), 200
+    except (ValueError, InvalidCursorException) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1168,8 +2671,91 @@ def addProvider():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/provider/bulk', methods=['POST'])
+@login_required(roles=['admin'])
+def addProvidersBulk():
+    """Add many providers at once
+    ---
+    consumes:
+        - application/json
+        - application/x-ndjson
+    parameters:
+        -   in: header
+            name: X-Access-Token
+            required: true
+            type: string
+            description: Access token
+            example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+        -   in: body
+            name: body
+            required: true
+            description: JSON array of providers, or one provider per line when sent as application/x-ndjson
+            schema:
+                type: array
+                items:
+                    $ref: '#/definitions/Provider'
+    responses:
+        200:
+            description: Result of every provider, in the order they were sent
+            schema:
+            type: object
+            properties:
+                created:
+                type: integer
+                description: Number of providers added
+                failed:
+                type: integer
+                description: Number of providers rejected
+                results:
+                type: array
+                description: One result per provider
+            example:
+                created: 1
+                failed: 1
+                results: [{"index": 0, "status": "created", "_id": "60b2b3b9d9c1b6f5f7e8f7b4"}, {"index": 1, "status": "error", "error": "Invalid fields: Provider.__init__() missing 1 required positional argument: 'address'"}]
+        400:
+            description: Invalid request
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Expected a JSON array or an NDJSON stream
+        403:
+            description: Only admins can import providers
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Forbidden
+        500:
+            description: Internal server error
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Internal server error
+    """
+    try:
+        result = importRecords(bulkRecords(), Provider, providerHandler.addProviders)
+        return jsonify(result), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/provider/<id>', methods=['GET'])
 @login_required
+@conditional('providers')
 def getProvider(id):
     """Get a provider by ID
     ---
@@ -1180,6 +2766,16 @@ def getProvider(id):
             type: string
             description: Access token
             example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+        -   in: header
+            name: If-None-Match
+            required: false
+            type: string
+            description: ETag of a previous response, answered with 304 if the data did not change
+        -   in: header
+            name: If-Modified-Since
+            required: false
+            type: string
+            description: Last-Modified of a previous response, answered with 304 if the data did not change
         -   in: path
             name: id
             required: true
@@ -1191,6 +2787,8 @@ def getProvider(id):
             description: Provider details
             schema:
             $ref: '#/definitions/Provider'
+        304:
+            description: Not modified since the ETag or date sent by the client
         404:
             description: Provider not found
             schema:
@@ -1214,7 +2812,7 @@ def getProvider(id):
     """
     try:
         provider = providerHandler.getProviderByID(id)
-        return jsonify(provider), 200
+        return dumps(provider), 200
     except ProviderNotFoundException:
         return jsonify({'error': 'Provider not found'}), 404
     except Exception as e:
@@ -1381,6 +2979,29 @@ def getUsers():
             type: string
             description: Access token
             example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+        -   in: query
+            name: limit
+            required: false
+            type: integer
+            description: Page size (1 to 1000). When given, the response is a page with the items and the cursor of the next page instead of the whole list
+            example: 100
+        -   in: query
+            name: after
+            required: false
+            type: string
+            description: Cursor of the page to retrieve, as returned in "next" by the previous page
+        -   in: query
+            name: sort
+            required: false
+            type: string
+            enum: [_id, email, name]
+            description: Field the users are ordered by. Defaults to _id
+        -   in: query
+            name: order
+            required: false
+            type: string
+            enum: [asc, desc]
+            description: Sort direction. Defaults to asc
     definitions:
         User:
             type: object
@@ -1408,11 +3029,21 @@ def getUsers():
                     example: admin
     responses:
         200:
-            description: List of users
+            description: List of users, or a page of them when limit is given
             schema:
             type: array
             items:
                 $ref: '#/definitions/User'
+        400:
+            description: Invalid pagination parameters
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Invalid pagination cursor
         500:
             description: Internal server error
             schema:
@@ -1425,8 +3056,12 @@ def getUsers():
                 error: Internal server error
     """
     try:
+        if isPaged():
+            return pageResponse(*userHandler.getUsersPage(**pageArgs()))
         users = userHandler.getUsers()
         return dumps(users), 200
+    except (ValueError, InvalidCursorException) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
@@ -1477,6 +3112,16 @@ def addUser():
                 description: Error message
             example:
                 error: Invalid request
+        409:
+            description: User already exists
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: User already exists
         500:
             description: Internal server error
             schema:
@@ -1497,7 +3142,8 @@ def addUser():
         password = data.get('password')
         role = data.get('role')
         user = User(name, lastname, email, cellphone, password, role)
-        userHandler.userRegister(user)
+        if not userHandler.userRegister(user):
+            return jsonify({'error': 'User already exists'}), 409
         return jsonify({'message': 'User added'}), 201
     except ValueError:
         return jsonify({'error': 'Invalid request'}), 400
@@ -1505,6 +3151,90 @@ def addUser():
         print(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
         
+@app.route('/user/bulk', methods=['POST'])
+@login_required(roles=['admin'])
+def addUsersBulk():
+    """Add many users at once
+    ---
+    consumes:
+        - application/json
+        - application/x-ndjson
+    parameters:
+        -   in: header
+            name: X-Access-Token
+            required: true
+            type: string
+            description: Access token
+            example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+        -   in: body
+            name: body
+            required: true
+            description: JSON array of users, or one user per line when sent as application/x-ndjson
+            schema:
+                type: array
+                items:
+                    $ref: '#/definitions/User'
+    responses:
+        200:
+            description: Result of every user, in the order they were sent
+            schema:
+            type: object
+            properties:
+                created:
+                type: integer
+                description: Number of users added
+                failed:
+                type: integer
+                description: Number of users rejected
+                results:
+                type: array
+                description: One result per user
+            example:
+                created: 1
+                failed: 1
+                results: [{"index": 0, "status": "created", "_id": "60b2b3b9d9c1b6f5f7e8f7b4"}, {"index": 1, "status": "error", "error": "E11000 duplicate key error"}]
+        400:
+            description: Invalid request
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Expected a JSON array or an NDJSON stream
+        403:
+            description: Only admins can import users
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Forbidden
+        500:
+            description: Internal server error
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Internal server error
+    """
+    try:
+        result = importRecords(bulkRecords(), User, userHandler.userBulkRegister)
+        return jsonify(result), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except PasswordHasherBusyException:
+        return jsonify({'error': 'Server busy, try again later'}), 503
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/user/<id>', methods=['GET'])
 @login_required
 def getUser(id):
@@ -1607,6 +3337,16 @@ def updateUser(id):
                 description: Error message
             example:
                 error: User not found
+        409:
+            description: User already exists
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: User already exists
         500:
             description: Internal server error
             schema:
@@ -1623,21 +3363,23 @@ def updateUser(id):
         data = request.get_json()
         if currentData is None:
             return jsonify({'error': 'User not found'}), 404
-        if name := data.get('name') is None:
+        if (name := data.get('name')) is None:
             name = currentData['name']
-        if lastname := data.get('lastname') is None:
+        if (lastname := data.get('lastname')) is None:
             lastname = currentData['lastname']
-        if email := data.get('email') is None:
+        if (email := data.get('email')) is None:
             email = currentData['email']
-        if cellphone := data.get('cellphone') is None:
+        if (cellphone := data.get('cellphone')) is None:
             cellphone = currentData['cellphone']
-        if password := data.get('password') is None:
+        if (password := data.get('password')) is None:
             password = currentData['password']
-        if role := data.get('role') is None:
+        if (role := data.get('role')) is None:
             role = currentData['role']
         user = User(name, lastname, email, cellphone, password, role)
         userHandler.updateUser(id, user)
         return jsonify({'message': 'User updated'}), 200
+    except DuplicateKeyError:
+        return jsonify({'error': 'User already exists'}), 409
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1700,6 +3442,68 @@ def deleteUser(id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Metrics endpoints
+
+@app.route('/metrics', methods=['GET'])
+@login_required
+def getMetrics():
+    """Get internal API counters
+    ---
+    parameters:
+        -   in: header
+            name: X-Access-Token
+            required: true
+            type: string
+            description: Access token
+            example: d2bd959809159bc15e26de7a01e7e58750bf8537b9381b32069d6e2017310d57
+    responses:
+        200:
+            description: API counters
+            schema:
+            type: object
+            properties:
+                tokenCache:
+                type: object
+                description: Hits, misses, size and evictions of the in-process token cache
+                revokedTokens:
+                type: integer
+                description: Signed tokens logged out before their expiry
+                tokenSweeper:
+                type: object
+                description: Runs and purged sessions of the expired session sweeper
+                productCatalog:
+                type: object
+                description: Version, reloads, size and age of the in-memory product catalog
+                indexes:
+                type: object
+                description: Indexes created at startup and build errors by collection
+                idempotency:
+                type: object
+                description: Hits, misses and size of the cache of idempotent POST /sale responses
+            example:
+                tokenCache: {"enabled": true, "size": 1, "maxSize": 1024, "hits": 10, "misses": 1, "evictions": 0}
+                revokedTokens: 0
+                tokenSweeper: {"enabled": true, "interval": 300, "runs": 12, "purged": 40, "lastPurged": 2, "lastRun": "2024-11-04T12:00:00", "errors": 0}
+                productCatalog: {"version": 3, "loads": 4, "size": 120, "age": 2.5, "watching": false}
+                indexes: {"building": false, "created": {"sales": ["date"]}, "errors": {}}
+                idempotency: {"size": 2, "maxSize": 1024, "hits": 1, "misses": 2, "evictions": 0}
+        500:
+            description: Internal server error
+            schema:
+            type: object
+            properties:
+                error:
+                type: string
+                description: Error message
+            example:
+                error: Internal server error
+    """
+    try:
+        return jsonify({'tokenCache': tokenHandler.cacheStats(), 'revokedTokens': len(tokenHandler.revocations), 'tokenSweeper': tokenHandler.sweeperStats(), 'productCatalog': productCatalog.stats(), 'indexes': indexManager.stats(), 'idempotency': idempotencyStore.stats()}), 200
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
 #add root endpoint so Cloudflare is happy
 @app.route('/')
 def root():
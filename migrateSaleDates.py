@@ -0,0 +1,70 @@
+"""
+Migration of the sale dates stored as strings (ISO from fillDb.py, "%Y-%m-%d %H:%M:%S" from older API versions)
+to BSON datetimes, the format the API writes and queries.
+
+Sales are streamed from a cursor and updated in batches of unordered bulk writes, so the migration runs in
+constant memory on any collection size and can be interrupted and run again: only the dates still stored as
+strings are read, and each update only applies if the date was not changed in the meantime.
+Dates that cannot be parsed are reported and left untouched.
+
+Strings without offset are read like the API reads them, as UTC, unless --timezone names the timezone of the
+clients that wrote them (fillDb.py and older API versions used the local time of their machine). Strings with an
+offset are converted to UTC whatever the option.
+
+Usage:
+    python migrateSaleDates.py [batchSize] [--dry-run] [--timezone=name]
+    python migrateSaleDates.py 1000 --timezone=America/Bogota
+"""
+
+from datetime import timezone, tzinfo
+from zoneinfo import ZoneInfo
+from pymongo import MongoClient, UpdateOne
+from saleHandler import SaleHandler, parseDate
+from indexManager import IndexManager
+from secret import Secret
+import sys
+
+def migrate(db, batchSize: int = 1000, dryRun: bool = False, tz: tzinfo = timezone.utc) -> dict:
+    stats = {'read': 0, 'migrated': 0, 'invalid': 0}
+    batch = []
+
+    def flush() -> None:
+        if batch and not dryRun:
+            stats['migrated'] += db.sales.bulk_write(batch, ordered=False).modified_count
+        elif batch:
+            stats['migrated'] += len(batch)
+        batch.clear()
+
+    sales = db.sales.find({'date': {'$type': 'string'}}, {'date': 1}, no_cursor_timeout=True).batch_size(batchSize)
+    try:
+        for sale in sales:
+            stats['read'] += 1
+            try:
+                date = parseDate(sale['date'], tz)
+            except ValueError:
+                stats['invalid'] += 1
+                print(f"Sale {sale['_id']} has an invalid date, left as is: {sale['date']!r}")
+                continue
+            batch.append(UpdateOne({'_id': sale['_id'], 'date': sale['date']}, {'$set': {'date': date}}))
+            if len(batch) >= batchSize:
+                flush()
+                print(f"{stats['migrated']} sales migrated")
+        flush()
+    finally:
+        sales.close()
+    return stats
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    dryRun = '--dry-run' in sys.argv
+    batchSize = int(args[0]) if args else 1000
+    names = [arg.split('=', 1)[1] for arg in sys.argv[1:] if arg.startswith('--timezone=')]
+    tz = ZoneInfo(names[0]) if names else timezone.utc
+    secret = Secret()
+    mongo = MongoClient(secret.uri)
+    handler = SaleHandler(secret.dbName, connection=mongo)
+    # the date index makes the range queries of the API index scans once dates are datetimes
+    IndexManager(mongo, secret.dbName, {'sales': SaleHandler.INDEXES}).apply()
+    stats = migrate(handler.conn, batchSize, dryRun, tz)
+    action = 'would be migrated' if dryRun else 'migrated'
+    print(f"{stats['read']} sales with string dates, {stats['migrated']} {action}, {stats['invalid']} invalid")
@@ -0,0 +1,78 @@
+"""
+Keyset (cursor) pagination over MongoDB collections.
+
+Pages are ordered by a sort field with _id as tie breaker, and the next page starts right after the last
+document returned instead of skipping the previous ones, so every page costs the same whatever its position.
+Continuation tokens are opaque base64url strings holding the sort field, the direction and the keys of the last
+document. Documents whose sort field is null or missing sort first in ascending order and last in descending order,
+as MongoDB sorts them. Values of a sort field are expected to share a type (e.g. all dates or all numbers).
+"""
+
+import base64
+import binascii
+from bson import json_util
+from pymongo import ASCENDING, DESCENDING
+from pymongo.collection import Collection
+from exceptions import InvalidCursorException
+
+MAX_LIMIT = 1000
+
+def encodeCursor(sort: str, lastDocument: dict, descending: bool = False) -> str:
+    payload = {'s': sort, 'd': -1 if descending else 1, 'id': lastDocument['_id']}
+    if sort != '_id':
+        payload['v'] = lastDocument.get(sort)
+    return base64.urlsafe_b64encode(json_util.dumps(payload).encode('utf-8')).decode('ascii')
+
+def decodeCursor(cursor: str, sort: str, descending: bool = False) -> dict:
+    try:
+        payload = json_util.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (binascii.Error, ValueError, UnicodeError):
+        raise InvalidCursorException("Invalid pagination cursor")
+    if not isinstance(payload, dict) or payload.get('s') != sort or payload.get('d') != (-1 if descending else 1) or 'id' not in payload:
+        raise InvalidCursorException("Pagination cursor does not match the requested sort")
+    return payload
+
+def paginate(collection: Collection, query: dict, limit: int, after: str = None, sort: str = '_id', descending: bool = False, projection: dict = None) -> tuple[list[dict], str | None]:
+    """
+    Returns one page of the documents of collection matching query, and the cursor of the next page.
+
+    Args:
+        collection (Collection): Collection to read from.
+        query (dict): Filter of the documents.
+        limit (int): Maximum number of documents in the page, between 1 and MAX_LIMIT.
+        after (str, optional): Cursor returned with the previous page. Defaults to None (first page).
+        sort (str, optional): Field the pages are ordered by, it should be indexed. Defaults to '_id'.
+        descending (bool, optional): Whether to order from the highest value. Defaults to False.
+        projection (dict, optional): Projection of the returned documents. Defaults to None.
+
+    Returns:
+        tuple[list[dict], str | None]: The documents of the page and the cursor of the next one (None on the last page).
+
+    Raises:
+        InvalidCursorException: If limit is out of range or after is not a cursor for this sort.
+    """
+    if limit < 1 or limit > MAX_LIMIT:
+        raise InvalidCursorException(f"limit must be between 1 and {MAX_LIMIT}")
+    direction = DESCENDING if descending else ASCENDING
+    comparison = '$lt' if descending else '$gt'
+    if after is not None:
+        position = decodeCursor(after, sort, descending)
+        if sort == '_id':
+            keyset = {'_id': {comparison: position['id']}}
+        else:
+            keyset = {'$or': [{sort: position.get('v'), '_id': {comparison: position['id']}}]}
+            # comparisons never match null or missing values, which sort below every other value
+            if position.get('v') is not None:
+                keyset['$or'].append({sort: {comparison: position['v']}})
+                if descending:
+                    keyset['$or'].append({sort: None})
+            elif not descending:
+                keyset['$or'].append({sort: {'$ne': None}})
+        query = {'$and': [query, keyset]} if query else keyset
+    order = [('_id', direction)] if sort == '_id' else [(sort, direction), ('_id', direction)]
+    # one extra document tells whether there is a next page
+    documents = list(collection.find(query, projection).sort(order).limit(limit + 1))
+    if len(documents) <= limit:
+        return documents, None
+    documents = documents[:limit]
+    return documents, encodeCursor(sort, documents[-1], descending)
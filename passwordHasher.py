@@ -0,0 +1,91 @@
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+from exceptions import PasswordHasherBusyException
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords with bcrypt on a bounded thread pool.
+
+    bcrypt releases the GIL while it works, so running it on a dedicated pool keeps its CPU cost off the
+    Flask request threads and lets several verifications run in parallel. At most maxPending operations
+    may be queued; callers waiting longer than timeout seconds for a slot get a PasswordHasherBusyException.
+
+    Attributes:
+        rounds (int): bcrypt cost factor used for new hashes.
+        workers (int): Number of threads hashing in parallel.
+    """
+    PREFIXES = (b'$2a$', b'$2b$', b'$2y$')
+
+    def __init__(self, rounds: int = 12, workers: int = None, maxPending: int = 64, timeout: float = 10.0) -> None:
+        self.rounds = rounds
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+        self._slots = threading.BoundedSemaphore(maxPending)
+
+    def hash(self, password: str) -> str:
+        return self._submit(self._hash, password)
+
+    def hashMany(self, passwords: list[str]) -> list[str]:
+        """
+        Hashes several passwords in parallel on the pool, returning the hashes in order.
+
+        Every password takes one of the maxPending slots until it is hashed, so large batches wait for slots like
+        single hashes do instead of flooding the pool.
+        """
+        futures = []
+        for password in passwords:
+            if not self._slots.acquire(timeout=self.timeout):
+                raise PasswordHasherBusyException("Too many pending password operations")
+            try:
+                future = self._pool.submit(self._hash, password)
+            except BaseException:
+                self._slots.release()
+                raise
+            future.add_done_callback(lambda _: self._slots.release())
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def verify(self, password: str, stored: str) -> bool:
+        """
+        Checks password against the stored value, which may be a bcrypt hash or a legacy plaintext password.
+        """
+        if stored is None:
+            return False
+        if not self.isHash(stored):
+            return hmac.compare_digest(self._encode(password), self._encode(stored))
+        return self._submit(bcrypt.checkpw, self._encode(password), stored.encode('utf-8'))
+
+    def needsRehash(self, stored: str) -> bool:
+        """
+        Returns True if stored is a plaintext password or a bcrypt hash with a different cost factor.
+        """
+        if not self.isHash(stored):
+            return True
+        return int(stored.split('$')[2]) != self.rounds
+
+    @classmethod
+    def isHash(cls, value) -> bool:
+        return isinstance(value, str) and len(value) == 60 and value.encode('utf-8').startswith(cls.PREFIXES)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False)
+
+    def _hash(self, password: str) -> str:
+        return bcrypt.hashpw(self._encode(password), bcrypt.gensalt(self.rounds)).decode('utf-8')
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PasswordHasherBusyException("Too many pending password operations")
+        try:
+            return self._pool.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _encode(password) -> bytes:
+        # bcrypt only uses the first 72 bytes, newer releases refuse longer inputs instead of truncating
+        return str(password).encode('utf-8')[:72]
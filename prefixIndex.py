@@ -0,0 +1,97 @@
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+def normalize(text: str) -> str:
+    """
+    Folds case and accents so that "cafe" finds "Café".
+    """
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+class PrefixIndex:
+    """
+    In-memory autocomplete index over names, kept as a sorted array searched with bisect.
+
+    Every word of a name is indexed, so "milk" suggests both "Milk" and "Whole milk". Entries can be added and
+    removed one at a time as names change, or the whole index can be rebuilt at once.
+
+    Attributes:
+        version: Tag of the data the index was built from, set by the owner of the index (None until it is built).
+        lock (threading.RLock): Lock to hold while changing the index and its version together.
+    """
+    def __init__(self) -> None:
+        self.version = None
+        self.lock = threading.RLock()
+        self._keys = []
+        self._entries = {}
+
+    def rebuild(self, entries: list[tuple], version=None) -> None:
+        """
+        Replaces the content of the index with entries, (key, name, value) tuples, and tags it with version.
+        """
+        keys, byKey = [], {}
+        for key, name, value in entries:
+            byKey[key] = (name, value)
+            keys.extend((word, key) for word in self._words(name))
+        keys.sort()
+        with self.lock:
+            self._keys = keys
+            self._entries = byKey
+            self.version = version
+
+    def add(self, key, name: str, value) -> None:
+        """
+        Indexes name under key, replacing the name previously indexed under the same key.
+        """
+        with self.lock:
+            self.remove(key)
+            self._entries[key] = (name, value)
+            for word in self._words(name):
+                insort(self._keys, (word, key))
+
+    def remove(self, key) -> None:
+        with self.lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+            for word in self._words(entry[0]):
+                position = bisect_left(self._keys, (word, key))
+                if position < len(self._keys) and self._keys[position] == (word, key):
+                    del self._keys[position]
+
+    def suggest(self, prefix: str, limit: int = 10) -> list:
+        """
+        Returns the values of up to limit names having a word starting with prefix, in alphabetical order of the matching word.
+        """
+        prefix = normalize(prefix.strip())
+        if not prefix or limit < 1:
+            return []
+        with self.lock:
+            keys, entries = self._keys, self._entries
+            found, results = set(), []
+            position = bisect_left(keys, (prefix,))
+            while position < len(keys) and len(results) < limit:
+                word, key = keys[position]
+                if not word.startswith(prefix):
+                    break
+                if key not in found:
+                    found.add(key)
+                    results.append(entries[key][1])
+                position += 1
+            return results
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _words(name: str) -> set[str]:
+        """
+        Returns the suffixes of the normalized name starting at each word, so prefixes can span several words.
+        """
+        name = normalize(name)
+        words = {name}
+        for position, char in enumerate(name):
+            if char.isspace() and position + 1 < len(name) and not name[position + 1].isspace():
+                words.add(name[position + 1:])
+        return words
@@ -0,0 +1,154 @@
+import threading
+import time
+from bson import ObjectId
+from pymongo.collection import Collection
+from pymongo.errors import PyMongoError
+from collectionVersion import CollectionVersion
+
+class ProductCatalog:
+    """
+    Process-local copy of the products collection, indexed by _id and by name.
+
+    The catalog is reloaded on the next read after invalidate() is called (ProductHandler does it on every write)
+    or once it is older than maxStaleness seconds, which bounds how long writes made by other API workers go unseen.
+    With a CollectionVersion, a change of the shared 'products' version (bumped by writes on any worker) also reloads it.
+    When MongoDB runs as a replica set, watch() follows a change stream so those writes invalidate it right away.
+    Stock changes made by sales do not reload it: the quantities are updated in place, by applyStock on the worker
+    selling and from the change stream on the others (otherwise they catch up within maxStaleness).
+    Documents handed out are shared with the catalog and must not be modified by callers.
+
+    Attributes:
+        version (int): Counter bumped on every invalidation.
+        loads (int): Number of times the catalog was (re)loaded from MongoDB.
+    """
+    def __init__(self, collection: Collection, maxStaleness: float = 30.0, versions: CollectionVersion = None) -> None:
+        self.collection = collection
+        self.maxStaleness = maxStaleness
+        self.versions = versions
+        self.version = 0
+        self.loads = 0
+        self._loadedVersion = None
+        self._loadedShared = None
+        self._loadedAt = 0.0
+        self._byId = {}
+        self._byName = {}
+        self._active = []
+        self._lock = threading.RLock()
+        self._watcher = None
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self.version += 1
+
+    def get(self, productId) -> dict | None:
+        """
+        Returns the product (active or not) with the given id, or None if there is none.
+        """
+        self._ensureFresh()
+        return self._byId.get(ObjectId(productId))
+
+    def getByName(self, name: str) -> dict | None:
+        """
+        Returns the active product with the given name, or None if there is none.
+        """
+        self._ensureFresh()
+        return self._byName.get(name)
+
+    def getMany(self, productIds: list) -> dict:
+        """
+        Returns the products found for the given ids as a dict keyed by ObjectId, missing ids are left out.
+        """
+        self._ensureFresh()
+        byId = self._byId
+        return {productId: byId[productId] for productId in map(ObjectId, productIds) if productId in byId}
+
+    def applyStock(self, changes: dict) -> None:
+        """
+        Applies quantity changes (deltas by ObjectId) made by this worker in place instead of reloading the catalog.
+        """
+        with self._lock:
+            if self._loadedVersion is None:
+                return
+            for productId, delta in changes.items():
+                product = self._byId.get(productId)
+                if product is not None:
+                    product['quantity'] = product.get('quantity', 0) + delta
+
+    def activeProducts(self) -> list[dict]:
+        self._ensureFresh()
+        return list(self._active)
+
+    def reload(self) -> None:
+        with self._lock:
+            version = self.version
+            shared = self._sharedVersion()
+            products = list(self.collection.find().sort('_id', 1))
+            self._byId = {product['_id']: product for product in products}
+            self._byName = {product['name']: product for product in products if product.get('_isActive', True)}
+            self._active = [product for product in products if product.get('_isActive', True)]
+            # an invalidation that happened while loading triggers another reload on the next read
+            self._loadedVersion = version
+            self._loadedShared = shared
+            self._loadedAt = time.monotonic()
+            self.loads += 1
+
+    def watch(self) -> bool:
+        """
+        Starts a daemon thread invalidating the catalog on every change stream event of the products collection.
+
+        Returns:
+            bool: False if change streams are not available (e.g. standalone MongoDB), in which case only maxStaleness applies.
+        """
+        try:
+            stream = self.collection.watch()
+        except PyMongoError as e:
+            print(f'Product change stream not available, catalog staleness is bounded by {self.maxStaleness}s: {e}')
+            return False
+        self._watcher = threading.Thread(target=self._follow, args=(stream,), name='product-catalog-watcher', daemon=True)
+        self._watcher.start()
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'version': self.version,
+            'loads': self.loads,
+            'size': len(self._byId),
+            'age': time.monotonic() - self._loadedAt if self._loadedVersion is not None else None,
+            'watching': self._watcher is not None and self._watcher.is_alive()
+        }
+
+    def _ensureFresh(self) -> None:
+        if self._isStale():
+            with self._lock:
+                # another thread may have reloaded while this one was waiting for the lock
+                if self._isStale():
+                    self.reload()
+
+    def _isStale(self) -> bool:
+        if self._loadedVersion != self.version or time.monotonic() - self._loadedAt > self.maxStaleness:
+            return True
+        return self._loadedShared != self._sharedVersion()
+
+    def _sharedVersion(self) -> int | None:
+        if self.versions is None:
+            return None
+        return self.versions.get(self.collection.name)[0]
+
+    def _follow(self, stream) -> None:
+        try:
+            with stream:
+                for event in stream:
+                    self._applyEvent(event)
+        except PyMongoError as e:
+            print(f'Product change stream stopped: {e}')
+
+    def _applyEvent(self, event: dict) -> None:
+        # updates of the quantity alone come from sales, the new quantity is set in place instead of reloading
+        update = event.get('updateDescription') or {}
+        if event.get('operationType') == 'update' and set(update.get('updatedFields', {})) == {'quantity'} and not update.get('removedFields'):
+            with self._lock:
+                product = self._byId.get(event['documentKey']['_id'])
+                if self._loadedVersion is not None and product is not None:
+                    product['quantity'] = update['updatedFields']['quantity']
+                    return
+        self.invalidate()
@@ -1,34 +1,136 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, IndexModel, ASCENDING, TEXT, ReturnDocument
 from product import Product
 from pymongo.results import InsertOneResult, UpdateResult
 from pymongo.server_api import ServerApi
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
-from exceptions import ProductNotFoundException
+from exceptions import ProductNotFoundException, InvalidCursorException
+from pagination import paginate
+from productCatalog import ProductCatalog
+from collectionVersion import CollectionVersion
+from bulkImport import insertMany
+from prefixIndex import PrefixIndex
 
 class ProductHandler:
 
-    def __init__(self,db_name: str,  uri: str = None, connection: MongoClient = None) -> None:
+    # fields list endpoints can be ordered by
+    SORT_FIELDS = ['_id', 'name', 'price']
+    # fields a product update can set
+    UPDATE_FIELDS = ['name', 'description', 'category', 'price', 'status', 'quantity']
+    # active products have unique names, deleted ones keep theirs without blocking it
+    INDEXES = [
+        IndexModel([('name', ASCENDING)], name='unique_active_name', unique=True, partialFilterExpression={'_isActive': True}),
+        # free text search over names and descriptions, name matches weighing more
+        IndexModel([('name', TEXT), ('description', TEXT)], name='name_description_text', weights={'name': 10, 'description': 1}),
+        # search filters, equality first and price last so price ranges and sorts use the index too
+        IndexModel([('_isActive', ASCENDING), ('category', ASCENDING), ('price', ASCENDING)], name='active_category_price'),
+        IndexModel([('_isActive', ASCENDING), ('status', ASCENDING), ('price', ASCENDING)], name='active_status_price')
+    ]
+
+    def __init__(self,db_name: str,  uri: str = None, connection: MongoClient = None, catalog: ProductCatalog = None, versions: CollectionVersion = None, suggestions: PrefixIndex = None) -> None:
         if connection is not None:
             self.connection = connection
         else:
             self.connection = MongoClient(uri, server_api=ServerApi('1'))
         self.db_name = db_name
+        # reads are served from the in-memory catalog when there is one, writes invalidate it
+        self.catalog = catalog
+        # writes bump the shared 'products' version used for ETags and reloads, stock changes the 'products_stock' one
+        self.versions = versions
+        # autocomplete index of active product names, updated in place on writes
+        self.suggestions = suggestions if suggestions is not None else PrefixIndex()
 
     def productRegister(self,product: Product) -> InsertOneResult:
+        """
+        Inserts the product, returning False if an active product already has its name (unique index on name).
+        """
         db = self.connection[self.db_name]
-        validate = db.products.find_one({'name': product.name})
-        if validate is not None:
+        document = product.to_dict()
+        try:
+            result = db.products.insert_one(document).acknowledged
+        except DuplicateKeyError:
             return False
-        return db.products.insert_one(product.to_dict()).acknowledged
+        self._invalidate(lambda index: self._suggestProduct(index, document))
+        return result
+
 
+    def productBulkRegister(self, products: list[Product]) -> list[dict]:
+        """
+        Registers many products with one unordered insert_many, returning one result per product.
+        Duplicated names, in the database or within the batch, are reported by the unique index.
+        """
+        db = self.connection[self.db_name]
+        documents = [product.to_dict() for product in products]
+        results = insertMany(db.products, documents, 'Product already exists')
+        created = [document for document, result in zip(documents, results) if result['status'] == 'created']
+        def suggest(index: PrefixIndex) -> None:
+            for document in created:
+                self._suggestProduct(index, document)
+        if created:
+            self._invalidate(suggest)
+        return results
 
     def getProducts(self) -> list[Product]:
+        if self.catalog is not None:
+            return self.catalog.activeProducts()
         db = self.connection[self.db_name]
         result = db.products.find({'_isActive': True})	
         resultDict = list(result)
         return resultDict
+
+    def getProductsPage(self, limit: int, after: str = None, sort: str = '_id', descending: bool = False) -> tuple[list[dict], str | None]:
+        if sort not in self.SORT_FIELDS:
+            raise InvalidCursorException(f"Products cannot be sorted by {sort}")
+        db = self.connection[self.db_name]
+        return paginate(db.products, {'_isActive': True}, limit, after, sort, descending)
     
+    def searchProducts(self, limit: int, text: str = None, category: str = None, status: str = None, minPrice: float = None, maxPrice: float = None, after: str = None, sort: str = '_id', descending: bool = False) -> tuple[list[dict], str | None]:
+        """
+        Returns one page of the active products matching every filter given, and the cursor of the next page.
+        text is matched against names and descriptions through the text index.
+        """
+        if sort not in self.SORT_FIELDS:
+            raise InvalidCursorException(f"Products cannot be sorted by {sort}")
+        query = {'_isActive': True}
+        if text:
+            query['$text'] = {'$search': text}
+        if category is not None:
+            query['category'] = category
+        if status is not None:
+            query['status'] = status
+        price = {}
+        if minPrice is not None:
+            price['$gte'] = minPrice
+        if maxPrice is not None:
+            price['$lte'] = maxPrice
+        if price:
+            query['price'] = price
+        db = self.connection[self.db_name]
+        return paginate(db.products, query, limit, after, sort, descending)
+    
+    def suggestProducts(self, prefix: str, limit: int = 10) -> list[dict]:
+        """
+        Returns up to limit active products (_id, name and price) with a word of their name starting with prefix.
+
+        Suggestions come from the in-memory prefix index. It is only reloaded from MongoDB when the shared 'products'
+        version shows writes made by other API workers, the writes of this one are applied to it in place.
+        """
+        index = self.suggestions
+        version = self._productsVersion()
+        if index.version != version:
+            with index.lock:
+                if index.version != version:
+                    db = self.connection[self.db_name]
+                    products = db.products.find({'_isActive': True}, {'name': 1, 'price': 1})
+                    index.rebuild([(product['_id'], product['name'], self._suggestion(product)) for product in products], version)
+        return index.suggest(prefix, limit)
+
     def getProductByID(self, product_id) -> Product:
+        if self.catalog is not None:
+            result = self.catalog.get(product_id)
+            if result is None:
+                raise ProductNotFoundException(f"Product with id {product_id} not found")
+            return result
         db = self.connection[self.db_name]
         product_id_object = ObjectId(product_id)
         result = db.products.find_one({'_id': product_id_object})
@@ -36,21 +138,86 @@ class ProductHandler:
             raise ProductNotFoundException(f"Product with id {product_id} not found")
         return result
         
-    def updateProduct(self, product_id, product: Product) -> UpdateResult:
+    def updateProduct(self, product_id, fields: dict) -> dict:
+        """
+        Sets the fields given (of UPDATE_FIELDS, None values being ignored) and leaves the others as stored, so an
+        update without quantity cannot write back a stock that concurrent sales decremented since it was read.
+
+        Raises:
+            ValueError: If no field to update is given.
+            ProductNotFoundException: If there is no product with that id.
+        """
+        update = {field: fields[field] for field in self.UPDATE_FIELDS if fields.get(field) is not None}
+        if not update:
+            raise ValueError(f"At least one of {', '.join(self.UPDATE_FIELDS)} is required")
         db = self.connection[self.db_name]
         product_id_object = ObjectId(product_id)
-        productJson = product.to_dict()
-        productJson['_id'] = product_id_object
-        #print(productJson)
-        result = db.products.update_one({'_id': product_id_object}, {'$set': productJson})
-        if result.modified_count > 0:
-            return {'message': 'Products updated successfully', 'updated_count': result.modified_count}
-        else:
-            return {'message': 'No product was updated', 'updated_count': result.modified_count}
+        result = db.products.find_one_and_update({'_id': product_id_object}, {'$set': update}, return_document=ReturnDocument.AFTER)
+        if result is None:
+            raise ProductNotFoundException(f"Product with id {product_id} not found")
+        self._invalidate(lambda index: self._suggestProduct(index, result))
+        return {'message': 'Products updated successfully', 'updated_count': 1}
 
 
     def deleteProduct(self, product_id) -> UpdateResult:
         db = self.connection[self.db_name]
         product_id_object = ObjectId(product_id)
-        return db.products.update_one({'_id': product_id_object}, {'$set': {'_isActive': False}})
+        result = db.products.update_one({'_id': product_id_object}, {'$set': {'_isActive': False}})
+        self._invalidate(lambda index: index.remove(product_id_object))
+        return result
+
+    def stockChanged(self, deltas: dict[ObjectId, int]) -> None:
+        """
+        Signals stock changes made by sales (quantity deltas by product id) to the catalog, which applies them in place.
+
+        Only the 'products_stock' version is bumped, so product ETags change while the catalogs and prefix indexes
+        of the other workers are not reloaded: prices and names did not change, and sales check the stock with
+        their conditional $inc rather than with the catalog.
+        """
+        if self.catalog is not None:
+            self.catalog.applyStock(deltas)
+        if self.versions is not None:
+            self.versions.bump('products_stock')
+
+    def _invalidate(self, suggest=None) -> None:
+        """
+        Signals a write to the catalog and the other workers, and applies suggest to the prefix index when it is current.
+        """
+        version = None
+        if self.versions is not None:
+            version = self.versions.bump('products')
+        if self.catalog is not None:
+            self.catalog.invalidate()
+        if suggest is not None:
+            self._suggestionsChanged(version, suggest)
+
+    def _suggestionsChanged(self, version: int | None, suggest) -> None:
+        """
+        Applies suggest to the prefix index and moves it to version, when version directly follows the one
+        it was built at. Otherwise another worker wrote in between and the index is reloaded on the next suggestion.
+        """
+        index = self.suggestions
+        with index.lock:
+            if index.version is None:
+                return
+            if version is not None and version != index.version + 1:
+                # another worker wrote since the index was built, it is reloaded on the next suggestion
+                index.version = None
+                return
+            suggest(index)
+            if version is not None:
+                index.version = version
+
+    def _productsVersion(self) -> int:
+        return self.versions.get('products')[0] if self.versions is not None else 0
+
+    def _suggestProduct(self, index: PrefixIndex, product: dict) -> None:
+        if product.get('_isActive', True):
+            index.add(product['_id'], product['name'], self._suggestion(product))
+        else:
+            index.remove(product['_id'])
+
+    @staticmethod
+    def _suggestion(product: dict) -> dict:
+        return {'_id': str(product['_id']), 'name': product['name'], 'price': product.get('price')}
     
\ No newline at end of file
@@ -1,9 +1,13 @@
 from provider import Provider
 import pymongo
+from pymongo import IndexModel, ASCENDING
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from pymongo.results import InsertOneResult, UpdateResult
-from exceptions import ProviderNotFoundException
+from exceptions import ProviderNotFoundException, InvalidCursorException
+from pagination import paginate
+from collectionVersion import CollectionVersion
+from bulkImport import insertMany
 from bson import ObjectId
 
 class ProviderHandler:
@@ -12,15 +16,21 @@ class ProviderHandler:
     Attributes:
         db_name (str): The name of the database.
         connection (MongoClient): The MongoDB client connection.
+        versions (CollectionVersion): Shared collection versions, the 'providers' version is bumped on every write.
+        INDEXES (list[IndexModel]): Indexes of the providers collection, created by the IndexManager.
     Methods:
-        __init__(db_name: str, uri: str = None, connection: MongoClient = None) -> None:
+        __init__(db_name: str, uri: str = None, connection: MongoClient = None, versions: CollectionVersion = None) -> None:
             Initializes the ProviderHandler with a database name, and optionally a URI or an existing MongoClient connection.
         getProviders() -> list[Provider]:
             Retrieves all providers from the database and returns them as a list of Provider objects.
+        getProvidersPage(limit: int, after: str = None, sort: str = '_id', descending: bool = False) -> tuple[list[dict], str | None]:
+            Retrieves one page of providers and the cursor of the next page.
         getProviderByID(provider_id) -> Provider:
             Retrieves a provider by its ID from the database and returns it as a Provider object.
         addProvider(provider: Provider) -> InsertOneResult:
             Adds a new provider to the database and returns the result of the insertion.
+        addProviders(providers: list[Provider]) -> list[dict]:
+            Adds many providers with a single unordered insert and returns one result per provider.
         updateProvider(provider_id, provider: Provider) -> UpdateResult:
             Updates an existing provider in the database by its ID and returns the result of the update.
         deleteProvider(provider_id) -> UpdateResult:
@@ -28,7 +38,13 @@ class ProviderHandler:
         __del__() -> None:
             Closes the MongoDB client connection when the ProviderHandler object is deleted.
     """
-    def __init__(self,db_name: str,  uri: str = None, connection: MongoClient = None) -> None:
+
+    # fields list endpoints can be ordered by
+    SORT_FIELDS = ['_id', 'name']
+    # pages ordered by name
+    INDEXES = [IndexModel([('name', ASCENDING), ('_id', ASCENDING)], name='name')]
+
+    def __init__(self,db_name: str,  uri: str = None, connection: MongoClient = None, versions: CollectionVersion = None) -> None:
         """
         Initializes the provider handler with a database name and optional URI or connection.
 
@@ -36,6 +52,7 @@ class ProviderHandler:
             db_name (str): The name of the database.
             uri (str, optional): The URI for the MongoDB connection. Defaults to None.
             connection (MongoClient, optional): An existing MongoClient connection. Defaults to None.
+            versions (CollectionVersion, optional): Shared collection versions to bump on writes. Defaults to None.
 
         If a connection is provided, it will be used. Otherwise, a new MongoClient will be created using the provided URI.
         """
@@ -44,6 +61,7 @@ class ProviderHandler:
         else:
             self.connection = MongoClient(uri, server_api=ServerApi('1'))
         self.db_name = db_name
+        self.versions = versions
         
     
     def getProviders(self) -> list[Provider]:
@@ -57,6 +75,24 @@ class ProviderHandler:
         result = db.providers.find()
         resultDict = list(result)
         return resultDict
+
+    def getProvidersPage(self, limit: int, after: str = None, sort: str = '_id', descending: bool = False) -> tuple[list[dict], str | None]:
+        """
+        Retrieves one page of providers, ordered by sort, starting after the given cursor.
+
+        Args:
+            limit (int): Maximum number of providers in the page.
+            after (str, optional): Cursor returned with the previous page. Defaults to None (first page).
+            sort (str, optional): Field to order by, one of SORT_FIELDS. Defaults to '_id'.
+            descending (bool, optional): Whether to order from the highest value. Defaults to False.
+
+        Returns:
+            tuple[list[dict], str | None]: The providers of the page and the cursor of the next page (None on the last page).
+        """
+        if sort not in self.SORT_FIELDS:
+            raise InvalidCursorException(f"Providers cannot be sorted by {sort}")
+        db = self.connection[self.db_name]
+        return paginate(db.providers, {}, limit, after, sort, descending)
     
     def getProviderByID(self, provider_id) -> Provider:
         """
@@ -73,6 +109,7 @@ class ProviderHandler:
         result = db.providers.find_one({'_id': ObjectId(provider_id)})
         if result is None:
             raise ProviderNotFoundException(f"Provider with id {provider_id} not found")
+        return result
         
     
     def addProvider(self, provider: Provider) -> InsertOneResult:
@@ -86,7 +123,25 @@ class ProviderHandler:
             InsertOneResult: The result of the insert operation.
         """
         db = self.connection[self.db_name]
-        return db.providers.insert_one(provider.to_dict())
+        result = db.providers.insert_one(provider.to_dict())
+        self._bumpVersion()
+        return result
+    
+    def addProviders(self, providers: list[Provider]) -> list[dict]:
+        """
+        Adds many providers to the database with a single unordered insert_many.
+
+        Args:
+            providers (list[Provider]): The providers to be added.
+
+        Returns:
+            list[dict]: One result per provider, {'status': 'created', '_id': ...} or {'status': 'error', 'error': ...}.
+        """
+        db = self.connection[self.db_name]
+        results = insertMany(db.providers, [provider.to_dict() for provider in providers])
+        if providers:
+            self._bumpVersion()
+        return results
     
     def updateProvider(self, provider_id, provider: Provider) -> UpdateResult:
         """
@@ -100,7 +155,9 @@ class ProviderHandler:
             UpdateResult: The result of the update operation, including details such as the number of documents matched and modified.
         """
         db = self.connection[self.db_name]
-        return db.providers.update_one({'_id': provider_id}, {'$set': provider.to_dict()})
+        result = db.providers.update_one({'_id': provider_id}, {'$set': provider.to_dict()})
+        self._bumpVersion()
+        return result
     
     def deleteProvider(self, provider_id) -> UpdateResult:
         """
@@ -113,7 +170,13 @@ class ProviderHandler:
             UpdateResult: The result of the update operation, indicating the success or failure of the operation.
         """
         db = self.connection[self.db_name]
-        return db.providers.update_one({'_id': provider_id}, {'$set': {'_isActive': False}})
+        result = db.providers.update_one({'_id': provider_id}, {'$set': {'_isActive': False}})
+        self._bumpVersion()
+        return result
+
+    def _bumpVersion(self) -> None:
+        if self.versions is not None:
+            self.versions.bump('providers')
     
     def __del__(self) -> None:
         """
@@ -9,6 +9,7 @@ echo "waiting 5 seconds for the API to start"
 sleep 5
 echo "Running the tests"
 pytest apiTest.py -v -s
+pytest sessionTest.py -v
 echo "Killing the API"
 pkill -f main.py
 echo "Deactivating the conda environment"
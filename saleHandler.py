@@ -1,69 +1,404 @@
 from sale import Sale
-from pymongo import MongoClient
-from datetime import datetime
+from pymongo import MongoClient, UpdateOne, IndexModel, ASCENDING
+from pymongo.errors import PyMongoError
+from datetime import datetime, timedelta, timezone, tzinfo
 from bson import ObjectId
+from bson.errors import InvalidId
+from exceptions import InvalidCursorException, InsufficientStockException, ProductNotFoundException
+from pagination import paginate
+from productCatalog import ProductCatalog
+from collectionVersion import CollectionVersion
+from salesRollup import SalesRollup
+from productHandler import ProductHandler
+from utcTime import utcnow
+
+def parseDate(value: str | datetime, tz: tzinfo = timezone.utc) -> datetime:
+    """
+    Converts a sale date to the naive UTC datetime stored in MongoDB.
+
+    Accepts datetimes and ISO 8601 strings, with or without time (e.g. "2024-11-04", "2024-11-04 12:00:00",
+    "2024-10-31T00:17:45.343090-05:00"). Dates with a timezone are converted to UTC. Naive ones are taken in tz,
+    UTC by default: the API reads every date without offset as UTC, like the dates it stores and defaults to.
+
+    Raises:
+        ValueError: If value is not a date.
+    """
+    if not isinstance(value, datetime):
+        if not isinstance(value, str):
+            raise ValueError(f'Invalid date {value!r}')
+        value = datetime.fromisoformat(value.strip())
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=tz)
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def isDateOnly(value) -> bool:
+    return isinstance(value, str) and len(value.strip()) == 10
+
+def dateCondition(dateLo: datetime | str = None, dateHi: datetime | str = None) -> dict:
+    """
+    Returns the condition on sale dates between dateLo and dateHi, both optional and inclusive.
+    A dateHi without time includes that whole day.
+    """
+    condition = {}
+    if dateLo is not None:
+        condition['$gte'] = parseDate(dateLo)
+    if dateHi is not None:
+        if isDateOnly(dateHi):
+            condition['$lt'] = parseDate(dateHi) + timedelta(days=1)
+        else:
+            condition['$lte'] = parseDate(dateHi)
+    return condition
 
 class SaleHandler:
 
-    def __init__(self, db_name: str, uri: str = None, connection: MongoClient = None) -> None:
+    # fields list endpoints can be ordered by
+    SORT_FIELDS = ['_id', 'date', 'total']
+    INDEXES = [
+        IndexModel([('date', ASCENDING)], name='date'),
+        # sales of a product, a seller or a client by date, _id being the tie breaker of their pages
+        IndexModel([('products.idProducto', ASCENDING), ('date', ASCENDING), ('_id', ASCENDING)], name='product_date_id'),
+        IndexModel([('id_seller', ASCENDING), ('date', ASCENDING), ('_id', ASCENDING)], name='seller_date_id'),
+        IndexModel([('id_client', ASCENDING), ('date', ASCENDING), ('_id', ASCENDING)], name='client_date_id')
+    ]
+
+    def __init__(self, db_name: str, uri: str = None, connection: MongoClient = None, catalog: ProductCatalog = None, versions: CollectionVersion = None, rollup: SalesRollup = None, products: ProductHandler = None) -> None:
         if connection is not None:
             self.connection = connection
         else:
             self.connection = MongoClient(uri)
         self.db_name = db_name
         self.conn = self.connection[self.db_name]
+        # prices are looked up in the in-memory catalog when there is one
+        self.catalog = catalog
+        # stock changes bump the shared 'products_stock' version used for ETags
+        self.versions = versions
+        # recorded sales are added to the daily rollup when there is one
+        self.rollup = rollup
+        # stock changes go through the product handler when there is one, so its suggestions stay current
+        self.products = products
+        # whether the deployment supports multi-document transactions, found out on the first sale
+        self._transactions = None
 
     def getSales(self) -> list[dict]:
         saleConn = self.conn.sales
         sales = saleConn.find()
         return sales
+
+    def getSalesPage(self, limit: int, after: str = None, sort: str = '_id', descending: bool = False) -> tuple[list[dict], str | None]:
+        if sort not in self.SORT_FIELDS:
+            raise InvalidCursorException(f"Sales cannot be sorted by {sort}")
+        return paginate(self.conn.sales, {}, limit, after, sort, descending)
     
-    def getSalesByDate(self, dateLo: datetime , dateHi: datetime) -> list[dict]:
-        saleConn = self.conn.sales
-        sales = saleConn.find({'date': {'$gte': dateLo, '$lte': dateHi}})
-        return sales
-    
-    def getSaleByProduct(self, product_id: int) -> list[dict]:
+    def getSalesByDate(self, dateLo: datetime | str, dateHi: datetime | str) -> list[dict]:
+        """
+        Returns the sales between dateLo and dateHi, both inclusive. A dateHi without time includes that whole day.
+
+        Raises:
+            ValueError: If a date is missing or invalid.
+        """
         saleConn = self.conn.sales
-        sales = saleConn.find({'products.idProducto': product_id})
+        sales = saleConn.find({'date': self.dateRange(dateLo, dateHi)})
         return sales
+
+    def streamSales(self, dateLo: datetime | str = None, dateHi: datetime | str = None, batchSize: int = 1000):
+        """
+        Returns a cursor over the sales between dateLo and dateHi (both optional and inclusive) in date order,
+        fetching batchSize sales per round trip. The cursor does not time out, so it must be closed by the caller.
+
+        Raises:
+            ValueError: If a date is invalid.
+        """
+        date = dateCondition(dateLo, dateHi)
+        return self.conn.sales.find({'date': date} if date else {}, no_cursor_timeout=True).sort('date', ASCENDING).batch_size(batchSize)
+
+    @staticmethod
+    def dateRange(dateLo: datetime | str, dateHi: datetime | str) -> dict:
+        """
+        Returns the condition on the date field matching dateLo to dateHi (see getSalesByDate).
+        """
+        if dateLo is None or dateHi is None:
+            raise ValueError('Both dateLo and dateHi are required')
+        return dateCondition(dateLo, dateHi)
     
-    def getSalesByUser(self, user_id: int) -> list[dict]:
-        saleConn = self.conn.sales
-        sales = saleConn.find({'user_id': user_id})
-        return sales
+    def getSaleByProduct(self, product_id: str, dateLo: datetime | str = None, dateHi: datetime | str = None, limit: int = 50, after: str = None, descending: bool = True) -> tuple[list[dict], str | None]:
+        """
+        Returns a page of the sales including a product, most recent first by default, and the cursor of the next page.
+
+        Product ids are stored as ObjectIds, and as strings by older API versions, both are matched.
+
+        Raises:
+            ValueError: If the id or a date is invalid.
+            InvalidCursorException: If limit or after is invalid.
+        """
+        productId = self._objectId(product_id)
+        return self._salesPage({'products.idProducto': {'$in': [productId, str(productId)]}}, dateLo, dateHi, limit, after, descending)
+
+    def getSalesBySeller(self, seller_id: str, dateLo: datetime | str = None, dateHi: datetime | str = None, limit: int = 50, after: str = None, descending: bool = True) -> tuple[list[dict], str | None]:
+        """
+        Returns a page of the sales made by a seller (see getSaleByProduct).
+        """
+        return self._salesPage({'id_seller': self._objectId(seller_id)}, dateLo, dateHi, limit, after, descending)
+
+    def getSalesByClient(self, client_id: str, dateLo: datetime | str = None, dateHi: datetime | str = None, limit: int = 50, after: str = None, descending: bool = True) -> tuple[list[dict], str | None]:
+        """
+        Returns a page of the sales made to a client (see getSaleByProduct).
+        """
+        return self._salesPage({'id_client': self._objectId(client_id)}, dateLo, dateHi, limit, after, descending)
+
+    def getSalesByUser(self, user_id: str, dateLo: datetime | str = None, dateHi: datetime | str = None, limit: int = 50, after: str = None, descending: bool = True) -> tuple[list[dict], str | None]:
+        """
+        Returns a page of the sales a user took part in, as seller or as client (see getSaleByProduct).
+        """
+        userId = self._objectId(user_id)
+        return self._salesPage({'$or': [{'id_seller': userId}, {'id_client': userId}]}, dateLo, dateHi, limit, after, descending)
+
+    def _salesPage(self, query: dict, dateLo: datetime | str, dateHi: datetime | str, limit: int, after: str, descending: bool) -> tuple[list[dict], str | None]:
+        """
+        Returns a page of the sales matching query between dateLo and dateHi, ordered by date then _id. With an
+        equality on id_seller, id_client or products.idProducto, the page is a range scan of their (field, date, _id) index.
+        """
+        date = dateCondition(dateLo, dateHi)
+        if date:
+            query = {**query, 'date': date}
+        return paginate(self.conn.sales, query, limit, after, 'date', descending)
+
+    @staticmethod
+    def _objectId(id: str) -> ObjectId:
+        try:
+            return ObjectId(id)
+        except (InvalidId, TypeError):
+            raise ValueError(f'Invalid id {id}')
     
-    def makeSale(self, id_seller: str, id_client: str, products: list[dict], date: str) -> dict:
-        total = 0
-        productReceiptDetails = []
+    def makeSale(self, id_seller: str, id_client: str, products: list[dict], date: str | datetime) -> dict:
+        """
+        Records a sale and takes the quantities sold out of the stock of the products.
+
+        All the products of the sale are resolved at once, from the catalog or with a single query.
+
+        Raises:
+            ValueError: If the date or a product id is invalid, or a quantity is not a positive integer.
+            ProductNotFoundException: If products do not exist, all of them being listed in the message.
+            InsufficientStockException: If a product does not have enough stock, in which case nothing is written.
+
+        Once the sale is written the method returns normally, so any exception means it was not recorded.
+        """
+        date = parseDate(date)
+        lines = self._parseLines(products)
+        found = self._lookupProducts([productId for productId, _ in lines])
+        sale, receipt, stock = self._priceSale(id_seller, id_client, lines, date, found)
+        self._recordSales([sale], stock)
+        return receipt
+
+    def makeSales(self, sales: list[dict]) -> list[dict]:
+        """
+        Records many sales at once, e.g. the sales replayed by a terminal after a connectivity gap.
+
+        The products of all the sales are resolved with one lookup and priced like in makeSale. Sales are accepted in
+        order while the stock allows it, and the accepted ones are written with one stock bulk_write and one insert_many.
+
+        Args:
+            sales (list[dict]): Sales with the fields of POST /sale (id_seller, id_client, products, date).
+
+        Returns:
+            list[dict]: One result per sale, { "status": "created", "_id": "...", "total": 0.0 } or { "status": "error", "error": "..." }.
+
+        Raises:
+            InsufficientStockException: If the stock changed concurrently between the lookup and the write, in which case nothing is written.
+        """
+        results = [None] * len(sales)
+        parsed = []
+        for index, data in enumerate(sales):
+            try:
+                if not isinstance(data, dict) or not data.get('id_seller') or not data.get('id_client') or not isinstance(data.get('products'), list):
+                    raise ValueError('Sale must be a JSON object with id_seller, id_client and a list of products')
+                date = parseDate(data['date']) if data.get('date') is not None else utcnow()
+                parsed.append((index, data, date, self._parseLines(data['products'])))
+            except (ValueError, KeyError, TypeError) as e:
+                results[index] = {'status': 'error', 'error': str(e)}
+        found = self._lookupProducts([productId for _, _, _, lines in parsed for productId, _ in lines])
+        available = {productId: product.get('quantity', 0) for productId, product in found.items()}
+        accepted = []
+        stock = {}
+        for index, data, date, lines in parsed:
+            try:
+                sale, receipt, saleStock = self._priceSale(data.get('id_seller'), data.get('id_client'), lines, date, found)
+            except (ProductNotFoundException, ValueError) as e:
+                results[index] = {'status': 'error', 'error': str(e)}
+                continue
+            short = [str(productId) for productId, quantity in saleStock.items() if available[productId] - stock.get(productId, 0) < quantity]
+            if short:
+                results[index] = {'status': 'error', 'error': f"Insufficient stock for products {', '.join(short)}"}
+                continue
+            for productId, quantity in saleStock.items():
+                stock[productId] = stock.get(productId, 0) + quantity
+            accepted.append((index, sale, receipt))
+        if accepted:
+            self._recordSales([sale for _, sale, _ in accepted], stock)
+        for index, sale, receipt in accepted:
+            results[index] = {'status': 'created', '_id': str(sale['_id']), 'total': receipt['total']}
+        return results
+
+    def _parseLines(self, products: list[dict]) -> list[tuple[ObjectId, dict]]:
+        """
+        Validates the line items of a sale, returning them with the ObjectId of their product.
+
+        Raises:
+            ValueError: If products is not a list of { "idProducto", "quantity" } objects, or a line is invalid.
+        """
+        if not isinstance(products, list):
+            raise ValueError('products must be a list')
+        lines = []
         for product in products:
             if product is not None:  
-                productResult = self.conn.products.find_one({'_id': ObjectId(product['idProducto'])})
-                productResult = dict(productResult)
-                if (productPrice := productResult['price']) is None:
-                    return {'error': f'Product {product["idProducto"]} not found'}
-                total += productPrice * product['quantity']
-                productReceiptDetails.append({
-                    'quantity': product['quantity'],
-                    'product': productResult['name'],
-                    'price': productPrice,
-                    'subtotal': productPrice * product['quantity']
-                })
-        saleConn = self.conn.sales
-        saleConn.insert_one({
-            'id_seller': ObjectId(id_seller),
-            'id_client': ObjectId(id_client),
-            'products': products,
+                if not isinstance(product, dict) or 'idProducto' not in product or 'quantity' not in product:
+                    raise ValueError('Each product must be a JSON object with idProducto and quantity')
+                quantity = product['quantity']
+                if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+                    raise ValueError(f'Invalid quantity for product {product["idProducto"]}')
+                try:
+                    lines.append((ObjectId(product['idProducto']), product))
+                except (InvalidId, TypeError):
+                    raise ValueError(f'Invalid product id {product["idProducto"]}')
+        return lines
+
+    def _lookupProducts(self, productIds: list[ObjectId]) -> dict[ObjectId, dict]:
+        """
+        Returns the name, price and stock of the given products, keyed by ObjectId, with one $in query or from the catalog.
+        """
+        if self.catalog is not None:
+            return self.catalog.getMany(productIds)
+        products = self.conn.products.find({'_id': {'$in': list(set(productIds))}}, {'name': 1, 'price': 1, 'quantity': 1})
+        return {product['_id']: product for product in products}
+
+    def _priceSale(self, id_seller: str, id_client: str, lines: list[tuple[ObjectId, dict]], date: datetime, found: dict[ObjectId, dict]) -> tuple[dict, dict, dict[ObjectId, int]]:
+        """
+        Computes the sale document, its receipt and the quantities sold by product from the resolved products.
+
+        Raises:
+            ValueError: If the seller or client id is invalid.
+            ProductNotFoundException: If products of the lines are missing from found.
+        """
+        try:
+            # ObjectId(None) would generate a new id instead of failing
+            if id_seller is None or id_client is None:
+                raise TypeError
+            sellerId, clientId = ObjectId(id_seller), ObjectId(id_client)
+        except (InvalidId, TypeError):
+            raise ValueError(f'Invalid seller or client id {id_seller}, {id_client}')
+        missing = [str(productId) for productId, _ in lines if found.get(productId, {}).get('price') is None]
+        if missing:
+            raise ProductNotFoundException(f"Products {', '.join(dict.fromkeys(missing))} not found")
+        total = 0
+        saleLines = []
+        productReceiptDetails = []
+        stock = {}
+        for productId, product in lines:
+            productResult = found[productId]
+            productPrice = productResult['price']
+            subtotal = productPrice * product['quantity']
+            total += subtotal
+            stock[productId] = stock.get(productId, 0) + product['quantity']
+            # the unit price is kept with the line, so later price changes do not alter past sales
+            saleLines.append({**product, 'idProducto': productId, 'price': productPrice})
+            productReceiptDetails.append({
+                'quantity': product['quantity'],
+                'product': productResult['name'],
+                'price': productPrice,
+                'subtotal': subtotal
+            })
+        sale = {
+            'id_seller': sellerId,
+            'id_client': clientId,
+            'products': saleLines,
             'date': date,
             'total': total
-        })
-        return {
+        }
+        receipt = {
             'seller': id_seller,
             'client': id_client,
             'date': date,
             'total': total,
             'products': productReceiptDetails
         }
+        return sale, receipt, stock
+
+    def _recordSales(self, sales: list[dict], stock: dict[ObjectId, int]) -> None:
+        """
+        Inserts the sales and decrements the stock of their products (quantities by product id) as a whole.
+
+        With a replica set, all the decrements are sent in one bulk_write of conditional $inc and committed with the
+        sales in a single transaction. Standalone servers have no transactions, so the decrements are applied one by
+        one, and if one of them or the insert fails, the sales already inserted are removed and the decrements undone.
+        """
+        if self._supportsTransactions():
+            def transaction(session) -> None:
+                self._decrementStock(stock, session)
+                self._insertSales(sales, session)
+            with self.connection.start_session() as session:
+                session.with_transaction(transaction)
+        else:
+            applied = {}
+            inserting = False
+            try:
+                for productId, quantity in stock.items():
+                    result = self.conn.products.update_one({'_id': productId, 'quantity': {'$gte': quantity}}, {'$inc': {'quantity': -quantity}})
+                    if result.matched_count == 0:
+                        raise InsufficientStockException(f"Insufficient stock for products {productId}")
+                    applied[productId] = quantity
+                inserting = True
+                self._insertSales(sales)
+            except Exception:
+                if inserting:
+                    # an unordered insert_many can store part of the sales before failing, the batch is all or nothing
+                    self.conn.sales.delete_many({'_id': {'$in': [sale['_id'] for sale in sales if '_id' in sale]}})
+                if applied:
+                    self.conn.products.bulk_write([UpdateOne({'_id': productId}, {'$inc': {'quantity': quantity}}) for productId, quantity in applied.items()])
+                raise
+        # the sales are committed from here on, so nothing after this may fail the request: a client retrying it
+        # (e.g. with the same Idempotency-Key) would record them twice
+        try:
+            self._stockChanged(stock)
+            if self.rollup is not None:
+                self.rollup.record(sales)
+        except Exception as e:
+            print(f'Sales recorded, but updating the catalog, versions or rollup failed: {e}')
+
+    def _insertSales(self, sales: list[dict], session=None) -> None:
+        if len(sales) == 1:
+            self.conn.sales.insert_one(sales[0], session=session)
+        else:
+            self.conn.sales.insert_many(sales, ordered=False, session=session)
+
+    def _decrementStock(self, stock: dict[ObjectId, int], session) -> None:
+        if not stock:
+            # sales without line items, bulk_write refuses an empty list
+            return
+        operations = [UpdateOne({'_id': productId, 'quantity': {'$gte': quantity}}, {'$inc': {'quantity': -quantity}}) for productId, quantity in stock.items()]
+        result = self.conn.products.bulk_write(operations, ordered=False, session=session)
+        if result.matched_count != len(operations):
+            # read outside the transaction, which is aborted and whose decrements are discarded
+            available = {product['_id']: product.get('quantity', 0) for product in self.conn.products.find({'_id': {'$in': list(stock)}}, {'quantity': 1})}
+            short = [str(productId) for productId, quantity in stock.items() if available.get(productId, 0) < quantity]
+            raise InsufficientStockException(f"Insufficient stock for products {', '.join(short)}")
+
+    def _stockChanged(self, stock: dict[ObjectId, int]) -> None:
+        if self.products is not None:
+            self.products.stockChanged({productId: -quantity for productId, quantity in stock.items()})
+            return
+        if self.catalog is not None:
+            self.catalog.applyStock({productId: -quantity for productId, quantity in stock.items()})
+        if self.versions is not None:
+            self.versions.bump('products_stock')
+
+    def _supportsTransactions(self) -> bool:
+        if self._transactions is None:
+            try:
+                hello = self.connection.admin.command('hello')
+                # transactions need a replica set or a sharded cluster
+                self._transactions = 'setName' in hello or hello.get('msg') == 'isdbgrid'
+            except PyMongoError:
+                self._transactions = False
+        return self._transactions
 
             
     
\ No newline at end of file
@@ -0,0 +1,218 @@
+"""
+Columnar export of the sales, one row per line item, to Parquet, Arrow IPC or gzip CSV files.
+
+Sales are read from a cursor batchSize at a time, each batch being flattened into an Arrow record batch and
+appended to the file before the next one is read, so the export runs in constant memory whatever the number of
+sales. Files are written next to their destination and renamed once complete, a failed export leaving nothing
+behind. ExportJobs runs exports in background threads for the API.
+
+Usage:
+    python salesExport.py path [parquet|arrow|csv] [dateLo] [dateHi]
+    python salesExport.py sales-2024.parquet parquet 2024-01-01 2024-12-31
+"""
+
+import os
+import sys
+import threading
+import uuid
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from exceptions import ExportNotFoundException
+from saleHandler import SaleHandler, parseDate, dateCondition
+from pymongo import MongoClient
+from secret import Secret
+
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow', 'csv': '.csv.gz'}
+MIMETYPES = {'parquet': 'application/vnd.apache.parquet', 'arrow': 'application/vnd.apache.arrow.file', 'csv': 'application/gzip'}
+DEFAULT_BATCH_SIZE = 5000
+
+SCHEMA = pa.schema([
+    ('sale_id', pa.string()),
+    ('date', pa.timestamp('ms')),
+    ('id_seller', pa.string()),
+    ('id_client', pa.string()),
+    ('total', pa.float64()),
+    ('line', pa.int32()),
+    ('product_id', pa.string()),
+    ('quantity', pa.int64()),
+    ('price', pa.float64())
+])
+
+def exportSales(handler: SaleHandler, path: str, format: str = 'parquet', dateLo: datetime | str = None, dateHi: datetime | str = None, batchSize: int = DEFAULT_BATCH_SIZE, progress=None) -> dict:
+    """
+    Writes the sales between dateLo and dateHi (both optional and inclusive) to path, one row per line item.
+
+    Args:
+        progress (callable, optional): Called with the running counts ({ "sales": int, "rows": int }) after every batch.
+
+    Returns:
+        dict: { "sales": int, "rows": int } exported.
+
+    Raises:
+        ValueError: If the format or a date is invalid.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    counts = {'sales': 0, 'rows': 0}
+    partial = path + '.part'
+    cursor = handler.streamSales(dateLo, dateHi, batchSize)
+    try:
+        writer = _writer(format, partial)
+        try:
+            for batch in _recordBatches(cursor, batchSize, counts):
+                writer.write_batch(batch)
+                if progress is not None:
+                    progress(dict(counts))
+        finally:
+            writer.close()
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        cursor.close()
+    return counts
+
+def _writer(format: str, path: str):
+    if format == 'parquet':
+        return pq.ParquetWriter(path, SCHEMA, compression='zstd')
+    if format == 'arrow':
+        return pa.ipc.new_file(path, SCHEMA)
+    return _CsvWriter(path)
+
+class _CsvWriter:
+    """
+    pyarrow CSV writer on a gzip stream, closing both.
+    """
+    def __init__(self, path: str) -> None:
+        self.stream = pa.CompressedOutputStream(path, 'gzip')
+        self.writer = pacsv.CSVWriter(self.stream, SCHEMA)
+
+    def write_batch(self, batch: pa.RecordBatch) -> None:
+        self.writer.write_batch(batch)
+
+    def close(self) -> None:
+        self.writer.close()
+        self.stream.close()
+
+def _recordBatches(cursor, batchSize: int, counts: dict):
+    columns = {field: [] for field in SCHEMA.names}
+
+    def flush() -> pa.RecordBatch:
+        batch = pa.RecordBatch.from_pydict(columns, schema=SCHEMA)
+        for values in columns.values():
+            values.clear()
+        return batch
+
+    sales = 0
+    for sale in cursor:
+        sales += 1
+        counts['sales'] += 1
+        date = sale.get('date')
+        if isinstance(date, str):
+            try:
+                date = parseDate(date)
+            except ValueError:
+                date = None
+        for line, item in enumerate(sale.get('products', [])):
+            counts['rows'] += 1
+            columns['sale_id'].append(str(sale['_id']))
+            columns['date'].append(date)
+            columns['id_seller'].append(_string(sale.get('id_seller')))
+            columns['id_client'].append(_string(sale.get('id_client')))
+            columns['total'].append(sale.get('total'))
+            columns['line'].append(line)
+            columns['product_id'].append(_string(item.get('idProducto')))
+            columns['quantity'].append(item.get('quantity'))
+            columns['price'].append(item.get('price'))
+        if sales >= batchSize:
+            sales = 0
+            yield flush()
+    if columns['sale_id']:
+        yield flush()
+
+def _string(value) -> str | None:
+    return None if value is None else str(value)
+
+class ExportJobs:
+    """
+    Sales exports running in background threads, their files written to a directory.
+
+    Jobs are kept in memory, so their state is lost on restart (the files stay). Files older than maxAge seconds are
+    deleted when a new export starts.
+    """
+    def __init__(self, handler: SaleHandler, directory: str = 'exports', maxAge: int = 86400) -> None:
+        self.handler = handler
+        self.directory = directory
+        self.maxAge = maxAge
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def start(self, format: str = 'parquet', dateLo: datetime | str = None, dateHi: datetime | str = None) -> dict:
+        """
+        Starts an export and returns its job.
+
+        Raises:
+            ValueError: If the format or a date is invalid, checked before the job starts.
+        """
+        if format not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        # dates are checked here so a typo is reported to the caller instead of failing the job
+        dateCondition(dateLo, dateHi)
+        os.makedirs(self.directory, exist_ok=True)
+        self._prune()
+        id = uuid.uuid4().hex
+        job = {'id': id, 'status': 'running', 'format': format, 'dateLo': dateLo, 'dateHi': dateHi, 'sales': 0, 'rows': 0,
+               'error': None, 'created': datetime.now(), 'finished': None, 'file': os.path.join(self.directory, f'sales-{id}{FORMATS[format]}')}
+        with self.lock:
+            self.jobs[id] = job
+
+        def run() -> None:
+            try:
+                counts = exportSales(self.handler, job['file'], format, dateLo, dateHi, progress=job.update)
+                job.update(counts, status='done')
+            except Exception as e:
+                print(f'Sales export {id} failed: {e}')
+                job.update(status='failed', error=str(e))
+            finally:
+                job['finished'] = datetime.now()
+
+        threading.Thread(target=run, name=f'sales-export-{id}', daemon=True).start()
+        return self.get(id)
+
+    def get(self, id: str) -> dict:
+        """
+        Returns a copy of a job.
+
+        Raises:
+            ExportNotFoundException: If there is no job with that id.
+        """
+        with self.lock:
+            if id not in self.jobs:
+                raise ExportNotFoundException(f'Export {id} not found')
+            return dict(self.jobs[id])
+
+    def _prune(self) -> None:
+        now = datetime.now()
+        with self.lock:
+            for id, job in list(self.jobs.items()):
+                if job['finished'] is not None and (now - job['finished']).total_seconds() > self.maxAge:
+                    if os.path.exists(job['file']):
+                        os.remove(job['file'])
+                    del self.jobs[id]
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python salesExport.py path [parquet|arrow|csv] [dateLo] [dateHi]')
+        sys.exit(1)
+    path = sys.argv[1]
+    format = sys.argv[2] if len(sys.argv) > 2 else 'parquet'
+    dateLo = sys.argv[3] if len(sys.argv) > 3 else None
+    dateHi = sys.argv[4] if len(sys.argv) > 4 else None
+    secret = Secret()
+    handler = SaleHandler(secret.dbName, connection=MongoClient(secret.uri))
+    counts = exportSales(handler, path, format, dateLo, dateHi, progress=lambda counts: print(f"{counts['sales']} sales exported", end='\r'))
+    print(f"{counts['sales']} sales exported to {path}, {counts['rows']} rows")
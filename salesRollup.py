@@ -0,0 +1,130 @@
+"""
+Daily sales rollup kept in the 'sales_daily' collection, so analytics read a few documents per day instead of every sale.
+
+Each document holds the totals of one day (UTC, from the stored sale dates) for one dimension:
+    { "day": datetime, "dimension": "day", "key": null, "sales": 3, "units": 12, "revenue": 150.0 }
+    { "day": datetime, "dimension": "seller", "key": seller_id, "sales": 2, "units": 7, "revenue": 90.0 }
+    { "day": datetime, "dimension": "product", "key": product_id, "sales": 1, "units": 5, "revenue": 50.0 }
+sales counts the sales of the day (for products, the sales that include the product), units the quantities sold
+and revenue the sale totals (for products, quantity by unit price of the lines that store it).
+
+SaleHandler updates the rollup after every recorded sale with upserted $inc, and the rebuild command recomputes
+it from the sales collection, e.g. to backfill the history:
+
+Usage:
+    python salesRollup.py rebuild [dateLo] [dateHi]
+    python salesRollup.py rebuild 2024-01-01 2024-12-31
+"""
+
+from pymongo import MongoClient, UpdateOne, IndexModel, ASCENDING
+from pymongo.errors import PyMongoError
+from datetime import datetime, timedelta
+from bson import ObjectId
+from secret import Secret
+import sys
+
+class SalesRollup:
+
+    INDEXES = [IndexModel([('dimension', ASCENDING), ('key', ASCENDING), ('day', ASCENDING)], name='dimension_key_day', unique=True)]
+
+    def __init__(self, connection: MongoClient, db: str) -> None:
+        self.connection = connection
+        self.db = db
+
+    def record(self, sales: list[dict]) -> None:
+        """
+        Adds recorded sales to the rollup with one unordered bulk_write of upserted $inc.
+
+        Errors are logged and do not fail the sale, the rebuild command fixes the days they left behind.
+        """
+        increments = {}
+
+        def add(day: datetime, dimension: str, key, units: int, revenue: float) -> None:
+            totals = increments.setdefault((day, dimension, key), {'sales': 0, 'units': 0, 'revenue': 0})
+            totals['sales'] += 1
+            totals['units'] += units
+            totals['revenue'] += revenue
+
+        for sale in sales:
+            day = self.day(sale['date'])
+            units = sum(line['quantity'] for line in sale['products'])
+            add(day, 'day', None, units, sale['total'])
+            add(day, 'seller', sale['id_seller'], units, sale['total'])
+            products = {}
+            for line in sale['products']:
+                product = products.setdefault(ObjectId(line['idProducto']), [0, 0])
+                product[0] += line['quantity']
+                product[1] += line['quantity'] * line.get('price', 0)
+            for productId, (quantity, revenue) in products.items():
+                add(day, 'product', productId, quantity, revenue)
+        operations = [
+            UpdateOne({'day': day, 'dimension': dimension, 'key': key}, {'$inc': totals}, upsert=True)
+            for (day, dimension, key), totals in increments.items()
+        ]
+        if not operations:
+            return
+        try:
+            self.connection[self.db].sales_daily.bulk_write(operations, ordered=False)
+        except PyMongoError as e:
+            print(f'Could not update the sales rollup, rebuild it to catch up: {e}')
+
+    def rebuild(self, dateLo: datetime = None, dateHi: datetime = None) -> int:
+        """
+        Recomputes the rollup of the days between dateLo and dateHi, both included as whole days (the whole
+        history by default), from the sales.
+
+        The totals are computed and written by the server ($group then $merge), so nothing but the command goes
+        through the client. It is meant for backfills and quiet hours: a sale recorded in a rebuilt day while it
+        runs makes the $merge fail on the unique index, and the rebuild has to be run again.
+
+        Returns:
+            int: Number of rollup documents of the rebuilt days.
+        """
+        db = self.connection[self.db]
+        date = {}
+        if dateLo is not None:
+            date['$gte'] = self.day(dateLo)
+        if dateHi is not None:
+            date['$lt'] = self.day(dateHi) + timedelta(days=1)
+        db.sales_daily.delete_many({'day': date} if date else {})
+        match = [{'$match': {'date': date}}] if date else []
+        day = {'$dateTrunc': {'date': '$date', 'unit': 'day'}}
+        # the days were emptied above, so every computed document is inserted
+        merge = {'$merge': {'into': 'sales_daily', 'whenMatched': 'fail', 'whenNotMatched': 'insert'}}
+        for dimension, key in [('day', None), ('seller', '$id_seller')]:
+            db.sales.aggregate(match + [
+                {'$group': {'_id': {'day': day, 'key': key}, 'sales': {'$sum': 1}, 'units': {'$sum': {'$sum': '$products.quantity'}}, 'revenue': {'$sum': '$total'}}},
+                {'$project': {'_id': 0, 'day': '$_id.day', 'dimension': {'$literal': dimension}, 'key': '$_id.key', 'sales': 1, 'units': 1, 'revenue': 1}},
+                merge
+            ])
+        db.sales.aggregate(match + [
+            {'$unwind': '$products'},
+            {'$group': {
+                '_id': {'day': day, 'sale': '$_id', 'key': {'$convert': {'input': '$products.idProducto', 'to': 'objectId', 'onError': None, 'onNull': None}}},
+                'units': {'$sum': '$products.quantity'},
+                'revenue': {'$sum': {'$multiply': ['$products.quantity', {'$ifNull': ['$products.price', 0]}]}}
+            }},
+            # a product appearing in several lines of a sale counts as one sale
+            {'$group': {'_id': {'day': '$_id.day', 'key': '$_id.key'}, 'sales': {'$sum': 1}, 'units': {'$sum': '$units'}, 'revenue': {'$sum': '$revenue'}}},
+            {'$match': {'_id.key': {'$ne': None}}},
+            {'$project': {'_id': 0, 'day': '$_id.day', 'dimension': {'$literal': 'product'}, 'key': '$_id.key', 'sales': 1, 'units': 1, 'revenue': 1}},
+            merge
+        ])
+        return db.sales_daily.count_documents({'day': date} if date else {})
+
+    @staticmethod
+    def day(date: datetime) -> datetime:
+        return date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+if __name__ == '__main__':
+    from saleHandler import parseDate
+    from indexManager import IndexManager
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        print('Usage: python salesRollup.py rebuild [dateLo] [dateHi]')
+        sys.exit(1)
+    secret = Secret()
+    rollup = SalesRollup(MongoClient(secret.uri), secret.dbName)
+    IndexManager(rollup.connection, rollup.db, {'sales_daily': SalesRollup.INDEXES}).apply()
+    dateLo = parseDate(sys.argv[2]) if len(sys.argv) > 2 else None
+    dateHi = parseDate(sys.argv[3]) if len(sys.argv) > 3 else None
+    print(f'{rollup.rebuild(dateLo, dateHi)} rollup documents rebuilt')
@@ -0,0 +1,179 @@
+import re
+from pymongo import MongoClient
+from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from saleHandler import dateCondition
+from salesRollup import SalesRollup
+
+class SalesStats:
+    """
+    Sales totals grouped by period, seller or product, computed by aggregation pipelines inside MongoDB.
+
+    Only the aggregated rows leave the server, whatever the number of sales. Every grouping can be restricted
+    to a date range (dateLo and dateHi, both inclusive, a dateHi without time including that whole day).
+    Periods are truncated with $dateTrunc and require MongoDB 5.0 or newer.
+
+    With the 'rollup' source, totals are summed from the daily rollup (see SalesRollup) instead of the sales,
+    a few documents per day whatever the number of sales. Rollup days are UTC days and ranges cover the whole
+    days they touch.
+    """
+
+    GRANULARITIES = ['day', 'week', 'month', 'year']
+    SOURCES = ['sales', 'rollup']
+    # UTC offsets accepted by $dateTrunc, e.g. +05, +0530, -05:30
+    UTC_OFFSET = re.compile(r'[+-]\d{2}(:?\d{2})?')
+
+    def __init__(self, db_name: str, uri: str = None, connection: MongoClient = None, source: str = 'sales') -> None:
+        if connection is not None:
+            self.connection = connection
+        else:
+            self.connection = MongoClient(uri)
+        self.db_name = db_name
+        self.conn = self.connection[self.db_name]
+        # source used when a method is not given one
+        self.source = source
+
+    def byPeriod(self, granularity: str = 'day', dateLo: datetime | str = None, dateHi: datetime | str = None, timezone: str = 'UTC', source: str = None) -> list[dict]:
+        """
+        Returns the total and number of sales of every period with sales, in chronological order.
+
+        Args:
+            granularity (str, optional): day, week (starting on monday), month or year. Defaults to 'day'.
+            dateLo (datetime | str, optional): First date included. Defaults to None (no limit).
+            dateHi (datetime | str, optional): Last date included. Defaults to None (no limit).
+            timezone (str, optional): Timezone the periods start in (Olson name or UTC offset). Defaults to 'UTC'.
+            source (str, optional): sales or rollup. Defaults to the source of the instance.
+
+        Returns:
+            list[dict]: { "period": datetime, "total": float, "sales": int } rows, period being the start of the period in UTC.
+
+        Raises:
+            ValueError: If the granularity, a date, the timezone or the source is invalid, or if a timezone other than UTC is asked from the rollup.
+        """
+        if granularity not in self.GRANULARITIES:
+            raise ValueError(f"granularity must be one of {', '.join(self.GRANULARITIES)}")
+        self._checkTimezone(timezone)
+        rollup = self._isRollup(source)
+        if rollup and timezone != 'UTC':
+            raise ValueError('The rollup only has UTC days, use the sales source for other timezones')
+        period = {'date': '$day' if rollup else '$date', 'unit': granularity, 'timezone': timezone}
+        if granularity == 'week':
+            period['startOfWeek'] = 'monday'
+        if rollup:
+            pipeline = self._rollupMatch('day', dateLo, dateHi) + [
+                {'$group': {'_id': {'$dateTrunc': period}, 'total': {'$sum': '$revenue'}, 'sales': {'$sum': '$sales'}}}
+            ]
+        else:
+            pipeline = self._match(dateLo, dateHi) + [
+                {'$group': {'_id': {'$dateTrunc': period}, 'total': {'$sum': '$total'}, 'sales': {'$sum': 1}}}
+            ]
+        pipeline += [
+            {'$sort': {'_id': 1}},
+            {'$project': {'_id': 0, 'period': '$_id', 'total': 1, 'sales': 1}}
+        ]
+        return self._aggregate(rollup, pipeline)
+
+    def bySeller(self, dateLo: datetime | str = None, dateHi: datetime | str = None, limit: int = None, source: str = None) -> list[dict]:
+        """
+        Returns the total and number of sales of every seller, highest total first.
+
+        Returns:
+            list[dict]: { "seller": ObjectId, "name": str, "lastname": str, "total": float, "sales": int } rows.
+        """
+        rollup = self._isRollup(source)
+        if rollup:
+            pipeline = self._rollupMatch('seller', dateLo, dateHi) + [
+                {'$group': {'_id': '$key', 'total': {'$sum': '$revenue'}, 'sales': {'$sum': '$sales'}}}
+            ]
+        else:
+            pipeline = self._match(dateLo, dateHi) + [
+                {'$group': {'_id': '$id_seller', 'total': {'$sum': '$total'}, 'sales': {'$sum': 1}}}
+            ]
+        pipeline.append({'$sort': {'total': -1, '_id': 1}})
+        if limit is not None:
+            pipeline.append({'$limit': limit})
+        # names are joined once the sales are grouped, one lookup per seller
+        pipeline += [
+            {'$lookup': {'from': 'users', 'localField': '_id', 'foreignField': '_id', 'as': 'user', 'pipeline': [{'$project': {'name': 1, 'lastname': 1}}]}},
+            {'$project': {'_id': 0, 'seller': '$_id', 'name': {'$first': '$user.name'}, 'lastname': {'$first': '$user.lastname'}, 'total': 1, 'sales': 1}}
+        ]
+        return self._aggregate(rollup, pipeline)
+
+    def byProduct(self, dateLo: datetime | str = None, dateHi: datetime | str = None, limit: int = None, source: str = None) -> list[dict]:
+        """
+        Returns the quantity sold and revenue of every product, most sold first.
+
+        Product ids stored as strings or ObjectIds are counted together. The revenue only covers the line items
+        that store their unit price, i.e. the sales recorded since prices are kept with them.
+
+        Returns:
+            list[dict]: { "product": ObjectId, "name": str, "quantity": int, "revenue": float, "sales": int } rows.
+        """
+        rollup = self._isRollup(source)
+        if rollup:
+            pipeline = self._rollupMatch('product', dateLo, dateHi) + [
+                {'$group': {'_id': '$key', 'quantity': {'$sum': '$units'}, 'revenue': {'$sum': '$revenue'}, 'sales': {'$sum': '$sales'}}}
+            ]
+        else:
+            pipeline = self._match(dateLo, dateHi) + [
+                {'$unwind': '$products'},
+                {'$group': {
+                    '_id': {'sale': '$_id', 'product': {'$convert': {'input': '$products.idProducto', 'to': 'objectId', 'onError': None, 'onNull': None}}},
+                    'quantity': {'$sum': '$products.quantity'},
+                    'revenue': {'$sum': {'$multiply': ['$products.quantity', '$products.price']}}
+                }},
+                # a product appearing in several lines of a sale counts as one sale
+                {'$group': {'_id': '$_id.product', 'quantity': {'$sum': '$quantity'}, 'revenue': {'$sum': '$revenue'}, 'sales': {'$sum': 1}}},
+                {'$match': {'_id': {'$ne': None}}}
+            ]
+        pipeline.append({'$sort': {'quantity': -1, '_id': 1}})
+        if limit is not None:
+            pipeline.append({'$limit': limit})
+        pipeline += [
+            {'$lookup': {'from': 'products', 'localField': '_id', 'foreignField': '_id', 'as': 'product', 'pipeline': [{'$project': {'name': 1}}]}},
+            {'$project': {'_id': 0, 'product': '$_id', 'name': {'$first': '$product.name'}, 'quantity': 1, 'revenue': 1, 'sales': 1}}
+        ]
+        return self._aggregate(rollup, pipeline)
+
+    @staticmethod
+    def _match(dateLo: datetime | str = None, dateHi: datetime | str = None) -> list[dict]:
+        """
+        Returns the $match stage of the date range, first in the pipeline so it uses the date index.
+        """
+        date = dateCondition(dateLo, dateHi)
+        return [{'$match': {'date': date}}] if date else []
+
+    @staticmethod
+    def _rollupMatch(dimension: str, dateLo: datetime | str = None, dateHi: datetime | str = None) -> list[dict]:
+        """
+        Returns the $match stage of the rollup documents of a dimension, on the days the date range touches.
+        """
+        match = {'dimension': dimension}
+        day = dateCondition(dateLo, dateHi)
+        if '$gte' in day:
+            day['$gte'] = SalesRollup.day(day['$gte'])
+        if day:
+            match['day'] = day
+        return [{'$match': match}]
+
+    @classmethod
+    def _checkTimezone(cls, timezone: str) -> None:
+        """
+        Raises ValueError if timezone is neither a known Olson name nor a UTC offset, before it reaches MongoDB.
+        """
+        if isinstance(timezone, str) and cls.UTC_OFFSET.fullmatch(timezone):
+            return
+        try:
+            ZoneInfo(timezone)
+        except (ZoneInfoNotFoundError, ValueError, TypeError):
+            raise ValueError(f'Unknown timezone: {timezone}')
+
+    def _isRollup(self, source: str = None) -> bool:
+        source = source if source is not None else self.source
+        if source not in self.SOURCES:
+            raise ValueError(f"source must be one of {', '.join(self.SOURCES)}")
+        return source == 'rollup'
+
+    def _aggregate(self, rollup: bool, pipeline: list[dict]) -> list[dict]:
+        collection = self.conn.sales_daily if rollup else self.conn.sales
+        return list(collection.aggregate(pipeline))
@@ -10,4 +10,27 @@ class Secret:
             self.dbName = config['MongoDB']['dbName']
             self.providerCollection = config['MongoDB']['providerCollection']
             self.token_ttl = config['API']['token_ttl']
-            self.secret = config['API']['secret']
\ No newline at end of file
+            self.secret = config['API']['secret']
+            # optional settings
+            self.token_cache_size = config['API'].get('token_cache_size', 1024)
+            self.token_cache_max_age = config['API'].get('token_cache_max_age', 60)
+            self.stateless_tokens = config['API'].get('stateless_tokens', False)
+            self.revocation_refresh = config['API'].get('revocation_refresh', 5)
+            self.token_sweep_interval = config['API'].get('token_sweep_interval', 0)
+            self.bcrypt_rounds = config['API'].get('bcrypt_rounds', 12)
+            self.hash_workers = config['API'].get('hash_workers')
+            self.catalog_max_staleness = config['API'].get('catalog_max_staleness', 30)
+            self.catalog_change_stream = config['API'].get('catalog_change_stream', False)
+            self.version_cache_age = config['API'].get('version_cache_age', 1)
+            # foreground (before serving), background (while serving) or none (indexManager.py is run separately)
+            self.index_build = config['API'].get('index_build', 'foreground')
+            # whether sales update the daily rollup, and whether stats are read from it (rollup) or from the sales
+            self.sales_rollup = config['API'].get('sales_rollup', True)
+            self.stats_source = config['API'].get('stats_source', 'sales')
+            # directory of the sales exports, deleted after export_max_age seconds
+            self.export_dir = config['API'].get('export_dir', 'exports')
+            self.export_max_age = config['API'].get('export_max_age', 86400)
+            # seconds idempotency keys of POST /sale are kept, and after which an unfinished request can be retried
+            self.idempotency_ttl = config['API'].get('idempotency_ttl', 86400)
+            self.idempotency_lock_timeout = config['API'].get('idempotency_lock_timeout', 60)
+            self.redis_uri = config.get('Redis', {}).get('uri')
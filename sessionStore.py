@@ -0,0 +1,170 @@
+import json
+import datetime
+import threading
+from pymongo import MongoClient, ASCENDING, IndexModel
+from utcTime import utcnow
+
+class SessionStore:
+    """
+    Interface of the backends where TokenHandler keeps its sessions.
+
+    A session is a dict with at least the 'user' and 'ttl' (naive UTC expiry datetime) keys.
+    Methods:
+        save(token: str, session: dict) -> None:
+            Stores the session under token until session['ttl'].
+        load(token: str) -> dict | None:
+            Returns the session stored under token, or None if there is none.
+        delete(token: str) -> bool:
+            Removes the session stored under token and returns whether there was one.
+        revoke(tokenId: str, ttl: datetime) -> None:
+            Records a signed token as logged out until its expiry.
+        revoked() -> dict[str, datetime]:
+            Returns the revoked signed tokens that have not expired yet.
+        purgeExpired() -> int:
+            Removes expired sessions and revocations, returning how many were removed.
+    """
+    def save(self, token: str, session: dict) -> None:
+        raise NotImplementedError
+
+    def load(self, token: str) -> dict | None:
+        raise NotImplementedError
+
+    def delete(self, token: str) -> bool:
+        raise NotImplementedError
+
+    def revoke(self, tokenId: str, ttl: datetime.datetime) -> None:
+        raise NotImplementedError
+
+    def revoked(self) -> dict[str, datetime.datetime]:
+        raise NotImplementedError
+
+    def purgeExpired(self) -> int:
+        return 0
+
+class MongoSessionStore(SessionStore):
+    """
+    Keeps sessions in the 'tokens' collection of the API database, the token being the document _id.
+
+    Both 'tokens' and 'revoked_tokens' carry a TTL index on 'ttl' so MongoDB removes expired entries by itself.
+    """
+    INDEXES = [IndexModel([('ttl', ASCENDING)], name='ttl_expiry', expireAfterSeconds=0)]
+
+    def __init__(self, connection: MongoClient, db: str) -> None:
+        self.connection = connection
+        self.db = db
+
+    def save(self, token: str, session: dict) -> None:
+        self.connection[self.db].tokens.insert_one({'_id': token, **session})
+
+    def load(self, token: str) -> dict | None:
+        return self.connection[self.db].tokens.find_one({'_id': token})
+
+    def delete(self, token: str) -> bool:
+        return self.connection[self.db].tokens.delete_one({'_id': token}).deleted_count > 0
+
+    def revoke(self, tokenId: str, ttl: datetime.datetime) -> None:
+        self.connection[self.db].revoked_tokens.update_one({'_id': tokenId}, {'$set': {'ttl': ttl}}, upsert=True)
+
+    def revoked(self) -> dict[str, datetime.datetime]:
+        result = self.connection[self.db].revoked_tokens.find({'ttl': {'$gt': utcnow()}})
+        return {item['_id']: item['ttl'] for item in result}
+
+    def purgeExpired(self) -> int:
+        # the TTL monitor only runs once a minute, this lets the sweeper remove expired entries right away
+        db = self.connection[self.db]
+        now = utcnow()
+        purged = db.tokens.delete_many({'ttl': {'$lt': now}}).deleted_count
+        purged += db.revoked_tokens.delete_many({'ttl': {'$lt': now}}).deleted_count
+        return purged
+
+class RedisSessionStore(SessionStore):
+    """
+    Keeps sessions in Redis as JSON strings, expiring them natively at the session ttl.
+
+    Sessions are shared by every API worker pointing at the same Redis, and reads never touch MongoDB.
+    """
+    def __init__(self, redis, prefix: str = 'session:', revokedKey: str = 'revoked_tokens') -> None:
+        """
+        Args:
+            redis (Redis): A redis.Redis client (or a compatible stand-in such as fakeredis).
+            prefix (str, optional): Prefix added to every session key. Defaults to 'session:'.
+            revokedKey (str, optional): Sorted set holding revoked signed tokens scored by expiry. Defaults to 'revoked_tokens'.
+        """
+        self.redis = redis
+        self.prefix = prefix
+        self.revokedKey = revokedKey
+
+    def save(self, token: str, session: dict) -> None:
+        seconds = int((session['ttl'] - utcnow()).total_seconds())
+        payload = {**session, 'ttl': session['ttl'].isoformat()}
+        self.redis.set(self.prefix + token, json.dumps(payload, default=str), ex=max(seconds, 1))
+
+    def load(self, token: str) -> dict | None:
+        payload = self.redis.get(self.prefix + token)
+        if payload is None:
+            return None
+        session = json.loads(payload)
+        session['ttl'] = datetime.datetime.fromisoformat(session['ttl'])
+        return session
+
+    def delete(self, token: str) -> bool:
+        return self.redis.delete(self.prefix + token) > 0
+
+    def revoke(self, tokenId: str, ttl: datetime.datetime) -> None:
+        self.redis.zadd(self.revokedKey, {tokenId: ttl.replace(tzinfo=datetime.timezone.utc).timestamp()})
+
+    def revoked(self) -> dict[str, datetime.datetime]:
+        now = utcnow().replace(tzinfo=datetime.timezone.utc).timestamp()
+        self.redis.zremrangebyscore(self.revokedKey, '-inf', now)
+        result = self.redis.zrangebyscore(self.revokedKey, now, '+inf', withscores=True)
+        return {
+            tokenId.decode('utf-8') if isinstance(tokenId, bytes) else tokenId: datetime.datetime.fromtimestamp(score, datetime.timezone.utc).replace(tzinfo=None)
+            for tokenId, score in result
+        }
+
+    def purgeExpired(self) -> int:
+        # sessions expire natively, only the revocation set needs trimming
+        now = utcnow().replace(tzinfo=datetime.timezone.utc).timestamp()
+        return self.redis.zremrangebyscore(self.revokedKey, '-inf', now)
+
+class MemorySessionStore(SessionStore):
+    """
+    Keeps sessions in a dict of the current process. Meant for tests and single worker development setups.
+    """
+    def __init__(self) -> None:
+        self.sessions = {}
+        self.revocations = {}
+        self._lock = threading.Lock()
+
+    def save(self, token: str, session: dict) -> None:
+        with self._lock:
+            self.sessions[token] = dict(session)
+
+    def load(self, token: str) -> dict | None:
+        with self._lock:
+            session = self.sessions.get(token)
+            return dict(session) if session is not None else None
+
+    def delete(self, token: str) -> bool:
+        with self._lock:
+            return self.sessions.pop(token, None) is not None
+
+    def revoke(self, tokenId: str, ttl: datetime.datetime) -> None:
+        with self._lock:
+            self.revocations[tokenId] = ttl
+
+    def revoked(self) -> dict[str, datetime.datetime]:
+        now = utcnow()
+        with self._lock:
+            return {tokenId: ttl for tokenId, ttl in self.revocations.items() if ttl > now}
+
+    def purgeExpired(self) -> int:
+        now = utcnow()
+        with self._lock:
+            expiredSessions = [token for token, session in self.sessions.items() if session['ttl'] < now]
+            expiredRevocations = [tokenId for tokenId, ttl in self.revocations.items() if ttl < now]
+            for token in expiredSessions:
+                del self.sessions[token]
+            for tokenId in expiredRevocations:
+                del self.revocations[tokenId]
+            return len(expiredSessions) + len(expiredRevocations)
@@ -0,0 +1,112 @@
+import pytest
+import fakeredis
+import time
+from datetime import timedelta
+from exceptions import ExpiredTokenException, TokenNotInSessionException
+from sessionStore import RedisSessionStore, MemorySessionStore
+from utcTime import utcnow
+from tokenHandler import TokenHandler, TokenSweeper
+
+SECRET = "test-secret"
+
+@pytest.fixture(params=["redis", "memory"])
+def store(request):
+    """Fixture giving each session store backend, Redis being served by fakeredis"""
+    if request.param == "redis":
+        return RedisSessionStore(fakeredis.FakeRedis())
+    return MemorySessionStore()
+
+def session(**ttl):
+    """Session expiring after the given timedelta arguments"""
+    return {"ttl": (utcnow() + timedelta(**ttl)).replace(microsecond=0), "user": "john.doe@example.com", "role": "admin", "userId": "60b2b3b9d9c1b6f5f7e8f7b4"}
+
+def test_store_save_load_delete(store):
+    """Test a session is loaded as saved until it is deleted"""
+    saved = session(hours=1)
+    store.save("token", saved)
+    assert store.load("token") == saved
+    assert store.delete("token")
+    assert store.load("token") is None
+    assert not store.delete("token")
+
+def test_store_revocations(store):
+    """Test revoked tokens are listed until their expiry and purged after it"""
+    expiry = (utcnow() + timedelta(hours=1)).replace(microsecond=0)
+    store.revoke("active", expiry)
+    store.revoke("expired", utcnow() - timedelta(seconds=1))
+    assert store.revoked() == {"active": expiry}
+
+def test_redis_store_expiry():
+    """Test Redis expires sessions by itself at their ttl"""
+    redis = fakeredis.FakeRedis()
+    store = RedisSessionStore(redis)
+    store.save("long", session(hours=1))
+    assert 3590 <= redis.ttl("session:long") <= 3600
+    store.save("short", session(seconds=1))
+    time.sleep(1.5)
+    assert store.load("short") is None
+    assert store.load("long") is not None
+
+def test_memory_store_purge_expired():
+    """Test expired sessions and revocations are purged and counted"""
+    store = MemorySessionStore()
+    store.save("active", session(hours=1))
+    store.save("expired", session(seconds=-1))
+    store.revoke("expired", utcnow() - timedelta(seconds=1))
+    assert store.purgeExpired() == 2
+    assert store.load("expired") is None
+    assert store.load("active") is not None
+    assert store.purgeExpired() == 0
+
+def test_sweeper_counts():
+    """Test the sweeper counts its runs, purged entries and failures"""
+    store = MemorySessionStore()
+    store.save("expired", session(seconds=-1))
+    store.save("other", session(seconds=-1))
+    sweeper = TokenSweeper(store, 60)
+    assert sweeper.sweep() == 2
+    assert sweeper.sweep() == 0
+    stats = sweeper.stats()
+    assert stats["runs"] == 2 and stats["purged"] == 2 and stats["lastPurged"] == 0 and stats["errors"] == 0
+    assert stats["lastRun"] is not None
+
+    def fail():
+        raise ConnectionError("store down")
+    store.purgeExpired = fail
+    assert sweeper.sweep() == 0
+    assert sweeper.stats()["errors"] == 1 and sweeper.stats()["runs"] == 2
+
+def test_logout_evicts_cached_session():
+    """Test a logged out token is rejected even though its session was cached"""
+    tokens = TokenHandler(1, SECRET, None, None, store=MemorySessionStore())
+    token = tokens.generate("john.doe@example.com", "admin", "60b2b3b9d9c1b6f5f7e8f7b4")["token"]
+    assert tokens.getSession(token)["role"] == "admin"
+    assert tokens.getSession(token)["user"] == "john.doe@example.com"
+    assert tokens.cacheStats()["hits"] == 2
+    tokens.delete(token)
+    with pytest.raises(TokenNotInSessionException):
+        tokens.getSession(token)
+    with pytest.raises(TokenNotInSessionException):
+        tokens.delete(token)
+
+def test_expired_session():
+    """Test an expired session is rejected and removed from the store"""
+    store = MemorySessionStore()
+    store.save("expired", session(seconds=-1))
+    tokens = TokenHandler(1, SECRET, None, None, store=store)
+    with pytest.raises(ExpiredTokenException):
+        tokens.getSession("expired")
+    assert store.load("expired") is None
+
+def test_signed_token_revocation(store):
+    """Test a logged out signed token is rejected by every worker sharing the store"""
+    worker = TokenHandler(1, SECRET, None, None, store=store, stateless=True, revocationRefresh=0)
+    other = TokenHandler(1, SECRET, None, None, store=store, stateless=True, revocationRefresh=0)
+    token = worker.generate("john.doe@example.com", "admin", "60b2b3b9d9c1b6f5f7e8f7b4")["token"]
+    assert other.getSession(token)["userId"] == "60b2b3b9d9c1b6f5f7e8f7b4"
+    worker.delete(token)
+    for handler in [worker, other]:
+        with pytest.raises(TokenNotInSessionException):
+            handler.getSession(token)
+    with pytest.raises(TokenNotInSessionException):
+        other.getSession(token[:-1] + ("A" if token[-1] != "A" else "B"))
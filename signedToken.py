@@ -0,0 +1,98 @@
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+import datetime
+from exceptions import ExpiredTokenException, TokenNotInSessionException
+from sessionStore import SessionStore
+
+class SignedTokenCodec:
+    """
+    Encodes and verifies stateless access tokens of the form <payload>.<signature>.
+
+    The payload is a base64url JSON object (user, role, exp as a unix timestamp) and the signature is
+    its HMAC-SHA256 keyed by the API secret, so verifying a token needs no I/O at all.
+    """
+    def __init__(self, secret: str) -> None:
+        self.key = secret.encode('utf-8')
+
+    def encode(self, payload: dict) -> str:
+        body = self._b64encode(json.dumps(payload, separators=(',', ':'), sort_keys=True, default=str).encode('utf-8'))
+        return f'{body}.{self._sign(body)}'
+
+    def decode(self, token: str) -> dict:
+        """
+        Returns the payload of token.
+
+        Raises:
+            TokenNotInSessionException: If the token is malformed or its signature does not match.
+            ExpiredTokenException: If the token is past its expiry.
+        """
+        try:
+            body, signature = token.split('.')
+        except ValueError:
+            raise TokenNotInSessionException("Malformed token")
+        if not hmac.compare_digest(signature, self._sign(body)):
+            raise TokenNotInSessionException("Invalid token signature")
+        payload = json.loads(self._b64decode(body))
+        if payload['exp'] < time.time():
+            raise ExpiredTokenException("Token expired")
+        return payload
+
+    @staticmethod
+    def signature(token: str) -> str:
+        """
+        Returns the signature part of token, used to identify it in the revocation list.
+        """
+        return token.rsplit('.', 1)[-1]
+
+    @staticmethod
+    def isSigned(token: str) -> bool:
+        return '.' in token
+
+    def _sign(self, body: str) -> str:
+        return self._b64encode(hmac.new(self.key, body.encode('utf-8'), hashlib.sha256).digest())
+
+    @staticmethod
+    def _b64encode(data: bytes) -> str:
+        return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+    @staticmethod
+    def _b64decode(data: str) -> bytes:
+        return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+class RevocationList:
+    """
+    Signed tokens that were logged out before their expiry.
+
+    The list is kept in memory and checked without I/O. Revocations are persisted in the session store
+    so other workers pick them up when they refresh, at most every refreshInterval seconds.
+    """
+    def __init__(self, store: SessionStore, refreshInterval: int = 5) -> None:
+        self.store = store
+        self.refreshInterval = refreshInterval
+        self._revoked = {}
+        self._lastRefresh = 0.0
+        self._lock = threading.Lock()
+
+    def revoke(self, tokenId: str, ttl: datetime.datetime) -> None:
+        self.store.revoke(tokenId, ttl)
+        with self._lock:
+            self._revoked[tokenId] = ttl
+
+    def isRevoked(self, tokenId: str) -> bool:
+        if time.monotonic() - self._lastRefresh > self.refreshInterval:
+            self.refresh()
+        with self._lock:
+            return tokenId in self._revoked
+
+    def refresh(self) -> None:
+        revoked = self.store.revoked()
+        with self._lock:
+            self._revoked = revoked
+            self._lastRefresh = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._revoked)
@@ -0,0 +1,48 @@
+"""
+Streamed serialization of MongoDB cursors for list endpoints.
+
+Documents are serialized as the cursor yields them and sent batchSize documents at a time, so memory stays
+constant whatever the size of the result and the first documents leave before the query is exhausted.
+The cursor is closed when the stream ends or the client goes away.
+"""
+
+from typing import Iterator
+from bson import json_util
+from pymongo.cursor import Cursor
+
+DEFAULT_BATCH_SIZE = 500
+MAX_BATCH_SIZE = 10000
+
+def ndjson(cursor: Cursor, batchSize: int = DEFAULT_BATCH_SIZE) -> Iterator[str]:
+    """
+    Yields the documents of cursor as NDJSON (one Extended JSON document per line), batchSize lines at a time.
+    """
+    try:
+        for batch in _batches(cursor, batchSize):
+            yield ''.join(line + '\n' for line in batch)
+    finally:
+        cursor.close()
+
+def jsonArray(cursor: Cursor, batchSize: int = DEFAULT_BATCH_SIZE) -> Iterator[str]:
+    """
+    Yields the documents of cursor as a single JSON array, the same body dumps(list(cursor)) would produce, in chunks.
+    """
+    try:
+        yield '['
+        separator = ''
+        for batch in _batches(cursor, batchSize):
+            yield separator + ', '.join(batch)
+            separator = ', '
+        yield ']'
+    finally:
+        cursor.close()
+
+def _batches(cursor: Cursor, batchSize: int) -> Iterator[list[str]]:
+    batch = []
+    for document in cursor.batch_size(batchSize):
+        batch.append(json_util.dumps(document))
+        if len(batch) >= batchSize:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -1,41 +1,171 @@
 import hashlib
 import datetime
+import threading
 from flask import jsonify
 from pymongo import MongoClient
 from exceptions import ExpiredTokenException, TokenNotInSessionException
+from sessionStore import SessionStore, MongoSessionStore
+from utcTime import utcnow
+from signedToken import SignedTokenCodec, RevocationList
+from ttlCache import TTLCache
 
 class TokenHandler:
     
-    def __init__(self, ttl: int, secret: str, connection: MongoClient, db: str) -> None:
+    def __init__(self, ttl: int, secret: str, connection: MongoClient, db: str, cacheSize: int = 1024, cacheMaxAge: int = 60, store: SessionStore = None, stateless: bool = False, revocationRefresh: int = 5) -> None:
         self.secret = secret
         self.ttl = ttl
         self.mongoConnect = connection
         self.db = db
+        # sessions live in MongoDB unless another backend (e.g. Redis) is given
+        self.store = store if store is not None else MongoSessionStore(connection, db)
+        # validated tokens are cached in-process so login_required does not hit the store on every request,
+        # cacheMaxAge bounds how long a logout done by another worker can go unnoticed
+        self.cache = TTLCache(cacheSize, clock=utcnow) if cacheSize else None
+        self.cacheMaxAge = cacheMaxAge
+        # in stateless mode tokens are HMAC signed payloads verified without I/O,
+        # only tokens logged out before their expiry are kept (in the revocation list)
+        self.stateless = stateless
+        self.codec = SignedTokenCodec(secret)
+        self.revocations = RevocationList(self.store, revocationRefresh)
+        self.sweeper = None
     
-    def generate(self, user: str) -> dict:
-        token = hashlib.sha256(f'{user}{str(datetime.datetime.now())}'.encode("utf-8")).hexdigest()
-        ttl = datetime.datetime.now() + datetime.timedelta(hours=self.ttl)
+    def generate(self, user: str, role: str = None, userId: str = None) -> dict:
+        ttl = utcnow() + datetime.timedelta(hours=self.ttl)
+        if self.stateless:
+            token = self.codec.encode({'user': user, 'role': role, 'id': userId, 'exp': int(ttl.replace(tzinfo=datetime.timezone.utc).timestamp())})
+        else:
+            token = hashlib.sha256(f'{user}{str(datetime.datetime.now())}'.encode("utf-8")).hexdigest()
+            session = {"ttl": ttl, "user": user, "role": role, "userId": userId}
+            self.store.save(token, session)
+            self._cacheSession(token, session)
         result = {
             'token': token,
             'ttl': ttl,
-            'user': user
+            'user': user,
+            'role': role
         }
-        db = self.mongoConnect[self.db]
-        db.tokens.insert_one({"_id": token, "ttl": ttl, "user": user})
         return result
     
     def auth(self, token: str) -> bool:
-        db = self.mongoConnect[self.db]
-        token = db.tokens.find_one({"_id": token})
-        if token is None:
+        return self.getSession(token) is not None
+
+    def getSession(self, token: str) -> dict:
+        """
+        Returns the session of a valid token: 'user' (email), 'role', 'userId' and 'ttl'.
+        'role' and 'userId' are None for sessions created before they were stored.
+
+        Raises:
+            TokenNotInSessionException: If the token is unknown, invalid or was logged out.
+            ExpiredTokenException: If the token expired.
+        """
+        # signed tokens are accepted whatever the current mode, so switching modes does not log everyone out
+        if self.codec.isSigned(token):
+            payload = self.codec.decode(token)
+            if self.revocations.isRevoked(self.codec.signature(token)):
+                raise TokenNotInSessionException("Token not found in session")
+            return {
+                'user': payload['user'],
+                'role': payload.get('role'),
+                'userId': payload.get('id'),
+                'ttl': datetime.datetime.fromtimestamp(payload['exp'], datetime.timezone.utc).replace(tzinfo=None)
+            }
+        if self.cache is not None and (session := self.cache.get(token)) is not None:
+            return session
+        session = self.store.load(token)
+        if session is None:
             raise TokenNotInSessionException("Token not found in session")
-        if token['ttl'] < datetime.datetime.now():
-            db.tokens.delete_one({"_id": token})
+        if session['ttl'] < utcnow():
+            self.store.delete(token)
             raise ExpiredTokenException("Token expired")
-        return True
+        self._cacheSession(token, session)
+        return session
 
     def delete(self, token: str) -> None:
-        db = self.mongoConnect[self.db]
-        result = db.tokens.delete_one({"_id": token})
-        if result.deleted_count == 0:
-            raise TokenNotInSessionException("Token not found in session")
\ No newline at end of file
+        if self.codec.isSigned(token):
+            try:
+                payload = self.codec.decode(token)
+            except ExpiredTokenException:
+                raise TokenNotInSessionException("Token not found in session")
+            self.revocations.revoke(self.codec.signature(token), datetime.datetime.fromtimestamp(payload['exp'], datetime.timezone.utc).replace(tzinfo=None))
+            return
+        if self.cache is not None:
+            self.cache.pop(token)
+        if not self.store.delete(token):
+            raise TokenNotInSessionException("Token not found in session")
+
+    def startSweeper(self, interval: int) -> 'TokenSweeper':
+        """
+        Starts a daemon thread purging expired sessions from the store every interval seconds.
+        """
+        if self.sweeper is None:
+            self.sweeper = TokenSweeper(self.store, interval)
+            self.sweeper.start()
+        return self.sweeper
+
+    def sweeperStats(self) -> dict:
+        if self.sweeper is None:
+            return {'enabled': False}
+        return {'enabled': True, **self.sweeper.stats()}
+
+    def cacheStats(self) -> dict:
+        if self.cache is None:
+            return {'enabled': False}
+        return {'enabled': True, **self.cache.stats()}
+
+    def _cacheSession(self, token: str, session: dict) -> None:
+        if self.cache is None:
+            return
+        expiresAt = min(session['ttl'], utcnow() + datetime.timedelta(seconds=self.cacheMaxAge))
+        self.cache.set(token, session, expiresAt)
+
+class TokenSweeper(threading.Thread):
+    """
+    Background thread that periodically removes expired sessions and revocations from a session store.
+
+    Attributes:
+        runs (int): Number of sweeps done.
+        purged (int): Total number of entries removed.
+        lastPurged (int): Entries removed by the last sweep.
+        lastRun (datetime): When the last sweep finished (naive UTC).
+        errors (int): Number of sweeps that failed.
+    """
+    def __init__(self, store: SessionStore, interval: int) -> None:
+        super().__init__(name='token-sweeper', daemon=True)
+        self.store = store
+        self.interval = interval
+        self.runs = 0
+        self.purged = 0
+        self.lastPurged = 0
+        self.lastRun = None
+        self.errors = 0
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.sweep()
+
+    def sweep(self) -> int:
+        try:
+            purged = self.store.purgeExpired()
+        except Exception as e:
+            self.errors += 1
+            print(f'Token sweep failed: {e}')
+            return 0
+        self.runs += 1
+        self.purged += purged
+        self.lastPurged = purged
+        self.lastRun = utcnow()
+        return purged
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def stats(self) -> dict:
+        return {
+            'interval': self.interval,
+            'runs': self.runs,
+            'purged': self.purged,
+            'lastPurged': self.lastPurged,
+            'lastRun': self.lastRun.isoformat() if self.lastRun is not None else None,
+            'errors': self.errors
+        }
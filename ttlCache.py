@@ -0,0 +1,81 @@
+import datetime
+import threading
+from collections import OrderedDict
+from typing import Any, Callable
+
+class TTLCache:
+    """
+    Bounded in-process cache where every entry carries its own expiry time.
+
+    Entries are kept in least-recently-used order; once the cache is full the oldest entry is evicted.
+    Expired entries are dropped lazily when they are read.
+
+    Attributes:
+        maxSize (int): Maximum number of entries kept in the cache.
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups that were not in the cache or had expired.
+        evictions (int): Number of entries dropped because the cache was full.
+    """
+    def __init__(self, maxSize: int = 1024, clock: Callable[[], datetime.datetime] = datetime.datetime.now) -> None:
+        """
+        Args:
+            maxSize (int, optional): Maximum number of entries. Defaults to 1024.
+            clock (Callable, optional): Function returning the current time, used to check expiry. Defaults to datetime.datetime.now.
+        """
+        self.maxSize = maxSize
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Any:
+        """
+        Returns the cached value for key, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expiresAt = entry
+            if expiresAt <= self.clock():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Any, value: Any, expiresAt: datetime.datetime) -> None:
+        """
+        Stores value under key until expiresAt, evicting the least recently used entry if the cache is full.
+        """
+        with self._lock:
+            self._entries[key] = (value, expiresAt)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Any) -> None:
+        """
+        Removes key from the cache if present.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxSize': self.maxSize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -1,29 +1,67 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, IndexModel, ASCENDING
 from user import User
 from pymongo.results import InsertOneResult, UpdateResult
 from pymongo.server_api import ServerApi
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
-from exceptions import UserNotFoundException
+from exceptions import UserNotFoundException, InvalidCursorException
+from pagination import paginate
+from passwordHasher import PasswordHasher
+from bulkImport import insertMany
 
 class UserHandler:
 
-    def __init__(self,db_name: str,  uri: str = None, connection: MongoClient = None) -> None:
+    # fields list endpoints can be ordered by
+    SORT_FIELDS = ['_id', 'email', 'name']
+    # active users have unique emails, deleted ones keep theirs without blocking it
+    INDEXES = [
+        IndexModel([('email', ASCENDING)], name='unique_active_email', unique=True, partialFilterExpression={'_isActive': True}),
+        # list endpoints only return active users
+        IndexModel([('_isActive', ASCENDING), ('_id', ASCENDING)], name='active')
+    ]
+
+    def __init__(self,db_name: str,  uri: str = None, connection: MongoClient = None, hasher: PasswordHasher = None) -> None:
         if connection is not None:
             self.connection = connection
         else:
             self.connection = MongoClient(uri, server_api=ServerApi('1'))
         self.db_name = db_name
+        self.hasher = hasher if hasher is not None else PasswordHasher()
 
     def userRegister(self,user: User) -> InsertOneResult:
+        """
+        Inserts the user, returning False if an active user already has its email (unique index on email).
+        """
         db = self.connection[self.db_name]
-        return db.users.insert_one(user.to_dict()).acknowledged
+        userJson = user.to_dict()
+        userJson['password'] = self.hasher.hash(user.password)
+        try:
+            return db.users.insert_one(userJson).acknowledged
+        except DuplicateKeyError:
+            return False
 
 
+    def userBulkRegister(self, users: list[User]) -> list[dict]:
+        """
+        Registers many users with one unordered insert_many, hashing their passwords in parallel on the hasher pool.
+        """
+        db = self.connection[self.db_name]
+        documents = [user.to_dict() for user in users]
+        for document, hashed in zip(documents, self.hasher.hashMany([user.password for user in users])):
+            document['password'] = hashed
+        return insertMany(db.users, documents, 'User already exists')
+
     def getUsers(self) -> list[User]:
         db = self.connection[self.db_name]
         result = db.users.find({'_isActive': True})	
         result = list(result)
         return result
+
+    def getUsersPage(self, limit: int, after: str = None, sort: str = '_id', descending: bool = False) -> tuple[list[dict], str | None]:
+        if sort not in self.SORT_FIELDS:
+            raise InvalidCursorException(f"Users cannot be sorted by {sort}")
+        db = self.connection[self.db_name]
+        return paginate(db.users, {'_isActive': True}, limit, after, sort, descending)
     
     def getUserByID(self, user_id) -> User:
         db = self.connection[self.db_name]
@@ -38,7 +76,8 @@ class UserHandler:
         user_id_object = ObjectId(user_id)
         userJson = user.to_dict()
         userJson['_id'] = user_id_object
-        print(userJson)
+        if not self.hasher.isHash(user.password):
+            userJson['password'] = self.hasher.hash(user.password)
         result = db.users.update_one({'_id': user_id_object}, {'$set': userJson})
         if result.modified_count > 0:
             return {'message': 'User updated successfully', 'updated_count': result.modified_count}
@@ -51,9 +90,16 @@ class UserHandler:
         user_id_object = ObjectId(user_id)
         return db.users.update_one({'_id': user_id_object}, {'$set': {'_isActive': False}})
     
+    def getUserByEmail(self, email) -> dict:
+        db = self.connection[self.db_name]
+        user = db.users.find_one({'email': email, '_isActive': True}, {'password': 0})
+        if user is None:
+            raise UserNotFoundException(f"User with email {email} not found")
+        return user
+
     def getUserRole(self, email) -> str:
         db = self.connection[self.db_name]
-        user = db.users.find_one({'email': email})
+        user = db.users.find_one({'email': email, '_isActive': True}, {'role': 1})
         if user is None:
             raise UserNotFoundException(f"User with email {email} not found")
         else:
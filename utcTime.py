@@ -0,0 +1,5 @@
+import datetime
+
+def utcnow() -> datetime.datetime:
+    # dates are stored as naive UTC datetimes, which is what MongoDB TTL indexes and the sale date queries compare against
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)